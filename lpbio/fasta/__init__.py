@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Code for fast summary statistics of FASTA sequence files.
+
+Files are memory-mapped and their bytes counted with NumPy, so that no
+Python code runs per sequence line or character, and many files can be
+summarised in parallel.
+"""
+
+import csv
+import gzip
+import mmap
+import os
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class FastaError(Exception):
+    """Exception raised when a file cannot be summarised as FASTA"""
+
+    def __init__(self, msg="Error in fasta module"):
+        """Instantiate class."""
+        Exception.__init__(self, msg)
+
+
+# factory class for the summary statistics of a FASTA file
+FastaStats = namedtuple(
+    "FastaStats",
+    "name path length contigs n50 largest gc n_fraction short_contigs short_length",
+)
+
+# Columns of a summary table, and the type of each
+SUMMARY_TYPES = (
+    ("name", str),
+    ("path", str),
+    ("length", int),
+    ("contigs", int),
+    ("n50", int),
+    ("largest", int),
+    ("gc", float),
+    ("n_fraction", float),
+    ("short_contigs", int),
+    ("short_length", int),
+)
+
+# Bytes counted in sequence, after folding to lower case
+BASES = b"acgtn"
+
+# Bytes up to and including space are whitespace (or control characters),
+# which are not sequence
+WHITESPACE_MAX = ord(" ")
+
+# Number of bytes counted at a time, small enough that the working arrays
+# stay in the CPU cache
+CHUNK_SIZE = 1 << 18
+
+
+def read_bytes(path):
+    """Return a read-only buffer of the (decompressed) content of the file.
+
+    Plain files are memory-mapped; gzip-compressed (.gz) files are read
+    into memory, as they cannot be mapped.
+    """
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as ifh:
+            return ifh.read()
+    with open(path, "rb") as ifh:
+        if not os.fstat(ifh.fileno()).st_size:
+            return b""
+        return mmap.mmap(ifh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def count_bases(data):
+    """Return counts of each of BASES, in either case, in the passed data.
+
+    - data           NumPy uint8 array
+
+    The data are counted a chunk at a time, reusing the same working arrays,
+    which is several times faster than np.bincount() on large arrays.
+    """
+    counts = np.zeros(len(BASES), dtype=np.int64)
+    folded = np.empty(min(len(data), CHUNK_SIZE), dtype=np.uint8)
+    matches = np.empty(len(folded), dtype=bool)
+    for offset in range(0, len(data), CHUNK_SIZE):
+        chunk = data[offset : offset + CHUNK_SIZE]
+        size = len(chunk)
+        np.bitwise_or(chunk, 0x20, out=folded[:size])  # Fold to lower case
+        for idx, base in enumerate(BASES):
+            np.equal(folded[:size], base, out=matches[:size])
+            counts[idx] += np.count_nonzero(matches[:size])
+    return counts
+
+
+def contig_lengths(data):
+    """Return sequence lengths, and header line spans, for FASTA data.
+
+    - data           NumPy uint8 array of FASTA file content
+
+    Header lines start with '>'; whitespace is not sequence. Header spans
+    are returned as arrays of start and end (exclusive) positions.
+    """
+    gt = np.flatnonzero(data == ord(">"))
+    starts = gt[(gt == 0) | (data[gt - 1] == ord("\n"))]
+    if not len(starts):
+        raise FastaError("No FASTA header lines found")
+    lineends = np.append(np.flatnonzero(data == ord("\n")), len(data))
+    ends = lineends[np.searchsorted(lineends, starts)]
+
+    # Each contig's sequence lies between the end of its header and the next
+    # header, less any whitespace there
+    nexts = np.append(starts[1:], len(data))
+    whitespace = np.flatnonzero(data <= WHITESPACE_MAX)
+    spaces = np.searchsorted(whitespace, nexts) - np.searchsorted(whitespace, ends)
+    return nexts - ends - spaces, starts, ends
+
+
+def n50(lengths):
+    """Return the N50 of the passed sequence lengths.
+
+    This is the length of the shortest sequence in the smallest set of
+    longest sequences that covers at least half the total length.
+    """
+    if not len(lengths) or not lengths.sum():
+        return 0
+    lengths = np.sort(lengths)[::-1]
+    cumulative = np.cumsum(lengths)
+    return int(lengths[np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+
+def fasta_stats(path, mincontiglen=200, name=None):
+    """Return a FastaStats summary of the passed FASTA file.
+
+    - path           Path to (optionally gzip-compressed) FASTA file
+    - mincontiglen   Integer, contigs shorter than this are counted as short
+    - name           String, name for the file (default, the file stem)
+
+    gc is the fraction of G and C among unambiguous bases, and n_fraction
+    the fraction of all sequence that is N.
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if path.endswith(".gz"):
+            name = os.path.splitext(name)[0]
+    buffer = read_bytes(path)
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if not len(data):
+        raise FastaError("{} is empty".format(path))
+    try:
+        lengths, starts, ends = contig_lengths(data)
+    except FastaError as exc:
+        raise FastaError("{}: {}".format(path, exc))
+
+    # Count bases in the whole file, less those in header lines, and in any
+    # text before the first header
+    widths = ends - starts
+    offsets = np.repeat(starts - (np.cumsum(widths) - widths), widths)
+    headers = data[np.arange(widths.sum()) + offsets]
+    counts = count_bases(data) - count_bases(data[: starts[0]]) - count_bases(headers)
+    del data  # Release the buffer, so that it can be closed
+    if isinstance(buffer, mmap.mmap):
+        buffer.close()
+
+    length = int(lengths.sum())
+    acgt = int(counts[:4].sum())
+    short = lengths < int(mincontiglen)
+    return FastaStats(
+        name=name,
+        path=path,
+        length=length,
+        contigs=len(lengths),
+        n50=n50(lengths),
+        largest=int(lengths.max()),
+        gc=int(counts[1] + counts[2]) / acgt if acgt else 0.0,
+        n_fraction=int(counts[4]) / length if length else 0.0,
+        short_contigs=int(short.sum()),
+        short_length=int(lengths[short].sum()),
+    )
+
+
+def summarise_fastas(paths, mincontiglen=200, workers=None):
+    """Return a list of FastaStats for the passed FASTA files, in order.
+
+    - paths          Iterable of paths to FASTA files
+    - mincontiglen   Integer, contigs shorter than this are counted as short
+    - workers        Number of files to summarise at once (default, one per
+                     core); NumPy releases the GIL while counting, so
+                     threads run in parallel
+
+    Raises FastaError if any file cannot be summarised.
+    """
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda path: fasta_stats(path, mincontiglen), paths))
+
+
+def write_summary(stats, path):
+    """Write the FastaStats to path, as a tab-separated table."""
+    with open(path, "w", newline="") as ofh:
+        writer = csv.writer(ofh, delimiter="\t")
+        writer.writerow(FastaStats._fields)
+        writer.writerows(stats)
+
+
+def read_summary(path):
+    """Return a list of FastaStats read from a table written by write_summary()."""
+    with open(path, "r", newline="") as ifh:
+        reader = csv.DictReader(ifh, delimiter="\t")
+        return [
+            FastaStats(**{key: typ(row[key]) for key, typ in SUMMARY_TYPES})
+            for row in reader
+        ]
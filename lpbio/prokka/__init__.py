@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""Code for combining the output of many prokka runs into one table.
+
+Each prokka output directory's feature table (<prefix>.tsv) and summary
+(<prefix>.txt) are parsed in parallel worker processes, and combined into
+one columnar annotation table, written as a NumPy .npz archive. Text
+columns with repeated values (genome, feature type, gene, EC number, COG
+and product) are stored as integer codes into a table of categories, so
+the archive is compact, and loads without unpickling any Python objects.
+"""
+
+import itertools
+import os
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from operator import methodcaller
+
+import numpy as np
+
+
+class ProkkaOutputError(Exception):
+    """Exception raised when a prokka output directory cannot be parsed"""
+
+    def __init__(self, msg="Error in prokka module"):
+        """Instantiate class."""
+        Exception.__init__(self, msg)
+
+
+# Text columns stored as categories, with the prokka .tsv header of each
+CATEGORICAL_COLUMNS = (
+    ("ftype", "ftype"),
+    ("gene", "gene"),
+    ("ec_number", "EC_number"),
+    ("cog", "COG"),
+    ("product", "product"),
+)
+
+# Value of the length column where prokka did not report a length (before
+# prokka 1.13)
+UNKNOWN_LENGTH = -1
+
+# factory class for the parsed output of one prokka run. locus_tags is an
+# array of bytes, and columns maps each categorical column name to a
+# (codes, categories) tuple, local to the run
+ProkkaOutput = namedtuple(
+    "ProkkaOutput", "genome locus_tags lengths columns contigs bases"
+)
+
+
+class Categorical(namedtuple("Categorical", "codes categories")):
+    """A column of integer codes into an array of category values"""
+
+    __slots__ = ()
+
+    def values(self):
+        """Return the column's values as an array"""
+        return self.categories[self.codes]
+
+
+def find_prokka_outputs(root):
+    """Yield prokka output directories under root, relative to root.
+
+    Output directories are those holding a feature table (.tsv file).
+    Symbolic links to directories are not followed, so that a link cannot
+    make the search loop forever.
+    """
+    dirs = [""]
+    while dirs:
+        reldir = dirs.pop()
+        with os.scandir(os.path.join(root, reldir)) as entries:
+            entries = list(entries)
+        if any(entry.name.endswith(".tsv") and entry.is_file() for entry in entries):
+            yield reldir
+        dirs.extend(
+            os.path.join(reldir, entry.name)
+            for entry in entries
+            if entry.is_dir(follow_symlinks=False)
+        )
+
+
+def encode(values):
+    """Return integer codes and categories for the passed list of values
+
+    Categories are in order of first appearance. The lookups are made with
+    C-level builtins (dict.fromkeys(), map()), which is several times faster
+    than a Python loop.
+    """
+    categories = list(dict.fromkeys(values))
+    index = {value: code for code, value in enumerate(categories)}
+    codes = np.fromiter(
+        map(index.__getitem__, values), dtype=np.int32, count=len(values)
+    )
+    return codes, categories
+
+
+def text_array(values):
+    """Return the strings as a NumPy bytes array, encoded as UTF-8"""
+    return np.array([value.encode("utf-8") for value in values], dtype=bytes)
+
+
+def split_columns(lines, width):
+    """Return a list of the columns of the passed tab-separated lines.
+
+    Where every line has width fields, as in prokka's output, all lines are
+    split in one call, and the columns sliced out; otherwise each line is
+    split, and padded or truncated to width fields.
+    """
+    if set(map(methodcaller("count", "\t"), lines)) <= {width - 1}:
+        fields = "\t".join(lines).split("\t") if lines else []
+    else:
+        padding = [""] * width
+        rows = [(line.split("\t") + padding)[:width] for line in lines]
+        fields = [field for row in rows for field in row]
+    return [fields[idx::width] for idx in range(width)]
+
+
+def parse_prokka_output(outdir, genome=None):
+    """Return a ProkkaOutput parsed from a prokka output directory.
+
+    - outdir         Path to prokka output directory
+    - genome         String, genome name (default, outdir's name)
+    """
+    if genome is None:
+        genome = os.path.basename(os.path.normpath(outdir))
+    tables = [fname for fname in os.listdir(outdir) if fname.endswith(".tsv")]
+    if len(tables) != 1:
+        raise ProkkaOutputError(
+            "Expected one .tsv file in {}, found {}".format(outdir, len(tables))
+        )
+    with open(os.path.join(outdir, tables[0]), "r", encoding="utf-8") as ifh:
+        headers = ifh.readline().rstrip("\n").split("\t")
+        lines = ifh.read().splitlines()
+    if "locus_tag" not in headers:
+        raise ProkkaOutputError("{} has no locus_tag column".format(tables[0]))
+    data = dict(zip(headers, split_columns(lines, len(headers))))
+    empty = [""] * len(lines)
+
+    if "length_bp" in data:
+        lengths = np.array(
+            [int(value) if value else UNKNOWN_LENGTH for value in data["length_bp"]],
+            dtype=np.int32,
+        )
+    else:
+        lengths = np.full(len(lines), UNKNOWN_LENGTH, dtype=np.int32)
+
+    # Contig and base counts from the run summary, where there is one
+    summary = {}
+    stem = os.path.join(outdir, os.path.splitext(tables[0])[0])
+    if os.path.isfile(stem + ".txt"):
+        with open(stem + ".txt", "r", encoding="utf-8") as ifh:
+            for line in ifh:
+                key, _, value = line.partition(":")
+                summary[key.strip()] = value.strip()
+
+    return ProkkaOutput(
+        genome=genome,
+        locus_tags=text_array(data["locus_tag"]),
+        lengths=lengths,
+        columns={
+            name: encode(data.get(header, empty))
+            for name, header in CATEGORICAL_COLUMNS
+        },
+        contigs=int(summary.get("contigs", 0)),
+        bases=int(summary.get("bases", 0)),
+    )
+
+
+def parse_in_dir(args):
+    """Parse the prokka output at a path relative to a root directory.
+
+    - args           Tuple of (root, relative path), as passed by
+                     ProcessPoolExecutor.map()
+    """
+    root, reldir = args
+    return parse_prokka_output(os.path.join(root, reldir), reldir or None)
+
+
+def aggregate_prokka_outputs(root, outfile, workers=None, chunksize=8):
+    """Parse all prokka output directories under root into one table.
+
+    - root           Path to directory holding prokka output directories
+                     (e.g. the output directory of bulk_prokka)
+    - outfile        Path to write the table (a NumPy .npz archive)
+    - workers        Number of worker processes (default, one per core)
+    - chunksize      Number of directories passed to a worker at a time
+
+    Each genome is named by the path of its output directory relative to
+    root. Returns the number of genomes and of features in the table.
+    """
+    reldirs = sorted(find_prokka_outputs(root))
+    locus_tags, lengths, genome_codes = [], [], []  # Arrays for each genome
+    genomes, contigs, bases = [], [], []
+    codes = {name: [] for name, _ in CATEGORICAL_COLUMNS}
+    categories = {name: {} for name, _ in CATEGORICAL_COLUMNS}
+
+    # Parsing is done by worker processes; each run's local category codes
+    # are mapped onto the combined categories as its results arrive
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsed = executor.map(
+            parse_in_dir, [(root, reldir) for reldir in reldirs], chunksize=chunksize
+        )
+        for output in parsed:
+            genome_codes.append(
+                np.full(len(output.lengths), len(genomes), dtype=np.int32)
+            )
+            genomes.append(output.genome)
+            contigs.append(output.contigs)
+            bases.append(output.bases)
+            locus_tags.append(output.locus_tags)
+            lengths.append(output.lengths)
+            for name, (local_codes, local_categories) in output.columns.items():
+                index = categories[name]
+                new = [value for value in local_categories if value not in index]
+                index.update(zip(new, itertools.count(len(index))))
+                mapping = np.fromiter(
+                    map(index.__getitem__, local_categories),
+                    dtype=np.int32,
+                    count=len(local_categories),
+                )
+                codes[name].append(mapping[local_codes])
+
+    def concatenate(arrays, dtype):
+        """Concatenate the arrays, allowing for there being none"""
+        return np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+
+    table = {
+        "locus_tag": concatenate(locus_tags, bytes),
+        "length": concatenate(lengths, np.int32),
+        "genome_codes": concatenate(genome_codes, np.int32),
+        "genome_categories": text_array(genomes),
+        "genome_contigs": np.array(contigs, dtype=np.int64),
+        "genome_bases": np.array(bases, dtype=np.int64),
+    }
+    for name, _ in CATEGORICAL_COLUMNS:
+        table[name + "_codes"] = concatenate(codes[name], np.int32)
+        table[name + "_categories"] = text_array(categories[name])
+    with open(outfile, "wb") as ofh:
+        np.savez(ofh, **table)
+    return len(genomes), len(table["length"])
+
+
+def load_annotations(path):
+    """Return the annotation table written by aggregate_prokka_outputs().
+
+    Returns a dictionary of columns: "locus_tag" (array of bytes) and
+    "length" (array of ints, UNKNOWN_LENGTH where not known) are arrays
+    with one value per feature; "genome", "ftype", "gene", "ec_number",
+    "cog" and "product" are Categorical columns; and "contigs" and "bases"
+    are arrays with one value per genome, in the order of the genome
+    column's categories.
+    """
+    with np.load(path, allow_pickle=False) as archive:
+        table = {
+            "locus_tag": archive["locus_tag"],
+            "length": archive["length"],
+            "contigs": archive["genome_contigs"],
+            "bases": archive["genome_bases"],
+        }
+        for name in ["genome"] + [name for name, _ in CATEGORICAL_COLUMNS]:
+            table[name] = Categorical(
+                archive[name + "_codes"],
+                np.char.decode(archive[name + "_categories"], "utf-8"),
+            )
+    return table
+
+
+def feature_counts(table):
+    """Return counts of each feature type in each genome of a loaded table.
+
+    Returns a (genomes x feature types) array, with rows in the order of the
+    genome column's categories, and columns in the order of the ftype
+    column's categories.
+    """
+    genome, ftype = table["genome"], table["ftype"]
+    shape = (len(genome.categories), len(ftype.categories))
+    combined = genome.codes.astype(np.int64) * shape[1] + ftype.codes
+    return np.bincount(combined, minlength=shape[0] * shape[1]).reshape(shape)
@@ -10,7 +10,32 @@ SGE_WAIT = 0.01
 
 
 class Job:
-    """Individual job to be run, with list of dependencies."""
+    """Individual job to be run, with list of dependencies.
+
+    Jobs have slots rather than a per-instance __dict__, to keep memory use
+    down in very large workflows; see JobTable for compact serialisation.
+    """
+
+    __slots__ = (
+        "name",
+        "queue",
+        "command",
+        "script",
+        "scriptPath",
+        "scriptpath",
+        "scriptargs",
+        "out",
+        "err",
+        "dependencies",
+        "submitted",
+        "jobid",
+        "_exit_codes",
+        "submit_time",
+        "_task_times",
+        "finished",
+        "priority",
+        "__weakref__",
+    )
 
     def __init__(self, name, command, queue=None):
         """Instantiate a Job object.
@@ -24,9 +49,40 @@ class Job:
         self.command = command  # Command line to run for this job
         self.script = command
         self.scriptPath = None  # Will hold path to the script file
+        self.scriptpath = None  # Path to the script file, once built
+        self.scriptargs = []  # Arguments passed to the script file
+        self.out = None  # stdout and stderr directories, once submitted
+        self.err = None
         self.dependencies = []  # List of jobs to be completed first
         self.submitted = False  # Flag: is job submitted?
+        self.jobid = None  # SGE job ID, assigned on submission
+        self._exit_codes = None  # Exit code of each task (see exit_codes)
+        self.submit_time = None  # Time (s since epoch) of submission to SGE
+        self._task_times = None  # Start and finish times of tasks (see task_times)
         self.finished = False
+        self.priority = None  # SGE priority (qsub -p), if set
+
+    @property
+    def exit_codes(self):
+        """Exit code of each task, keyed by task ID (created on first use)."""
+        if self._exit_codes is None:
+            self._exit_codes = {}
+        return self._exit_codes
+
+    @exit_codes.setter
+    def exit_codes(self, value):
+        self._exit_codes = value
+
+    @property
+    def task_times(self):
+        """Start and finish times of each task, keyed by task ID."""
+        if self._task_times is None:
+            self._task_times = {}
+        return self._task_times
+
+    @task_times.setter
+    def task_times(self, value):
+        self._task_times = value
 
     def add_dependency(self, job):
         """Add passed job to the dependency list for this Job.
@@ -46,7 +102,7 @@ class Job:
 
     def wait(self, interval=SGE_WAIT):
         """Wait until the job finishes, and poll SGE on its status."""
-        args = ["qstat", "-j", self.name]
+        args = ["qstat", "-j", self.name if self.jobid is None else self.jobid]
         self.finished = False
         while not self.finished:
             pipe = subprocess.Popen(args, stdout=subprocess.PIPE)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""JobBundle class for running several short jobs as one scheduler task"""
+
+from .Job import Job
+
+
+class JobBundle(Job):
+    """Job that runs the scripts of several other jobs in a single task.
+
+    The bundled jobs must not depend on each other. The bundle exits with
+    status 1 if any bundled job fails, and 0 otherwise.
+    """
+
+    __slots__ = ("members", "width")
+
+    def __init__(self, name, jobs, width=1, queue=None):
+        """Instantiate a JobBundle object.
+
+        - name           String describing the bundle (uniquely)
+        - jobs           Iterable of Job objects to be run in the bundle
+        - width          Integer, number of bundled jobs to run at once
+        - queue          String, the SGE queue under which the bundle shall run
+        """
+        self.members = list(jobs)  # Jobs run by this bundle
+        self.width = max(width, 1)
+        Job.__init__(self, name, self.build_command(), queue)
+
+    def build_command(self):
+        """Return shell code running the bundled jobs' scripts.
+
+        Each bundled script runs in its own subshell. With a width above one,
+        scripts are started in batches of that many, and each batch is waited
+        on before the next starts.
+        """
+        lines = ["PYSGE_BUNDLE_STATUS=0"]
+        for start in range(0, len(self.members), self.width):
+            batch = self.members[start : start + self.width]
+            if self.width == 1:
+                lines.append(
+                    "(\n{}\n) || PYSGE_BUNDLE_STATUS=1".format(batch[0].script)
+                )
+                continue
+            lines.append("PYSGE_BUNDLE_PIDS=()")
+            for member in batch:
+                lines.append("(\n{}\n) &".format(member.script))
+                lines.append("PYSGE_BUNDLE_PIDS+=($!)")
+            lines.append(
+                'for pid in "${PYSGE_BUNDLE_PIDS[@]}"; do '
+                'wait "$pid" || PYSGE_BUNDLE_STATUS=1; done'
+            )
+        lines.append("exit $PYSGE_BUNDLE_STATUS")
+        return "\n".join(lines)
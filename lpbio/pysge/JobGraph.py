@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""JobGraph class for ordering Job dependencies for submission"""
+
+from .exceptions import PySGEException
+
+
+class JobGraph:
+    """Dependency graph of Job/JobGroup objects.
+
+    The graph is built, and ordered for submission, in time linear in the
+    number of jobs plus the number of dependencies.
+    """
+
+    def __init__(self, jobs):
+        """Instantiate a JobGraph object.
+
+        - jobs           Iterable of Job/JobGroup objects
+
+        Every dependency of a passed job must either be passed itself, or
+        already have been submitted; otherwise a PySGEException is raised.
+        """
+        self.jobs = []  # Jobs in the graph, in the order they were passed
+        self.index = {}  # Index of each job in self.jobs, keyed by id()
+        for job in jobs:
+            if id(job) not in self.index:
+                self.index[id(job)] = len(self.jobs)
+                self.jobs.append(job)
+
+        # Adjacency list from each job to the jobs that depend on it, and
+        # count of unsatisfied dependencies for each job
+        self.dependents = [[] for _ in self.jobs]
+        self.indegree = [0] * len(self.jobs)
+        for idx, job in enumerate(self.jobs):
+            for dep in job.dependencies:
+                try:
+                    self.dependents[self.index[id(dep)]].append(idx)
+                except KeyError:
+                    if dep.submitted:  # Dependency is already with the scheduler
+                        continue
+                    raise PySGEException(
+                        "Job {} depends on job {}, which was not submitted".format(
+                            job.name, dep.name
+                        )
+                    )
+                self.indegree[idx] += 1
+
+    def __len__(self):
+        """Return the number of jobs in the graph."""
+        return len(self.jobs)
+
+    def waves(self):
+        """Return jobs as a list of waves, in topological order.
+
+        Each wave is a list of jobs that depend only on jobs in earlier waves,
+        so all jobs in a wave may be submitted together. A PySGEException is
+        raised if the dependencies contain a cycle.
+        """
+        indegree = list(self.indegree)
+        wave = [idx for idx, degree in enumerate(indegree) if degree == 0]
+        waves, ordered = [], 0
+        while wave:
+            waves.append([self.jobs[idx] for idx in wave])
+            ordered += len(wave)
+            nextwave = []
+            for idx in wave:
+                for child in self.dependents[idx]:
+                    indegree[child] -= 1
+                    if indegree[child] == 0:
+                        nextwave.append(child)
+            wave = nextwave
+
+        if ordered < len(self.jobs):
+            cyclic = [job.name for job, degree in zip(self.jobs, indegree) if degree]
+            raise PySGEException(
+                "Job dependencies contain a cycle involving {} jobs: {}".format(
+                    len(cyclic), ", ".join(cyclic[:10])
+                )
+            )
+        return waves
+
+    def order(self):
+        """Return list of jobs in topological order."""
+        return [job for wave in self.waves() for job in wave]
+
+    def remaining_times(self, durations):
+        """Return the remaining critical-path length of each job.
+
+        - durations      List of the (estimated) duration of each job, in the
+                         order of self.jobs
+
+        The remaining critical-path length of a job is its duration plus the
+        longest remaining critical-path length of any job that depends on
+        it: the least time from the job starting to the whole workflow
+        finishing. Values are returned in the order of self.jobs.
+        """
+        remaining = list(durations)
+        for job in reversed(self.order()):
+            idx = self.index[id(job)]
+            if self.dependents[idx]:
+                remaining[idx] += max(
+                    remaining[child] for child in self.dependents[idx]
+                )
+        return remaining
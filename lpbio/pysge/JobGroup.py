@@ -1,18 +1,79 @@
 # -*- coding: utf-8 -*-
 """JobGroup class for SGE-like scheduler interactions"""
 
+import os
 import shlex
 import subprocess
+import tempfile
 import time
 
+from functools import reduce
+
+from .exceptions import PySGEException
+
 # Base unit of time (s) to wait between polling SGE
 SGE_WAIT = 0.01
 
+# Width of each record in a sweep index file: a 16-digit byte offset and a
+# 15-digit length in the values file, then a newline
+SWEEP_INDEX_RECORD = "{:016d}{:015d}\n"
+SWEEP_INDEX_WIDTH = 32
+
+# Shell function that prints value <index> from sweep table <path>, reading
+# only the index record and the value itself (tail -c + seeks in regular
+# files), so that lookup time does not grow with the size of the table
+SWEEP_READER = """pysge_sweep_value() {
+    local record
+    record=$(tail -c +$(($2 * %d + 1)) "$1.index" | head -c %d)
+    tail -c +$((10#${record:0:16} + 1)) "$1.values" | head -c $((10#${record:16}))
+}
+""" % (
+    SWEEP_INDEX_WIDTH,
+    SWEEP_INDEX_WIDTH - 1,
+)
+
 
 class JobGroup:
-    """Class that stores a group of jobs, permitting parameter sweeps."""
+    """Class that stores a group of jobs, permitting parameter sweeps.
+
+    As for Job, attributes are held in slots.
+    """
+
+    __slots__ = (
+        "name",
+        "queue",
+        "command",
+        "script",
+        "scriptpath",
+        "scriptargs",
+        "out",
+        "err",
+        "dependencies",
+        "taskids",
+        "submitted",
+        "jobid",
+        "_exit_codes",
+        "submit_time",
+        "_task_times",
+        "finished",
+        "priority",
+        "sweepdir",
+        "sweep",
+        "max_running",
+        "arguments",
+        "tasks",
+        "__weakref__",
+    )
 
-    def __init__(self, name, command, queue=None, arguments=None):
+    def __init__(
+        self,
+        name,
+        command,
+        queue=None,
+        arguments=None,
+        sweep="product",
+        max_running=None,
+    ):
         """Instantiate a JobGroup object.
 
         JobGroups allow for the use of combinatorial parameter sweeps by
@@ -25,6 +86,12 @@ class JobGroup:
         - arguments         Dictionary, the values for each parameter as
                             lists of strings, keyed by an identifier for
                             the command string
+        - sweep             String, "product" to run all combinations of the
+                            parameter values, or "zip" to pair the nth
+                            values of every parameter (all lists must then
+                            be the same length)
+        - max_running       Integer, maximum number of tasks that SGE may
+                            run at once (qsub -tc), or None for no limit
 
         For example, to use a command 'my_cmd' with the arguments
         '-foo' and '-bar' having values 1, 2, 3, 4 and 'a', 'b', 'c', 'd' in
@@ -32,55 +99,149 @@ class JobGroup:
         command='my_cmd $SGE_TASK_ID -foo $fooargs -bar $barargs'
         arguments='{'fooargs': ['1','2','3','4'],
                     'barargs': ['a','b','c','d']}
+
+        Values are shell words, as they would be written in a bash array, so
+        values containing spaces or special characters should be quoted
+        (e.g. with shlex.quote()).
         """
         self.name = shlex.quote(name.replace(" ", "_"))  # Set JobQueue name
         self.queue = queue  # Set SGE queue to request
         self.command = command  # Set command string
         self.dependencies = []  # Create empty list for dependencies
+        self.scriptpath = None  # Path to the script file, once built
+        self.scriptargs = []  # Arguments passed to the script file
+        self.out = None  # stdout and stderr directories, once submitted
+        self.err = None
+        self.taskids = None  # Task IDs to run, if not all (see pysge.retry_failed_jobs)
         self.submitted = False  # Set submitted Boolean
+        self.jobid = None  # SGE job ID, assigned on submission
+        self._exit_codes = None  # Exit code of each task (see exit_codes)
+        self.submit_time = None  # Time (s since epoch) of submission to SGE
+        self._task_times = None  # Start and finish times of tasks (see task_times)
         self.finished = False
+        self.priority = None  # SGE priority (qsub -p), if set
+        self.sweepdir = None  # Directory holding sweep tables, once written
+        if sweep not in ("product", "zip"):
+            raise PySGEException("Unknown sweep type: {}".format(sweep))
+        self.sweep = sweep
+        self.max_running = max_running  # Limit on concurrent tasks
         if arguments is not None:
             self.arguments = arguments  # Dictionary of arguments for command
         else:
             self.arguments = {}
+        self.tasks = self.count_tasks()  # Number of tasks in this group
         self.generate_script()  # Make SGE script for sweep/array
 
+    def count_tasks(self):
+        """Return the number of tasks needed to run the parameter sweep."""
+        counts = [len(values) for values in self.arguments.values()]
+        if self.sweep == "product":
+            return reduce(lambda total, count: total * count, counts, 1)
+        if len(set(counts)) > 1:
+            raise PySGEException(
+                "Zipped sweep {} has parameter lists of different lengths".format(
+                    self.name
+                )
+            )
+        return counts[0] if counts else 1
+
     def generate_script(self):
-        """Create the SGE script that will run the jobs in the JobGroup."""
-        self.script = ""  # Holds the script string
-        total = 1  # total number of jobs in this group
+        """Create the SGE script that will run the jobs in the JobGroup.
 
+        Until sweep tables are written (see write_sweep()), parameter values
+        are inlined into the script as bash arrays. Once written, each task
+        reads only its own values from the tables, so that the script stays
+        small however many values there are.
+        """
         # for now, SGE_TASK_ID becomes TASK_ID, but we base it at zero
-        self.script += """let "TASK_ID=$SGE_TASK_ID - 1"\n"""
-
-        # build the array definitions
-        for key in sorted(self.arguments.keys()):
-            # The keys are sorted for py3.5 compatibility with tests
-            values = self.arguments[key]
-            line = "%s_ARRAY=( " % (key)
-            for value in values:
-                line += value
-                line += " "
-            line += " )\n"
-            self.script += line
-            total *= len(values)
-        self.script += "\n"
-
-        # now, build the decoding logic in the script
-        for key in sorted(self.arguments.keys()):
-            # The keys are sorted for py3.5 compatibility with tests
-            count = len(self.arguments[key])
-            self.script += """let "%s_INDEX=$TASK_ID %% %d"\n""" % (key, count)
-            self.script += """%s=${%s_ARRAY[$%s_INDEX]}\n""" % (key, key, key)
-            self.script += """let "TASK_ID=$TASK_ID / %d"\n""" % (count)
+        lines = ['let "TASK_ID=$SGE_TASK_ID - 1"']
+        # The keys are sorted for py3.5 compatibility with tests
+        keys = sorted(self.arguments.keys())
+
+        # build the array definitions, or the table reader
+        if self.sweepdir is None:
+            for key in keys:
+                lines.append("%s_ARRAY=( %s  )" % (key, " ".join(self.arguments[key])))
+        else:
+            lines.append(SWEEP_READER)
+        lines.append("")
+
+        # now, build the decoding logic in the script. In a product sweep,
+        # the value index for each key is one digit of TASK_ID in a mixed
+        # radix; in a zipped sweep, all keys share the same index
+        for key in keys:
+            if self.sweep == "product":
+                count = len(self.arguments[key])
+                lines.append('let "%s_INDEX=$TASK_ID %% %d"' % (key, count))
+            else:
+                lines.append('let "%s_INDEX=$TASK_ID"' % key)
+            if self.sweepdir is None:
+                lines.append("%s=${%s_ARRAY[$%s_INDEX]}" % (key, key, key))
+            else:
+                table = shlex.quote(os.path.join(self.sweepdir, key))
+                lines.append(
+                    'eval "%s=$(pysge_sweep_value %s $%s_INDEX)"' % (key, table, key)
+                )
+            if self.sweep == "product":
+                lines.append('let "TASK_ID=$TASK_ID / %d"' % count)
 
         # now, add the command to run the job
-        self.script += "\n"
-        self.script += self.command
-        self.script += "\n"
+        lines.extend(["", self.command, ""])
+        self.script = "\n".join(lines)
+
+    def write_sweep(self, sweepdir):
+        """Write the parameter values to sweep tables in the passed directory.
+
+        Each parameter is written as a pair of files: <key>.values holds the
+        values, one per line, and <key>.index holds a fixed-width record of
+        the offset and length of each value, so that a task can read any
+        value directly. Each file is written under a temporary name, then
+        renamed into place, so a task never reads a partly-written table.
+        The script is regenerated to read from the tables.
+
+        - sweepdir          Path to the directory to hold the sweep tables
+        """
+        sweepdir = os.path.abspath(sweepdir)
+        os.makedirs(sweepdir, exist_ok=True)
+        for key, values in self.arguments.items():
+            path = os.path.join(sweepdir, key)
+            value_fd, valuepath = tempfile.mkstemp(dir=sweepdir, prefix=".values_")
+            index_fd, indexpath = tempfile.mkstemp(dir=sweepdir, prefix=".index_")
+            offset = 0
+            with os.fdopen(value_fd, "wb") as valuefh, os.fdopen(
+                index_fd, "w"
+            ) as indexfh:
+                for value in values:
+                    encoded = value.encode("utf-8")
+                    valuefh.write(encoded + b"\n")
+                    indexfh.write(SWEEP_INDEX_RECORD.format(offset, len(encoded)))
+                    offset += len(encoded) + 1
+            os.replace(valuepath, path + ".values")
+            os.replace(indexpath, path + ".index")
+        self.sweepdir = sweepdir
+        self.generate_script()
+
+    @property
+    def exit_codes(self):
+        """Exit code of each task, keyed by task ID (created on first use)."""
+        if self._exit_codes is None:
+            self._exit_codes = {}
+        return self._exit_codes
+
+    @exit_codes.setter
+    def exit_codes(self, value):
+        self._exit_codes = value
+
+    @property
+    def task_times(self):
+        """Start and finish times of each task, keyed by task ID."""
+        if self._task_times is None:
+            self._task_times = {}
+        return self._task_times
 
-        # set the number of tasks in this group
-        self.tasks = total
+    @task_times.setter
+    def task_times(self, value):
+        self._task_times = value
 
     def add_dependency(self, job):
         """Add the passed job to the dependency list for this JobGroup.
@@ -101,7 +262,7 @@ class JobGroup:
 
     def wait(self, interval=SGE_WAIT):
         """Wait for a defined period, then poll SGE for job status."""
-        args = ["qstat", "-j", self.name]
+        args = ["qstat", "-j", self.name if self.jobid is None else self.jobid]
         self.finished = False
         while not self.finished:
             pipe = subprocess.Popen(args, stdout=subprocess.PIPE)
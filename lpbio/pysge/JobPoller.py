@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""JobPoller class for batched status polling of SGE-like schedulers"""
+
+import asyncio
+import shutil
+import subprocess
+import time
+
+from collections import namedtuple
+from xml.etree import ElementTree
+
+# Base unit of time (s) to wait between polling SGE
+SGE_WAIT = 0.01
+
+# Upper bound (s) on the time between polls of SGE
+SGE_MAX_WAIT = 60
+
+# Default location for qstat executable
+QSTAT_DEFAULT = shutil.which("qstat")
+if QSTAT_DEFAULT is None:
+    QSTAT_DEFAULT = "qstat"
+
+# factory class for a single job (or array task range) reported by qstat
+QstatRecord = namedtuple("QstatRecord", "jobid name state tasks")
+
+
+def parse_qstat_xml(text):
+    """Return list of QstatRecords describing jobs in qstat -xml output.
+
+    - text       String (or bytes), output of qstat -xml
+
+    Running array tasks are reported one record per task; pending array
+    tasks are reported as a single record with a task range such as 3-10:1.
+    """
+    root = ElementTree.fromstring(text)
+    records = []
+    for joblist in root.iter("job_list"):
+        records.append(
+            QstatRecord(
+                joblist.findtext("JB_job_number"),
+                joblist.findtext("JB_name"),
+                joblist.findtext("state"),
+                joblist.findtext("tasks"),
+            )
+        )
+    return records
+
+
+class JobPoller:
+    """Tracks completion of many jobs with one qstat query per cycle.
+
+    Jobs are identified by their SGE job ID where this is known, and by name
+    otherwise.
+    """
+
+    def __init__(
+        self, jobs, interval=SGE_WAIT, max_interval=SGE_MAX_WAIT, qstat=QSTAT_DEFAULT
+    ):
+        """Instantiate a JobPoller object.
+
+        - jobs           Iterable of Job/JobGroup objects to be tracked
+        - interval       Float, initial time (s) between polls
+        - max_interval   Float, upper bound on time (s) between polls; this
+                         bounds the delay before a finished job is noticed
+        - qstat          String, path to the qstat executable
+        """
+        self.jobs = list(jobs)
+        self.interval = interval
+        self.max_interval = max_interval
+        self.qstat = qstat
+
+    @property
+    def active(self):
+        """Jobs that have not yet been seen to finish."""
+        return [job for job in self.jobs if not job.finished]
+
+    def track(self, job):
+        """Track the passed job, in addition to those already tracked."""
+        self.jobs.append(job)
+
+    def query(self):
+        """Return QstatRecords for all of the user's jobs, or None on failure.
+
+        A failed qstat call (e.g. a transient qmaster error) must not be
+        mistaken for all jobs having finished, so None is returned instead
+        of an empty list.
+        """
+        pipe = subprocess.run(
+            [self.qstat, "-xml"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        return self.parse_query(pipe.returncode, pipe.stdout)
+
+    @staticmethod
+    def parse_query(returncode, output):
+        """Return QstatRecords from qstat output, or None if qstat failed."""
+        if returncode:
+            return None
+        try:
+            return parse_qstat_xml(output)
+        except ElementTree.ParseError:
+            return None
+
+    def update(self, records, jobs=None):
+        """Update the status of tracked jobs from a qstat query.
+
+        - records        List of QstatRecords from a single qstat query
+        - jobs           Iterable of the jobs to update (default, all
+                         tracked jobs); only jobs that were tracked before
+                         the query started should be updated
+
+        The time at which each task is first seen running, and at which it
+        is first seen to have finished, is recorded in job.task_times (so
+        these are only as accurate as the polling interval). Returns the
+        list of jobs newly seen to have finished.
+        """
+        now = time.time()
+        queued_ids = {record.jobid for record in records}
+        queued_names = {record.name for record in records}
+        running = {}  # Running task IDs, keyed by job ID and by job name
+        for record in records:
+            if record.state is not None and "r" in record.state:
+                task = int(record.tasks) if (record.tasks or "").isdigit() else 1
+                running.setdefault(record.jobid, set()).add(task)
+                running.setdefault(record.name, set()).add(task)
+        finished = []
+        for job in self.active if jobs is None else jobs:
+            if job.finished:
+                continue
+            if job.jobid is None:
+                key, queued = job.name, job.name in queued_names
+            else:
+                key, queued = job.jobid, job.jobid in queued_ids
+            tasks = running.get(key, set()) if queued else set()
+            for task in tasks:
+                job.task_times.setdefault(task, {}).setdefault("started", now)
+            for task, times in job.task_times.items():
+                if task not in tasks:
+                    times.setdefault("finished", now)
+            if not queued:
+                job.finished = True
+                finished.append(job)
+        return finished
+
+    def poll(self):
+        """Query SGE once, and update the status of all tracked jobs.
+
+        Returns the number of tracked jobs still active.
+        """
+        records = self.query()
+        if records is not None:
+            self.update(records)
+        return len(self.active)
+
+    def wait(self):
+        """Poll SGE until all tracked jobs have finished."""
+        interval = self.interval
+        while self.poll():
+            time.sleep(interval)
+            interval = min(2 * interval, self.max_interval)
+
+
+class AsyncJobPoller(JobPoller):
+    """Tracks completion of many jobs from an asyncio event loop.
+
+    A single polling task queries qstat once per cycle for all tracked jobs,
+    and resolves a future for each job when it finishes. A job's future is
+    dropped once it is resolved, so that long-running pollers do not hold on
+    to finished jobs.
+    """
+
+    def __init__(
+        self, jobs=(), interval=SGE_WAIT, max_interval=SGE_MAX_WAIT, qstat=QSTAT_DEFAULT
+    ):
+        """Instantiate an AsyncJobPoller object.
+
+        - jobs           Iterable of Job/JobGroup objects to be tracked
+        - interval       Float, initial time (s) between polls
+        - max_interval   Float, upper bound on time (s) between polls
+        - qstat          String, path to the qstat executable
+
+        Must be instantiated from within a running event loop.
+        """
+        JobPoller.__init__(self, [], interval, max_interval, qstat)
+        self.futures = {}  # Future for each unfinished job, keyed by id()
+        self.task = None  # Polling task, while any job is active
+        self.delay = interval  # Time (s) before the next poll
+        self.wakeup = asyncio.Event()  # Set when a new job is tracked
+        for job in jobs:
+            self.track(job)
+
+    def track(self, job):
+        """Track the passed job, and return a future resolving to the job.
+
+        The future resolves when the job is seen to have finished. Tracking a
+        job resets the time between polls to the initial interval, and wakes
+        the polling task, so that a newly-submitted job is not left waiting
+        for a long back-off to expire.
+        """
+        future = self.futures.get(id(job))
+        if future is not None and not future.done():
+            return future
+        future = asyncio.get_event_loop().create_future()
+        if job.finished:
+            future.set_result(job)
+            return future
+        self.futures[id(job)] = future
+        self.jobs.append(job)
+        self.delay = self.interval
+        self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return future
+
+    async def query(self):
+        """Return QstatRecords for all of the user's jobs, or None on failure."""
+        proc = await asyncio.create_subprocess_exec(
+            self.qstat, "-xml", stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, _ = await proc.communicate()
+        return self.parse_query(proc.returncode, stdout)
+
+    async def sleep(self):
+        """Wait for the current time between polls, or until a job is tracked.
+
+        The time between polls doubles after each wait, up to max_interval.
+        """
+        delay, self.delay = self.delay, min(2 * self.delay, self.max_interval)
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        """Poll SGE until all tracked jobs have finished.
+
+        Jobs tracked while a qstat query is running may have been submitted
+        after qstat took its snapshot, so would wrongly appear to have
+        finished; each query's result is applied only to the jobs that were
+        tracked before it started.
+        """
+        try:
+            while self.active:
+                polled = self.active
+                records = await self.query()
+                if records is not None:
+                    self.update(records, polled)
+                    for job in polled:
+                        if job.finished:
+                            self.futures.pop(id(job)).set_result(job)
+                    self.jobs = self.active
+                if self.active:
+                    await self.sleep()
+        except Exception as exc:  # Don't leave the futures waiting forever
+            for job in self.active:
+                future = self.futures.get(id(job))
+                if future is not None and not future.done():
+                    future.set_exception(exc)
+
+    async def wait(self):
+        """Wait until all tracked jobs have finished."""
+        await asyncio.gather(*list(self.futures.values()))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""JobTable class for compact serialisation of large sets of jobs"""
+
+from array import array
+from collections import deque
+from itertools import repeat
+from operator import attrgetter
+
+
+class Unset:
+    """Marker for a slot that has no value (pickled by reference)."""
+
+
+def slot_names(cls):
+    """Return the names of all slots of the passed class, in MRO order.
+
+    The dependencies slot is omitted, as dependencies are stored separately,
+    as is the __weakref__ slot, which holds no job data.
+    """
+    names = []
+    for klass in reversed(cls.__mro__):
+        for name in getattr(klass, "__slots__", ()):
+            if name not in ("dependencies", "__weakref__") and name not in names:
+                names.append(name)
+    return names
+
+
+class JobTable:
+    """Jobs packed into flat tuples, with integer-indexed dependencies.
+
+    Pickling Job objects directly follows the dependency lists recursively,
+    which is slow for large workflows, and fails on long dependency chains.
+    A JobTable holds the attributes of each job as a tuple, and the
+    dependencies of all jobs as a compressed sparse row index: the
+    dependencies of job i are jobs indices[indptr[i]:indptr[i + 1]]. It can
+    be pickled quickly, and unpacked to an equivalent set of jobs.
+
+    Dependencies that were not passed are packed too, so that the unpacked
+    jobs form a complete graph. The members of a JobBundle are pickled
+    with the bundle, as ordinary attributes.
+    """
+
+    def __init__(self, jobs):
+        """Instantiate a JobTable object.
+
+        - jobs           Iterable of Job/JobGroup objects
+        """
+        ordered, index = [], {}  # Jobs to pack, and their indices by id()
+        for job in jobs:
+            if id(job) not in index:
+                index[id(job)] = len(ordered)
+                ordered.append(job)
+        self.count = len(ordered)  # Number of passed jobs
+
+        self.classes = []  # Classes of the packed jobs
+        self.kinds = array("B")  # Index into self.classes of each job
+        self.rows = []  # Tuple of slot values of each job
+        self.indptr = array("q", [0])
+        self.indices = array("q")
+        getters = {}  # Getter for all slot values, keyed by class
+        idx = 0
+        while idx < len(ordered):  # ordered grows as dependencies are found
+            job = ordered[idx]
+            cls = type(job)
+            if cls not in getters:
+                names = slot_names(cls)
+                getters[cls] = (len(self.classes), names, attrgetter(*names))
+                self.classes.append(cls)
+            kind, names, getter = getters[cls]
+            self.kinds.append(kind)
+            try:
+                self.rows.append(getter(job))
+            except AttributeError:  # Some slots are unset
+                self.rows.append(tuple(getattr(job, name, Unset) for name in names))
+            for dep in job.dependencies:
+                if id(dep) not in index:
+                    index[id(dep)] = len(ordered)
+                    ordered.append(dep)
+                self.indices.append(index[id(dep)])
+            self.indptr.append(len(self.indices))
+            idx += 1
+
+    def __len__(self):
+        """Return the number of packed jobs, including unpassed dependencies."""
+        return len(self.rows)
+
+    def jobs(self):
+        """Return a list of new Job/JobGroup objects unpacked from the table.
+
+        The jobs are returned in the order they were passed; dependencies
+        that were not passed are reachable through the jobs' dependencies.
+        Slots are filled a column at a time, with map(), to keep the
+        per-job cost of unpacking low.
+        """
+        unpacked = [None] * len(self.rows)
+        for kind, cls in enumerate(self.classes):
+            positions = [idx for idx, value in enumerate(self.kinds) if value == kind]
+            jobs = [cls.__new__(cls) for _ in positions]
+            columns = zip(*[self.rows[idx] for idx in positions])
+            for name, column in zip(slot_names(cls), columns):
+                if Unset in column:
+                    for job, value in zip(jobs, column):
+                        if value is not Unset:
+                            setattr(job, name, value)
+                else:
+                    deque(map(setattr, jobs, repeat(name), column), maxlen=0)
+            for idx, job in zip(positions, jobs):
+                unpacked[idx] = job
+
+        # Slice each job's dependencies from the flattened dependency list
+        targets = [unpacked[idx] for idx in self.indices]
+        spans = map(slice, self.indptr[:-1], self.indptr[1:])
+        dependencies = map(targets.__getitem__, spans)
+        deque(map(setattr, unpacked, repeat("dependencies"), dependencies), maxlen=0)
+        return unpacked[: self.count]
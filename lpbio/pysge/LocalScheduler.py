@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""LocalScheduler class for running SGE-like jobs on the local machine"""
+
+import itertools
+import os
+import subprocess
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .JobGraph import JobGraph
+
+
+class LocalScheduler:
+    """Runs Job/JobGroup scripts on the local machine, respecting dependencies.
+
+    Each job (or JobGroup task) is started as soon as all of the jobs it
+    depends on have finished, with up to workers tasks running at once. As
+    with SGE holds, a job is released when its dependencies finish, whatever
+    their exit status.
+    """
+
+    def __init__(self, root_dir=os.curdir, workers=None, shell="bash"):
+        """Instantiate a LocalScheduler object.
+
+        - root_dir     Path to the directory holding the stdout and stderr
+                       subdirectories, as made by pysge.build_directories()
+        - workers      Integer, maximum number of concurrent tasks (default:
+                       the number of CPUs)
+        - shell        String, shell used to run the job scripts
+        """
+        self.root_dir = root_dir
+        self.workers = workers if workers else os.cpu_count()
+        self.shell = shell
+        self.counter = itertools.count(1)  # Source of local job IDs
+
+    @staticmethod
+    def task_ids(job):
+        """Return the task IDs of the passed job (1 for a single Job)."""
+        return range(1, getattr(job, "tasks", 1) + 1)
+
+    def run_task(self, job, localid, taskid):
+        """Run a single task of the passed job, and return its exit code.
+
+        As under SGE, the script sees JOB_ID, JOB_NAME and SGE_TASK_ID in its
+        environment, and its output is written to <name>.o<JOB_ID>[.<task>]
+        (and .e for stderr) in the stdout and stderr directories. The start
+        and finish times of the task are recorded in job.task_times.
+        """
+        env = dict(os.environ, JOB_ID=str(localid), JOB_NAME=job.name)
+        suffix = str(localid)
+        if hasattr(job, "tasks"):
+            env["SGE_TASK_ID"] = str(taskid)
+            suffix = "{}.{}".format(localid, taskid)
+        else:
+            env["SGE_TASK_ID"] = "undefined"
+        outpath = os.path.join(
+            self.root_dir, "stdout", "{}.o{}".format(job.name, suffix)
+        )
+        errpath = os.path.join(
+            self.root_dir, "stderr", "{}.e{}".format(job.name, suffix)
+        )
+        times = job.task_times[taskid] = {"started": time.time()}
+        with open(outpath, "w") as outfh, open(errpath, "w") as errfh:
+            returncode = subprocess.call(
+                [self.shell, job.scriptpath] + list(job.scriptargs),
+                env=env,
+                stdout=outfh,
+                stderr=errfh,
+            )
+        times["finished"] = time.time()
+        return returncode
+
+    def run(self, jobs):
+        """Run the passed jobs, returning when all have finished.
+
+        - jobs         Iterable of Job/JobGroup objects, with scripts built
+
+        The exit code of each task is recorded in job.exit_codes, keyed by
+        task ID.
+        """
+        graph = JobGraph(jobs)
+        graph.waves()  # Raises PySGEException if the dependencies are cyclic
+        indegree = list(graph.indegree)
+        remaining = {}  # Number of unfinished tasks for each running job
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}  # Running task futures, with their job index and task
+
+            def start(idx):
+                """Queue all tasks of the job with the passed index."""
+                job = graph.jobs[idx]
+                job.submitted, job.finished = True, False
+                job.exit_codes, job.task_times = {}, {}
+                job.submit_time = time.time()
+                localid = next(self.counter)
+                taskids = self.task_ids(job)
+                remaining[idx] = len(taskids)
+                for taskid in taskids:
+                    future = executor.submit(self.run_task, job, localid, taskid)
+                    pending[future] = (idx, taskid)
+
+            for idx, degree in enumerate(indegree):
+                if degree == 0:
+                    start(idx)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, taskid = pending.pop(future)
+                    job = graph.jobs[idx]
+                    job.exit_codes[taskid] = future.result()
+                    remaining[idx] -= 1
+                    if remaining[idx]:
+                        continue
+                    job.finished = True
+                    for child in graph.dependents[idx]:
+                        indegree[child] -= 1
+                        if indegree[child] == 0:
+                            start(child)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""ScheduleSimulator class for dry-running pysge workflows"""
+
+import heapq
+
+from collections import namedtuple
+
+from .exceptions import PySGEException
+from .JobGraph import JobGraph
+
+# factory class for the outcome of a simulated run. schedule is a list of
+# (job, start, finish) tuples, in the order the jobs were passed
+SimulationReport = namedtuple(
+    "SimulationReport",
+    "makespan critical_path critical_path_length busy_slot_time "
+    "idle_slot_time utilisation schedule",
+)
+
+
+class ScheduleSimulator:
+    """Simulates running a workflow of Job/JobGroup objects on fixed slots.
+
+    Each job (or JobGroup task) occupies one slot for its estimated runtime,
+    and may start once all the jobs it depends on have finished. Whenever a
+    slot is free, the next ready task is started: in the order the tasks
+    became ready ("fifo", as a scheduler that gives all jobs the same
+    priority would), or longest remaining critical path first ("critical").
+    """
+
+    POLICIES = ("fifo", "critical")
+
+    def __init__(self, jobs, slots, runtimes=None, default_runtime=1):
+        """Instantiate a ScheduleSimulator object.
+
+        - jobs               Iterable of Job/JobGroup objects
+        - slots              Integer, number of job slots available
+        - runtimes           Dictionary of estimated runtime (s) for each job
+                             (for each task, for a JobGroup), keyed by job name
+        - default_runtime    Float, estimated runtime (s) for jobs not in
+                             runtimes
+        """
+        if slots < 1:
+            raise PySGEException("At least one slot is needed to run jobs")
+        self.graph = JobGraph(jobs)
+        self.graph.waves()  # Raises PySGEException if the dependencies are cyclic
+        self.slots = slots
+        runtimes = {} if runtimes is None else runtimes
+        self.durations = [
+            runtimes.get(job.name, default_runtime) for job in self.graph.jobs
+        ]
+        self.remaining = self.graph.remaining_times(self.durations)
+
+    def critical_path(self):
+        """Return the critical path, as a list of jobs in execution order.
+
+        This is the chain of dependent jobs with the greatest total runtime,
+        which bounds the makespan however many slots are available.
+        """
+        graph, remaining = self.graph, self.remaining
+        if not graph.jobs:
+            return []
+        roots = [idx for idx, degree in enumerate(graph.indegree) if degree == 0]
+        idx = max(roots, key=remaining.__getitem__)
+        path = [graph.jobs[idx]]
+        while graph.dependents[idx]:
+            idx = max(graph.dependents[idx], key=remaining.__getitem__)
+            path.append(graph.jobs[idx])
+        return path
+
+    def run(self, policy="fifo"):
+        """Simulate the schedule, and return a SimulationReport.
+
+        - policy         String, the order in which ready tasks are started:
+                         "fifo" or "critical" (see the class docstring)
+        """
+        if policy not in self.POLICIES:
+            raise PySGEException("Unknown scheduling policy: {}".format(policy))
+        graph, durations = self.graph, self.durations
+        indegree = list(graph.indegree)
+        tasks = [getattr(job, "tasks", 1) for job in graph.jobs]
+        unfinished = list(tasks)  # Unfinished tasks of each job
+        starts = [None] * len(graph.jobs)
+        finishes = [None] * len(graph.jobs)
+        ready = []  # Heap of (priority, sequence, job index, tasks left to start)
+        running = []  # Heap of (finish time, job index)
+        sequence = 0  # Tiebreak, so that ready jobs are started in FIFO order
+
+        def release(idx):
+            """Add the tasks of the job with the passed index to the ready heap."""
+            nonlocal sequence
+            key = -self.remaining[idx] if policy == "critical" else 0
+            heapq.heappush(ready, (key, sequence, idx, tasks[idx]))
+            sequence += 1
+
+        for idx, degree in enumerate(indegree):
+            if degree == 0:
+                release(idx)
+
+        now, free = 0, self.slots
+        while ready or running:
+            # Start as many ready tasks as there are free slots; the tasks of
+            # a JobGroup are started together where slots allow
+            while ready and free:
+                key, seq, idx, left = ready[0]
+                count = min(left, free)
+                if starts[idx] is None:
+                    starts[idx] = now
+                for _ in range(count):
+                    heapq.heappush(running, (now + durations[idx], idx))
+                free -= count
+                if count == left:
+                    heapq.heappop(ready)
+                else:
+                    heapq.heapreplace(ready, (key, seq, idx, left - count))
+
+            # Advance to the next task to finish, releasing the dependents of
+            # any job whose tasks have all finished
+            now, idx = heapq.heappop(running)
+            free += 1
+            unfinished[idx] -= 1
+            if unfinished[idx]:
+                continue
+            finishes[idx] = now
+            for child in graph.dependents[idx]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    release(child)
+
+        makespan = max(finishes, default=0)
+        busy = sum(count * duration for count, duration in zip(tasks, durations))
+        critical_path = self.critical_path()
+        return SimulationReport(
+            makespan=makespan,
+            critical_path=critical_path,
+            critical_path_length=max(self.remaining, default=0),
+            busy_slot_time=busy,
+            idle_slot_time=self.slots * makespan - busy,
+            utilisation=busy / (self.slots * makespan) if makespan else 0,
+            schedule=list(zip(graph.jobs, starts, finishes)),
+        )
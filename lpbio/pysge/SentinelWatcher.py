@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""SentinelWatcher class for detecting job completion from exit status files"""
+
+import ctypes
+import ctypes.util
+import os
+import re
+import select
+import time
+
+from .JobPoller import SGE_MAX_WAIT, SGE_WAIT
+
+# Shell code that makes a job script write its exit status, and the time (s
+# since epoch) at which it started, to a sentinel file <JOB_ID>.<SGE_TASK_ID>
+# in the status directory when it exits. The file is written under a
+# temporary name and renamed, so that it appears atomically.
+# Single (non-array) jobs are recorded as task 1. If $PYSGE_TASKS is set (as
+# :<task>:<task>:), array tasks not listed there exit at once, without writing
+# a sentinel, so that a subset of tasks can be rerun.
+SENTINEL_PROLOGUE = """[[ -z $PYSGE_TASKS || $PYSGE_TASKS == *:$SGE_TASK_ID:* ]] || exit 0
+PYSGE_TASK=$SGE_TASK_ID
+[[ $PYSGE_TASK =~ ^[0-9]+$ ]] || PYSGE_TASK=1
+PYSGE_STATUS={statusdir}/$JOB_ID.$PYSGE_TASK
+PYSGE_START=$(date +%s)
+trap 'printf "%d %d\\n" $? $PYSGE_START > "$PYSGE_STATUS.tmp" && mv "$PYSGE_STATUS.tmp" "$PYSGE_STATUS"' EXIT
+"""
+
+# Sentinel filenames: <JOB_ID>.<task ID>
+SENTINEL_PATTERN = re.compile(r"^(\d+)\.(\d+)$")
+
+# inotify event masks for files closed after writing, or moved into the
+# watched directory
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+
+class Inotify:
+    """Minimal inotify watch on a directory, used only to wake up early.
+
+    Raises OSError if inotify is not available on this system.
+    """
+
+    def __init__(self, path):
+        """Watch the passed directory for new files."""
+        libname = ctypes.util.find_library("c")
+        if libname is None:
+            raise OSError("C library not found")
+        libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if (
+            libc.inotify_add_watch(
+                self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+            < 0
+        ):
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        """Wait up to timeout (s) for files to change, discarding the events."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        """Stop watching the directory."""
+        os.close(self.fd)
+
+
+class SentinelWatcher:
+    """Tracks completion of jobs from the exit status files they write.
+
+    Job scripts must be built with sentinels (see pysge.build_job_scripts()),
+    and the jobs submitted, so that their job IDs are known. No scheduler
+    queries are made: the status directory is scanned for sentinel files,
+    waking early on inotify events where these are available (inotify does
+    not see files written by other hosts on networked filesystems, so the
+    directory is always rescanned at least every max_interval seconds).
+
+    A job that is killed before its script can exit (e.g. by SIGKILL) writes
+    no sentinel, and will not be seen to finish.
+    """
+
+    def __init__(
+        self,
+        jobs,
+        statusdir,
+        interval=SGE_WAIT,
+        max_interval=SGE_MAX_WAIT,
+        use_inotify=True,
+    ):
+        """Instantiate a SentinelWatcher object.
+
+        - jobs           Iterable of submitted Job/JobGroup objects
+        - statusdir      Path to the directory holding sentinel files
+        - interval       Float, initial time (s) between scans
+        - max_interval   Float, upper bound on time (s) between scans
+        - use_inotify    If True, use inotify to wake early where available
+        """
+        self.jobs = {job.jobid: job for job in jobs}
+        self.statusdir = statusdir
+        self.interval = interval
+        self.max_interval = max_interval
+        self.use_inotify = use_inotify
+        self.seen = set()  # Sentinel files already read
+
+    @property
+    def active(self):
+        """Jobs that have not yet been seen to finish."""
+        return [job for job in self.jobs.values() if not job.finished]
+
+    def track(self, job):
+        """Track the passed submitted job, in addition to those already tracked."""
+        self.jobs[job.jobid] = job
+
+    def scan(self):
+        """Read new sentinel files, and update the status of tracked jobs.
+
+        The exit code of each task is recorded in job.exit_codes, and its
+        start and finish times (the latter from the sentinel's modification
+        time) in job.task_times. A job is finished when all of its tasks have
+        exited. Returns the number of tracked jobs still active.
+        """
+        with os.scandir(self.statusdir) as entries:
+            for entry in entries:
+                if entry.name in self.seen:
+                    continue
+                match = SENTINEL_PATTERN.match(entry.name)
+                if match is None or match.group(1) not in self.jobs:
+                    continue
+                with open(entry.path, "r") as ifh:
+                    fields = ifh.read().split()
+                self.seen.add(entry.name)
+                job, task = self.jobs[match.group(1)], int(match.group(2))
+                job.exit_codes[task] = int(fields[0])
+                times = job.task_times.setdefault(task, {})
+                if len(fields) > 1:
+                    times["started"] = float(fields[1])
+                times["finished"] = entry.stat().st_mtime
+                if len(job.exit_codes) >= getattr(job, "tasks", 1):
+                    job.finished = True
+        return len(self.active)
+
+    def poll(self):
+        """Scan for sentinel files once (as for JobPoller.poll()).
+
+        Returns the number of tracked jobs still active.
+        """
+        return self.scan()
+
+    def wait(self, timeout=None):
+        """Scan for sentinel files until all tracked jobs have finished.
+
+        - timeout        Float, maximum time (s) to wait, or None to wait
+                         indefinitely
+
+        Returns the number of tracked jobs still active.
+        """
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = Inotify(self.statusdir)
+            except OSError:
+                inotify = None
+        start, interval = time.time(), self.interval
+        try:
+            while self.scan():
+                if timeout is not None:
+                    remaining = timeout - (time.time() - start)
+                    if remaining <= 0:
+                        break
+                    interval = min(interval, remaining)
+                if inotify is None:
+                    time.sleep(interval)
+                else:
+                    inotify.wait(interval)
+                interval = min(2 * interval, self.max_interval)
+        finally:
+            if inotify is not None:
+                inotify.close()
+        return len(self.active)
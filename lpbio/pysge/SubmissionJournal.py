@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""SubmissionJournal class for recording pysge submissions on disk"""
+
+import json
+import os
+import threading
+import time
+
+# Name of the journal file, in the root directory of a pysge run
+JOURNAL_FILENAME = "pysge_journal.jsonl"
+
+
+class SubmissionJournal:
+    """Append-only on-disk record of submitted and finished jobs.
+
+    Each event is written as a line of JSON, and flushed to the operating
+    system as it is recorded, so that the journal survives the death of the
+    submitting process. Calling sync() also forces it to disk. Jobs are
+    identified in the journal by name, so names should be unique within a
+    run that is to be resumed.
+    """
+
+    def __init__(self, root_dir):
+        """Instantiate a SubmissionJournal object.
+
+        - root_dir       Path to the root directory of the pysge run
+        """
+        self.path = os.path.join(root_dir, JOURNAL_FILENAME)
+        self.lock = threading.Lock()  # Submissions may be recorded by threads
+        self.handle = None
+
+    def __enter__(self):
+        """Open the journal for appending."""
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        """Close the journal."""
+        self.close()
+
+    def open(self):
+        """Open the journal for appending."""
+        if self.handle is None:
+            self.handle = open(self.path, "a")
+
+    def close(self):
+        """Sync and close the journal."""
+        if self.handle is not None:
+            self.sync()
+            self.handle.close()
+            self.handle = None
+
+    def write(self, record):
+        """Append the passed record (a JSON-serialisable dict) to the journal."""
+        record["time"] = time.time()
+        with self.lock:
+            self.handle.write("{}\n".format(json.dumps(record)))
+            self.handle.flush()
+
+    def sync(self):
+        """Force all recorded events to disk."""
+        with self.lock:
+            os.fsync(self.handle.fileno())
+
+    def record_submitted(self, job):
+        """Record the submission of the passed job."""
+        self.write(
+            {
+                "event": "submitted",
+                "name": job.name,
+                "jobid": job.jobid,
+                "tasks": getattr(job, "tasks", 1),
+                "dependencies": [dep.jobid for dep in job.dependencies],
+            }
+        )
+
+    def record_finished(self, job):
+        """Record that the passed job has finished."""
+        self.write(
+            {
+                "event": "finished",
+                "name": job.name,
+                "jobid": job.jobid,
+                "exit_codes": job.exit_codes,
+            }
+        )
+
+    def load(self):
+        """Return the state of each job in the journal, keyed by job name.
+
+        Each state is a dict with keys jobid, submit_time, finished and
+        exit_codes. Where a name was submitted more than once, the latest
+        submission is used. A final line left incomplete by a crash is
+        ignored.
+        """
+        states = {}
+        if not os.path.isfile(self.path):
+            return states
+        with open(self.path, "r") as ifh:
+            for line in ifh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record["event"] == "submitted":
+                    states[record["name"]] = {
+                        "jobid": record["jobid"],
+                        "submit_time": record["time"],
+                        "finished": False,
+                        "exit_codes": {},
+                    }
+                elif record["event"] == "finished":
+                    state = states.get(record["name"])
+                    if state is not None and state["jobid"] == record["jobid"]:
+                        state["finished"] = True
+                        state["exit_codes"] = {
+                            int(task): code
+                            for task, code in record["exit_codes"].items()
+                        }
+        return states
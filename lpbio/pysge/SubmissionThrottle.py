@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""SubmissionThrottle class for limiting the load that pysge puts on SGE"""
+
+import threading
+import time
+
+from .JobPoller import SGE_MAX_WAIT, SGE_WAIT
+
+
+class SubmissionThrottle:
+    """Limits the number of jobs in flight, and the rate of qsub calls.
+
+    A job is in flight from its submission until it is seen to finish by the
+    throttle's tracker: a JobPoller, or a SentinelWatcher if the job scripts
+    write sentinel files. When the limit is reached, the tracker is polled
+    until a job finishes and frees a slot. A JobGroup counts as one job; use
+    its max_running argument to limit its concurrent tasks.
+    """
+
+    def __init__(
+        self,
+        tracker=None,
+        max_in_flight=None,
+        rate=None,
+        interval=SGE_WAIT,
+        max_interval=SGE_MAX_WAIT,
+    ):
+        """Instantiate a SubmissionThrottle object.
+
+        - tracker        JobPoller or SentinelWatcher used to detect finished
+                         jobs (required if max_in_flight is set)
+        - max_in_flight  Integer, maximum number of unfinished submitted jobs,
+                         or None for no limit
+        - rate           Float, maximum number of qsub calls per second, or
+                         None for no limit
+        - interval       Float, initial time (s) between polls for free slots
+        - max_interval   Float, upper bound on time (s) between polls
+        """
+        self.tracker = tracker
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.interval = interval
+        self.max_interval = max_interval
+        self.lock = threading.Lock()  # qsub calls may be made by threads
+        self.next_time = 0  # Earliest time (s) for the next qsub call
+
+    @property
+    def in_flight(self):
+        """Number of submitted jobs not yet seen to finish."""
+        return 0 if self.tracker is None else len(self.tracker.active)
+
+    def wait_for_slot(self):
+        """Wait until fewer than max_in_flight jobs are in flight."""
+        if not self.max_in_flight:
+            return
+        interval = self.interval
+        while self.in_flight >= self.max_in_flight:
+            if self.tracker.poll() < self.max_in_flight:
+                break
+            time.sleep(interval)
+            interval = min(2 * interval, self.max_interval)
+
+    def wait_for_rate(self):
+        """Wait until the next qsub call is allowed by the rate limit."""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time)
+            self.next_time = start + 1 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def wait(self):
+        """Wait until another job may be submitted."""
+        self.wait_for_slot()
+        self.wait_for_rate()
+
+    def track(self, job):
+        """Count the passed, newly submitted, job as in flight."""
+        if self.tracker is not None:
+            self.tracker.track(job)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""TimingReport class for recording where the time goes in a pysge run"""
+
+import json
+import re
+import shutil
+import subprocess
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Name of the timing report file, in the root directory of a pysge run
+TIMING_FILENAME = "pysge_timing.json"
+
+# Default location for qacct executable
+QACCT_DEFAULT = shutil.which("qacct")
+if QACCT_DEFAULT is None:
+    QACCT_DEFAULT = "qacct"
+
+# Multipliers for the memory units used by qacct
+MEMORY_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_qacct_value(value):
+    """Return the passed qacct field value, converted to a number if possible.
+
+    Times (e.g. ru_wallclock, cpu) may carry an 's' suffix, and memory
+    (e.g. maxvmem) a K, M, G or T suffix; memory is converted to bytes.
+    """
+    match = re.match(r"^(-?[\d.]+)(s|[KMGT])?$", value)
+    if match is None:
+        return value
+    return float(match.group(1)) * MEMORY_UNITS.get(match.group(2), 1)
+
+
+def parse_qacct(text):
+    """Return accounting fields for each task in qacct -j output.
+
+    - text       String (or bytes), output of qacct -j <jobid>
+
+    Returns a dictionary of {field: value} dictionaries, keyed by task ID
+    (1 for a single job). Numeric fields are converted to floats.
+    """
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    tasks = {}
+    for block in re.split(r"^=+\s*$", text, flags=re.MULTILINE):
+        fields = {}
+        for line in block.splitlines():
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                fields[parts[0]] = parse_qacct_value(parts[1].strip())
+        if "jobnumber" not in fields:
+            continue
+        taskid = fields.get("taskid")
+        tasks[int(taskid) if isinstance(taskid, float) else 1] = fields
+    return tasks
+
+
+class TimingReport:
+    """Per-task timing of a set of jobs, with SGE accounting data.
+
+    Submission times are recorded when jobs are submitted, and task start
+    and finish times as jobs are waited on (by qstat polling, sentinel
+    files, or the LocalScheduler). Accounting data are read from qacct after
+    the jobs have finished.
+    """
+
+    # Accounting fields included in the report
+    ACCOUNTING_FIELDS = (
+        "hostname",
+        "qsub_time",
+        "start_time",
+        "end_time",
+        "ru_wallclock",
+        "cpu",
+        "maxvmem",
+        "failed",
+        "exit_status",
+    )
+
+    def __init__(self, jobs, qacct=QACCT_DEFAULT):
+        """Instantiate a TimingReport object.
+
+        - jobs           Iterable of Job/JobGroup objects
+        - qacct          String, path to the qacct executable
+        """
+        self.jobs = list(jobs)
+        self.qacct = qacct
+        self.accounting = {}  # qacct fields for each task, keyed by job ID
+
+    def query_accounting(self, job):
+        """Return qacct fields for each task of the passed job, by task ID.
+
+        An empty dictionary is returned if qacct fails, e.g. because the
+        job's accounting record has not yet been written.
+        """
+        pipe = subprocess.run(
+            [self.qacct, "-j", job.jobid],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if pipe.returncode:
+            return {}
+        return parse_qacct(pipe.stdout)
+
+    def collect_accounting(self, workers=1):
+        """Read accounting data for all submitted jobs from qacct.
+
+        - workers        Maximum number of concurrent qacct calls
+        """
+        jobs = [job for job in self.jobs if job.jobid is not None]
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for job, tasks in zip(jobs, executor.map(self.query_accounting, jobs)):
+                self.accounting[job.jobid] = tasks
+
+    def rows(self):
+        """Return a list of dictionaries describing the timing of each task.
+
+        Times are seconds since the epoch. queue_wait is the time from
+        submission to the start of the task, and run_time the time from its
+        start to its finish; either is None where the times are not known.
+        """
+        rows = []
+        for job in self.jobs:
+            accounting = self.accounting.get(job.jobid, {})
+            for task in range(1, getattr(job, "tasks", 1) + 1):
+                times = job.task_times.get(task, {})
+                started, finished = times.get("started"), times.get("finished")
+                row = {
+                    "name": job.name,
+                    "jobid": job.jobid,
+                    "task": task,
+                    "submitted": job.submit_time,
+                    "started": started,
+                    "finished": finished,
+                    "queue_wait": None,
+                    "run_time": None,
+                    "exit_code": job.exit_codes.get(task),
+                }
+                if None not in (job.submit_time, started):
+                    row["queue_wait"] = started - job.submit_time
+                if None not in (started, finished):
+                    row["run_time"] = finished - started
+                fields = accounting.get(task, {})
+                for field in self.ACCOUNTING_FIELDS:
+                    row[field] = fields.get(field)
+                rows.append(row)
+        return rows
+
+    def write(self, path):
+        """Write the report to the passed path, as JSON."""
+        with open(path, "w") as ofh:
+            json.dump({"created": time.time(), "tasks": self.rows()}, ofh, indent=1)
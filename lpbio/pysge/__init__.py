@@ -43,26 +43,206 @@ operation of the code.
 ==============================================================================
 """
 
+import asyncio
+import base64
 import os
+import re
 import shlex
 import shutil
 import subprocess
+import tempfile
+import time
+import weakref
 
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import PySGEException
 from .Job import Job  # noqa: F401
+from .JobBundle import JobBundle
+from .JobGraph import JobGraph
 from .JobGroup import JobGroup
+from .JobTable import JobTable  # noqa: F401
+from .LocalScheduler import LocalScheduler
+from .ScheduleSimulator import ScheduleSimulator, SimulationReport  # noqa: F401
+from .SentinelWatcher import SENTINEL_PROLOGUE, SentinelWatcher
+from .SubmissionJournal import JOURNAL_FILENAME, SubmissionJournal
+from .SubmissionThrottle import SubmissionThrottle
+from .TimingReport import (  # noqa: F401
+    QACCT_DEFAULT,
+    TIMING_FILENAME,
+    TimingReport,
+    parse_qacct,
+)
+from .JobPoller import (  # noqa: F401
+    AsyncJobPoller,
+    JobPoller,
+    QstatRecord,
+    QSTAT_DEFAULT,
+    SGE_MAX_WAIT,
+    SGE_WAIT,
+    parse_qstat_xml,
+)
 
 # Default location for qsub executable
 QSUB_DEFAULT = shutil.which("qsub")
 if QSUB_DEFAULT is None:
     QSUB_DEFAULT = "qsub"
 
+# Default location for qdel executable
+QDEL_DEFAULT = shutil.which("qdel")
+if QDEL_DEFAULT is None:
+    QDEL_DEFAULT = "qdel"
+
+# Runner script for jobs written to a manifest by build_job_manifest(). Each
+# job passes the byte offset ($1) and length ($2) of its encoded script in the
+# manifest, which is read without scanning the lines before it (tail -c +
+# seeks in regular files), so that lookup time does not grow with the number
+# of jobs
+MANIFEST_RUNNER = """#!/bin/sh
+#$ -S /bin/bash
+# Run the job script at byte offset $1, of length $2, in the manifest
+PYSGE_SCRIPT=$(tail -c +$(($1 + 1)) {manifest} | head -c "$2" | base64 -d)
+set --
+eval "$PYSGE_SCRIPT"
+"""
+
+# Default number of times to retry failed tasks, and delay (s) before the
+# first retry
+RETRIES = 3
+RETRY_BACKOFF = 60
+
+# Default number of concurrent qsub calls
+SUBMIT_WORKERS = 1
+
+# Range of SGE job priorities (qsub -p) available to users
+PRIORITY_MIN = -1023
+PRIORITY_MAX = 0
+
+# Registry of jobs submitted from this process, keyed by SGE job ID. Jobs are
+# held by weak reference, so that the registry does not keep finished jobs
+# alive for the life of the process
+JOB_REGISTRY = weakref.WeakValueDictionary()
+
+
+def bundle_jobs(
+    jobs, target_duration, runtimes=None, default_runtime=1, width=1, prefix="bundle"
+):
+    """Return list of jobs, with single Jobs packed into JobBundles.
+
+    Where jobs are short, scheduling overhead can outweigh the work done.
+    Bundling packs several jobs into one scheduler task, so that each
+    bundle is expected to run for about target_duration seconds. Only jobs
+    in the same dependency wave (see JobGraph.waves()) share a bundle, and
+    the dependencies of bundled jobs become dependencies between bundles.
+    JobGroups are not bundled, but are returned with their dependencies on
+    bundled jobs replaced by the corresponding bundles.
+
+    - jobs               Iterable of Job/JobGroup objects
+    - target_duration    Float, target runtime (s) for each bundle
+    - runtimes           Dictionary of estimated runtime (s) for each job,
+                         keyed by job name
+    - default_runtime    Float, estimated runtime (s) for jobs not in runtimes
+    - width              Integer, number of bundled jobs each bundle runs at
+                         once
+    - prefix             String, prefix for bundle names
+    """
+    runtimes = {} if runtimes is None else runtimes
+    output = []  # Bundles and JobGroups to be returned
+    replacements = {}  # Bundle or JobGroup replacing each passed job, by id()
+
+    def add_bundle(members):
+        """Pack the passed jobs into a new bundle."""
+        bundle = JobBundle(
+            "{}_{}".format(prefix, len(output)), members, width, members[0].queue
+        )
+        output.append(bundle)
+        for member in members:
+            replacements[id(member)] = bundle
+
+    for wave in JobGraph(jobs).waves():
+        members, duration = [], 0
+        for job in wave:
+            if isinstance(job, JobGroup):
+                output.append(job)
+                replacements[id(job)] = job
+                continue
+            runtime = runtimes.get(job.name, default_runtime)
+            if members and (duration + runtime) / max(width, 1) > target_duration:
+                add_bundle(members)
+                members, duration = [], 0
+            members.append(job)
+            duration += runtime
+        if members:
+            add_bundle(members)
+
+    # Replace dependencies on passed jobs with dependencies on their bundles
+    for item in output:
+        dependencies, seen = [], {id(item)}
+        for member in getattr(item, "members", [item]):
+            for dep in member.dependencies:
+                dep = replacements.get(id(dep), dep)
+                if id(dep) not in seen:
+                    seen.add(id(dep))
+                    dependencies.append(dep)
+        item.dependencies = dependencies
+    return output
+
+
+def simulate_jobs(jobs, slots, runtimes=None, default_runtime=1, policy="fifo"):
+    """Dry-run the passed jobs on a number of slots, and return a report.
 
-class PySGEException(Exception):
-    """General exception for pysge."""
+    Nothing is submitted. The returned SimulationReport gives the expected
+    makespan, the critical path (the chain of dependent jobs with the
+    greatest total runtime) and its length, and the busy and idle slot
+    time, so that a workflow can be restructured before it is run.
 
-    def __init__(self, msg="Error in pysge module"):
-        """Instantiate class."""
-        Exception.__init__(self, msg)
+    - jobs               Iterable of Job/JobGroup objects
+    - slots              Integer, number of job slots available
+    - runtimes           Dictionary of estimated runtime (s) for each job (for
+                         each task, for a JobGroup), keyed by job name
+    - default_runtime    Float, estimated runtime (s) for jobs not in runtimes
+    - policy             String, order in which ready jobs are started: "fifo"
+                         or "critical" (longest remaining critical path first)
+    """
+    if not isinstance(jobs, list):
+        jobs = [jobs]
+    return ScheduleSimulator(jobs, slots, runtimes, default_runtime).run(policy)
+
+
+def assign_priorities(
+    jobs, runtimes=None, default_runtime=1, lowest=PRIORITY_MIN, highest=PRIORITY_MAX
+):
+    """Set job priorities (qsub -p) by remaining critical-path length.
+
+    Where all jobs have the same priority, a job at the head of a long chain
+    of dependencies may start late, and stretch the run. Each job's
+    remaining critical-path length (see JobGraph.remaining_times()) is
+    mapped linearly onto the range lowest to highest, so that jobs on the
+    longest paths start first. Without runtime estimates, every job takes
+    the default runtime, and priorities follow the downstream depth of each
+    job.
+
+    - jobs               Iterable of Job/JobGroup objects
+    - runtimes           Dictionary of estimated runtime (s) for each job,
+                         keyed by job name
+    - default_runtime    Float, estimated runtime (s) for jobs not in runtimes
+    - lowest             Integer, priority for the shortest remaining path
+    - highest            Integer, priority for the longest remaining path
+    """
+    graph = JobGraph(jobs)
+    runtimes = {} if runtimes is None else runtimes
+    remaining = graph.remaining_times(
+        [runtimes.get(job.name, default_runtime) for job in graph.jobs]
+    )
+    if not remaining:
+        return
+    shortest, longest = min(remaining), max(remaining)
+    for job, length in zip(graph.jobs, remaining):
+        if longest == shortest:
+            job.priority = highest
+        else:
+            fraction = (length - shortest) / (longest - shortest)
+            job.priority = int(round(lowest + fraction * (highest - lowest)))
 
 
 def build_directories(root_dir):
@@ -74,6 +254,8 @@ def build_directories(root_dir):
     - jobs             Stores the scripts for each job
     - stderr           Stores the stderr output from SGE
     - stdout           Stores the stdout output from SGE
+    - status           Stores exit status sentinel files (if used)
+    - sweeps           Stores parameter sweep tables for JobGroups
     - output           Stores output (if the scripts place the output here)
 
     - root_dir   Path to the top-level directory for creation of subdirectories
@@ -85,30 +267,118 @@ def build_directories(root_dir):
     # Create subdirectories
     directories = [
         os.path.join(root_dir, subdir)
-        for subdir in ("output", "stderr", "stdout", "jobs")
+        for subdir in ("output", "stderr", "stdout", "status", "sweeps", "jobs")
     ]
     for dirname in directories:
         os.makedirs(dirname, exist_ok=True)
 
 
-def build_job_scripts(root_dir, jobs):
+def build_script_text(root_dir, job, sentinels=False):
+    """Return the script text to be run for the passed Job.
+
+    - root_dir      Path to output directory
+    - job           Job object
+    - sentinels     If True, the script writes its exit status to a sentinel
+                    file in the status subdirectory when it exits
+    """
+    if not sentinels:
+        return job.script
+    statusdir = os.path.abspath(os.path.join(root_dir, "status"))
+    return SENTINEL_PROLOGUE.format(statusdir=shlex.quote(statusdir)) + job.script
+
+
+def build_job_scripts(root_dir, jobs, manifest=False, sentinels=False):
     """Construct script for each passed Job in the jobs iterable.
 
     - jobs          Iterable of jobs
     - root_dir      Path to output directory
+    - manifest      If True, write a single manifest for all jobs, instead of
+                    one script file per job (see build_job_manifest())
+    - sentinels     If True, each script writes its exit status to a
+                    sentinel file when it exits (see SentinelWatcher)
+
+    The parameter values of each JobGroup are written to sweep tables in a
+    new directory under the sweeps subdirectory, which its tasks read from.
+    Unlike job scripts, sweep tables are not spooled by qsub, so each
+    submission gets its own directory, and does not overwrite the tables of
+    queued tasks from an earlier submission of a job with the same name.
     """
+    jobs = list(jobs)
+    sweepsdir = os.path.join(root_dir, "sweeps")
+    for job in jobs:
+        if isinstance(job, JobGroup):
+            os.makedirs(sweepsdir, exist_ok=True)
+            job.write_sweep(
+                tempfile.mkdtemp(dir=sweepsdir, prefix="{}_".format(job.name))
+            )
+
+    if manifest:
+        build_job_manifest(root_dir, jobs, sentinels)
+        return
+
     # Loop over the job list, creating each job script in turn, and then adding
     # scriptPath to the Job object
     for job in jobs:
         scriptpath = os.path.join(root_dir, "jobs", job.name)
         with open(scriptpath, "w") as scriptfile:
-            scriptfile.write("#!/bin/sh\n#$ -S /bin/bash\n%s\n" % job.script)
+            scriptfile.write(
+                "#!/bin/sh\n#$ -S /bin/bash\n%s\n"
+                % build_script_text(root_dir, job, sentinels)
+            )
         job.scriptpath = scriptpath
+        job.scriptargs = []
+
+
+def build_job_manifest(root_dir, jobs, sentinels=False):
+    """Construct a manifest and runner script for the passed Jobs.
+
+    Writing one script per job is slow for very many jobs on a networked
+    filesystem. Instead, the script for each job is written to a single
+    manifest file, as a line of the form <name><TAB><base64-encoded script>,
+    and each job runs a shared runner script that is passed the byte offset
+    and length of its encoded script in the manifest. Both files are written
+    to the jobs subdirectory, with a unique prefix, and synced to disk
+    together once both are written (fsync() applies to a single file, so
+    each file is synced, but no job can see one without the other).
+
+    - jobs          Iterable of jobs
+    - root_dir      Path to output directory
+    - sentinels     If True, each script writes its exit status to a
+                    sentinel file when it exits
+    """
+    jobsdir = os.path.join(root_dir, "jobs")
+    manifest_fd, manifestpath = tempfile.mkstemp(
+        dir=jobsdir, prefix="manifest_", suffix=".tsv"
+    )
+    runnerpath = "{}.sh".format(os.path.splitext(manifestpath)[0])
+
+    with os.fdopen(manifest_fd, "wb") as manifestfile:
+        offset = 0
+        for job in jobs:
+            script = build_script_text(root_dir, job, sentinels)
+            name = "{}\t".format(job.name).encode("utf-8")
+            encoded = base64.b64encode(script.encode("utf-8"))
+            manifestfile.write(name + encoded + b"\n")
+            job.scriptpath = runnerpath
+            job.scriptargs = [str(offset + len(name)), str(len(encoded))]
+            offset += len(name) + len(encoded) + 1
+        with open(runnerpath, "w") as runnerfile:
+            runnerfile.write(
+                MANIFEST_RUNNER.format(
+                    manifest=shlex.quote(os.path.abspath(manifestpath))
+                )
+            )
+            for ofh in (manifestfile, runnerfile):
+                ofh.flush()
+                os.fsync(ofh.fileno())
 
 
 def extract_submittable_jobs(waiting):
     """Obtain list of jobs that are able to be submitted from pending list.
 
+    This rescans the whole pending list on each call; submit_jobs() uses a
+    JobGraph to order jobs instead.
+
     - waiting           List of Job objects
     """
     submittable = set()  # Holds jobs that are able to be submitted
@@ -116,92 +386,668 @@ def extract_submittable_jobs(waiting):
     # list.  If there are any, and all of these have been submitted, then
     # append the job to the list of submittable jobs.
     for job in waiting:
-        unsatisfied = sum([(subjob.submitted is False) for subjob in job.dependencies])
-        if unsatisfied == 0:
+        if all(subjob.submitted for subjob in job.dependencies):
             submittable.add(job)
     return list(submittable)
 
 
-def submit_safe_jobs(root_dir, jobs, sgeargs=None):
-    """Submit passed list of jobs to SGE server with dir as root for output.
+def build_qsub_cmd(root_dir, job, sgeargs=None):
+    """Return qsub command-line, as a list of arguments, for the passed job.
 
     - root_dir      Path to output directory
-    - jobs          Iterable of Job objects
+    - job           Job object, with a script already built
+    - sgeargs       Additional arguments to qsub
     """
-    # Loop over each job, constructing SGE command-line based on job settings
-    for job in jobs:
-        job.out = shlex.quote(os.path.join(root_dir, "stdout"))
-        job.err = shlex.quote(os.path.join(root_dir, "stderr"))
+    job.out = shlex.quote(os.path.join(root_dir, "stdout"))
+    job.err = shlex.quote(os.path.join(root_dir, "stderr"))
+
+    # Add the job name, current working directory, and SGE stdout/stderr
+    # directories to the SGE command line. We ask for terse output, so that
+    # qsub reports only the ID of the submitted job
+    args = " -terse -N {} -cwd -o {} -e {} ".format(
+        shlex.quote(job.name), job.out, job.err
+    )
 
-        # Add the job name, current working directory, and SGE stdout/stderr
-        # directories to the SGE command line
-        args = " -N {} -cwd -o {} -e {} ".format(
-            shlex.quote(job.name), job.out, job.err
+    # If a queue is specified, add this to the SGE command line
+    # LP: This has an undeclared variable, not sure why - delete?
+    # if job.queue is not None and job.queue in local_queues:
+    #    args += local_queues[job.queue]
+
+    # If the job is actually a JobGroup, add the task numbering argument. If
+    # only some tasks are to be run, the range covers these, and the task IDs
+    # are passed to the script (see SENTINEL_PROLOGUE), which skips the others
+    if isinstance(job, JobGroup) and job.taskids:
+        args += "-t {}-{} -v PYSGE_TASKS=:{}: ".format(
+            min(job.taskids), max(job.taskids), ":".join(map(str, job.taskids))
         )
+    elif isinstance(job, JobGroup):
+        args += "-t 1:{} ".format(shlex.quote(str(job.tasks)))
 
-        # If a queue is specified, add this to the SGE command line
-        # LP: This has an undeclared variable, not sure why - delete?
-        # if job.queue is not None and job.queue in local_queues:
-        #    args += local_queues[job.queue]
+    # Set the job's priority relative to the user's other jobs, if requested
+    if job.priority is not None:
+        args += "-p {} ".format(int(job.priority))
 
-        # If the job is actually a JobGroup, add the task numbering argument
-        if isinstance(job, JobGroup):
-            args += "-t 1:{} ".format(shlex.quote(str(job.tasks)))
+    # Limit the number of array tasks running at once, if requested
+    if isinstance(job, JobGroup) and job.max_running:
+        args += "-tc {} ".format(int(job.max_running))
 
-        # If there are dependencies for this job, hold the job until they are
-        # complete
-        if len(job.dependencies) > 0:
-            args += "-hold_jid {}".format(
-                ",".join([shlex.quote(dep.name) for dep in job.dependencies])
+    # If there are unfinished dependencies for this job, hold the job until
+    # they are complete. Dependencies are identified by job ID where known, as
+    # job names may not be unique
+    holds = [dep for dep in job.dependencies if not dep.finished]
+    if len(holds) > 0:
+        args += "-hold_jid {}".format(
+            ",".join(
+                [
+                    shlex.quote(dep.name if dep.jobid is None else dep.jobid)
+                    for dep in holds
+                ]
             )
+        )
+
+    # Additional qsub arguments must precede the script path, or qsub will
+    # pass them to the script
+    if sgeargs is not None:
+        args += " {}".format(sgeargs)
+
+    # Build the qsub SGE commandline (passing local environment), with any
+    # arguments to the script following the script path
+    qsubcmd = "{} -V {} {}".format(QSUB_DEFAULT, args, shlex.quote(job.scriptpath))
+    return shlex.split(qsubcmd) + list(job.scriptargs)
+
+
+def parse_qsub_jobid(output):
+    """Return the job ID (as a string) reported by qsub.
+
+    - output        String (or bytes), qsub output
+
+    Both terse output (e.g. 12345, or 12345.1-3:1 for array jobs) and the
+    default output (e.g. Your job 12345 ("name") has been submitted) are
+    understood.
+    """
+    if isinstance(output, bytes):
+        output = output.decode("utf-8")
+    match = re.search(r"(?:^|Your job(?:-array)? )(\d+)", output.strip())
+    if match is None:
+        raise PySGEException("Could not find job ID in qsub output: {}".format(output))
+    return match.group(1)
+
+
+def register_job(job, jobid):
+    """Record the passed job as submitted to SGE with the passed job ID.
+
+    - job           Job object
+    - jobid         String, the SGE job ID
+    """
+    job.jobid = jobid
+    job.submitted = True  # Set the job's submitted flag to True
+    JOB_REGISTRY[jobid] = job
+
+
+def get_job(jobid):
+    """Return the Job submitted in this process with the passed SGE job ID.
+
+    - jobid         String, the SGE job ID
+
+    Raises KeyError if no such job was submitted, or it is no longer in use.
+    """
+    return JOB_REGISTRY[str(jobid)]
+
+
+def register_qsub_output(job, returncode, stdout, stderr):
+    """Record the passed job as submitted, from the output of its qsub call.
+
+    The time of submission is recorded as job.submit_time.
+
+    - job           Job object
+    - returncode    Integer, qsub return code
+    - stdout        Bytes, qsub standard output
+    - stderr        Bytes, qsub standard error
+    """
+    if returncode:
+        raise PySGEException(
+            "qsub failed to submit job {}: {}".format(
+                job.name, stderr.decode("utf-8").strip()
+            )
+        )
+    register_job(job, parse_qsub_jobid(stdout))
+    job.submit_time = time.time()
+
+
+def submit_job(root_dir, job, sgeargs=None, journal=None):
+    """Submit passed job to SGE server with dir as root for output.
+
+    The ID of the submitted job is recorded as job.jobid, and in the
+    in-process job registry.
+
+    - root_dir      Path to output directory
+    - job           Job object
+    - sgeargs       Additional arguments to qsub
+    - journal       SubmissionJournal in which to record the submission
+    """
+    pipe = subprocess.run(
+        build_qsub_cmd(root_dir, job, sgeargs),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    register_qsub_output(job, pipe.returncode, pipe.stdout, pipe.stderr)
+    if journal is not None:
+        journal.record_submitted(job)
+
+
+def submit_safe_jobs(
+    root_dir, jobs, sgeargs=None, workers=SUBMIT_WORKERS, journal=None
+):
+    """Submit passed list of jobs to SGE server with dir as root for output.
+
+    The jobs must not depend on each other. Up to workers qsub calls are
+    made concurrently.
+
+    - root_dir      Path to output directory
+    - jobs          Iterable of Job objects
+    - sgeargs       Additional arguments to qsub
+    - workers       Maximum number of concurrent qsub calls
+    - journal       SubmissionJournal in which to record the submissions
+    """
+    try:
+        if workers <= 1:
+            for job in jobs:
+                submit_job(root_dir, job, sgeargs, journal)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(submit_job, root_dir, job, sgeargs, journal)
+                for job in jobs
+            ]
+        for future in futures:  # Raise the first exception from qsub, if any
+            future.result()
+    finally:
+        if journal is not None:  # Force the wave's submissions to disk
+            journal.sync()
+
 
-        # Build the qsub SGE commandline (passing local environment)
-        qsubcmd = "{} -V {} {}".format(QSUB_DEFAULT, args, shlex.quote(job.scriptpath))
-        if sgeargs is not None:
-            qsubcmd = "{} {}".format(qsubcmd, shlex.quote(sgeargs))
-        safecmd = shlex.split(qsubcmd)
-        subprocess.run(safecmd)
-        job.submitted = True  # Set the job's submitted flag to True
+def cancel_jobs(jobs):
+    """Cancel the passed jobs, identified by their SGE job IDs.
 
+    Jobs that have not been submitted are ignored.
 
-def submit_jobs(root_dir, jobs, sgeargs=None):
+    - jobs          Iterable of Job objects
+    """
+    jobids = [job.jobid for job in jobs if job.jobid is not None]
+    if jobids:
+        subprocess.run(
+            [QDEL_DEFAULT] + jobids, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+
+def submit_jobs(
+    root_dir,
+    jobs,
+    sgeargs=None,
+    workers=SUBMIT_WORKERS,
+    journal=None,
+    throttle=None,
+):
     """Submit passed jobs to SGE server with passed directory as root.
 
+    Jobs are submitted in waves, in topological order of their dependencies,
+    so that no job is submitted before the jobs it depends on. A
+    PySGEException is raised before anything is submitted if the dependencies
+    contain a cycle, or refer to a job that is not being submitted. Within a
+    wave, up to workers jobs are submitted concurrently.
+
+    If a SubmissionThrottle is passed, jobs are instead submitted one at a
+    time, in topological order, each waiting until the throttle releases it.
+
     - root_dir       Path to output directory
     - jobs           List of Job objects
+    - sgeargs        Additional arguments to qsub
+    - workers        Maximum number of concurrent qsub calls
+    - journal        SubmissionJournal in which to record the submissions
+    - throttle       SubmissionThrottle limiting jobs in flight and qsub rate
+    """
+    if throttle is None:
+        for wave in JobGraph(jobs).waves():
+            submit_safe_jobs(root_dir, wave, sgeargs, workers, journal)
+        return
+    try:
+        for job in JobGraph(jobs).order():
+            throttle.wait()
+            submit_job(root_dir, job, sgeargs, journal)
+            throttle.track(job)
+    finally:
+        if journal is not None:
+            journal.sync()
+
+
+def wait_for_jobs(jobs, interval=SGE_WAIT, max_interval=SGE_MAX_WAIT):
+    """Wait until all passed jobs have finished.
+
+    All jobs are polled together, with a single qstat query per cycle.
+
+    - jobs           Iterable of Job objects
+    - interval       Initial time (s) between polls
+    - max_interval   Upper bound on time (s) between polls
     """
-    waiting = list(jobs)  # List of jobs still to be done
-    # Loop over the list of pending jobs, while there still are any
-    while len(waiting) > 0:
-        # extract submittable jobs
-        submittable = extract_submittable_jobs(waiting)
-        # run those jobs
-        submit_safe_jobs(root_dir, submittable, sgeargs)
-        # remove those from the waiting list
-        for job in submittable:
-            waiting.remove(job)
+    poller = JobPoller(jobs, interval=interval, max_interval=max_interval)
+    poller.wait()
+
+
+def wait_for_sentinels(
+    jobs, root_dir=os.curdir, interval=SGE_WAIT, max_interval=SGE_MAX_WAIT, timeout=None
+):
+    """Wait until all passed jobs have written exit status sentinel files.
+
+    The jobs' scripts must have been built with sentinels=True. No scheduler
+    queries are made, and the exit code of each task is recorded in
+    job.exit_codes. Returns the number of jobs still active, which is
+    nonzero only if the timeout was reached.
+
+    - jobs           Iterable of submitted Job objects
+    - root_dir       Root directory for SGE and job output
+    - interval       Initial time (s) between scans of the status directory
+    - max_interval   Upper bound on time (s) between scans
+    - timeout        Maximum time (s) to wait, or None to wait indefinitely
+    """
+    watcher = SentinelWatcher(
+        jobs,
+        os.path.join(root_dir, "status"),
+        interval=interval,
+        max_interval=max_interval,
+    )
+    return watcher.wait(timeout)
+
+
+def build_throttle(
+    root_dir=os.curdir,
+    sentinels=False,
+    max_in_flight=None,
+    submit_rate=None,
+    max_interval=SGE_MAX_WAIT,
+):
+    """Return a SubmissionThrottle for jobs submitted under root_dir.
+
+    Finished jobs are detected from sentinel files if sentinels is True, and
+    by polling qstat otherwise.
+
+    - root_dir       Root directory for SGE and job output
+    - sentinels      If True, job scripts write sentinel files
+    - max_in_flight  Maximum number of submitted jobs not yet finished
+    - submit_rate    Maximum number of qsub calls per second
+    - max_interval   Upper bound on time (s) between polls for free slots
+    """
+    if sentinels:
+        tracker = SentinelWatcher(
+            [], os.path.join(root_dir, "status"), max_interval=max_interval
+        )
+    else:
+        tracker = JobPoller([], max_interval=max_interval)
+    return SubmissionThrottle(
+        tracker, max_in_flight, submit_rate, max_interval=max_interval
+    )
+
 
+def write_timing_report(jobs, root_dir=os.curdir, accounting=True, workers=1):
+    """Write a timing report for the passed finished jobs, and return its path.
 
-def build_and_submit_jobs(jobs, root_dir=os.curdir, sgeargs=None, wait=False):
+    The report is written as JSON to pysge_timing.json in root_dir, with one
+    record per task giving its submission, start and finish times, queue
+    wait and run time, and exit code, together with accounting data
+    (wallclock, CPU time, maxvmem, etc.) from qacct.
+
+    - jobs           Iterable of finished Job objects
+    - root_dir       Root directory for SGE and job output
+    - accounting     If True, read accounting data from qacct
+    - workers        Maximum number of concurrent qacct calls
+    """
+    report = TimingReport(jobs)
+    if accounting:
+        report.collect_accounting(workers)
+    path = os.path.join(root_dir, TIMING_FILENAME)
+    report.write(path)
+    return path
+
+
+def build_and_submit_jobs(
+    jobs,
+    root_dir=os.curdir,
+    sgeargs=None,
+    wait=False,
+    max_interval=SGE_MAX_WAIT,
+    workers=SUBMIT_WORKERS,
+    manifest=False,
+    sentinels=False,
+    journal=False,
+    retries=0,
+    backoff=RETRY_BACKOFF,
+    timing=False,
+    max_in_flight=None,
+    submit_rate=None,
+    priorities=False,
+):
     """Submit passed iterable of Job objects to SGE.
 
     SGE's output is placed in root_dir
     Additional arguments to SGE are taken as sgeargs
 
-    - jobs       List of Job objects, describing each job to be submitted
-    - root_dir   Root directory for SGE and job output
-    - sgeargs    Additional arguments to qsub
-    - wait       If True, wait for submitted jobs to complete before returning
+    - jobs           List of Job objects, describing each job to be submitted
+    - root_dir       Root directory for SGE and job output
+    - sgeargs        Additional arguments to qsub
+    - wait           If True, wait for submitted jobs to complete before
+                     returning
+    - max_interval   Upper bound on time (s) between status polls when waiting
+    - workers        Maximum number of concurrent qsub calls
+    - manifest       If True, write all job scripts to a single manifest
+    - sentinels      If True, jobs write exit status sentinel files, and these
+                     (rather than qstat) are used to detect completion
+    - journal        If True, record submitted and finished jobs in a journal
+                     in root_dir, so that the run can be resumed with
+                     resume_jobs() if this process dies
+    - retries        Maximum number of times to resubmit failed tasks (see
+                     retry_failed_jobs()); requires wait and sentinels
+    - backoff        Delay (s) before the first round of retries
+    - timing         If True, write a timing report for the jobs to root_dir
+                     once they have finished (see write_timing_report());
+                     requires wait
+    - max_in_flight  Maximum number of submitted jobs not yet finished; the
+                     remaining jobs are submitted as earlier ones finish
+    - submit_rate    Maximum number of qsub calls per second
+    - priorities     If True, give jobs with more jobs downstream of them a
+                     higher priority (see assign_priorities())
     """
     # If the passed set of jobs is not a list, turn it into one. This makes the
     # use of a single JobGroup a little more intutitive
     if not isinstance(jobs, list):
         jobs = [jobs]
+    if retries and not (wait and sentinels):
+        raise PySGEException("Retrying failed tasks requires wait and sentinels")
+    if timing and not wait:
+        raise PySGEException("Writing a timing report requires wait")
 
     # Build and submit the passed jobs
+    if priorities:
+        assign_priorities(jobs)
     build_directories(root_dir)  # build all necessary directories
-    build_job_scripts(root_dir, jobs)  # build job scripts
-    submit_jobs(root_dir, jobs, sgeargs)  # submit the jobs to SGE
-    if wait:
+    build_job_scripts(root_dir, jobs, manifest, sentinels)  # build job scripts
+    journal = SubmissionJournal(root_dir) if journal else None
+    throttle = None
+    if max_in_flight or submit_rate:
+        throttle = build_throttle(
+            root_dir, sentinels, max_in_flight, submit_rate, max_interval
+        )
+    try:
+        if journal is not None:
+            journal.open()
+        # submit to SGE
+        submit_jobs(root_dir, jobs, sgeargs, workers, journal, throttle)
+        if wait:
+            wait_for_completion(jobs, root_dir, sentinels, max_interval, journal)
+        if retries:
+            retry_failed_jobs(
+                jobs,
+                root_dir,
+                sgeargs,
+                retries,
+                backoff,
+                max_interval,
+                workers,
+                journal,
+            )
+        if timing:
+            write_timing_report(jobs, root_dir, workers=workers)
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def wait_for_completion(
+    jobs, root_dir=os.curdir, sentinels=False, max_interval=SGE_MAX_WAIT, journal=None
+):
+    """Wait until all passed jobs have finished.
+
+    - jobs           Iterable of submitted Job objects
+    - root_dir       Root directory for SGE and job output
+    - sentinels      If True, detect completion from sentinel files, otherwise
+                     poll qstat
+    - max_interval   Upper bound on time (s) between status checks
+    - journal        SubmissionJournal in which to record finished jobs
+    """
+    if sentinels:
+        wait_for_sentinels(jobs, root_dir, max_interval=max_interval)
+    else:
+        wait_for_jobs(jobs, max_interval=max_interval)
+    if journal is not None:
         for job in jobs:
-            job.wait()
+            journal.record_finished(job)
+
+
+def failed_tasks(job):
+    """Return sorted list of the passed job's task IDs with nonzero exit codes.
+
+    - job            Job object
+    """
+    return sorted(task for task, code in job.exit_codes.items() if code)
+
+
+def retry_failed_jobs(
+    jobs,
+    root_dir=os.curdir,
+    sgeargs=None,
+    retries=RETRIES,
+    backoff=RETRY_BACKOFF,
+    max_interval=SGE_MAX_WAIT,
+    workers=SUBMIT_WORKERS,
+    journal=None,
+):
+    """Resubmit failed tasks of the passed finished jobs, and wait for them.
+
+    The jobs must have been built with sentinels=True, and waited on, so
+    that the exit code of each task is known. Only failed single jobs, and
+    the failed tasks of JobGroups, are resubmitted; a failed job that
+    depends on another failed job holds until the retry of its dependency
+    has finished. Jobs that depend on a failed job are not rerun. Each
+    round of retries is preceded by a delay of backoff * 2 ** (round - 1)
+    seconds, and at most retries rounds are made.
+
+    Returns the list of jobs that still have failed tasks.
+
+    - jobs           Iterable of finished Job objects
+    - root_dir       Root directory for SGE and job output
+    - sgeargs        Additional arguments to qsub
+    - retries        Maximum number of times to retry a task
+    - backoff        Delay (s) before the first round of retries
+    - max_interval   Upper bound on time (s) between status checks
+    - workers        Maximum number of concurrent qsub calls
+    - journal        SubmissionJournal in which to record the retries
+    """
+    for attempt in range(retries):
+        failed = [job for job in jobs if failed_tasks(job)]
+        if not failed:
+            break
+        time.sleep(backoff * 2 ** attempt)
+        for job in failed:
+            tasks = failed_tasks(job)
+            for task in tasks:
+                del job.exit_codes[task]
+                job.task_times.pop(task, None)
+            if isinstance(job, JobGroup):
+                job.taskids = tasks
+            job.submitted, job.finished = False, False
+        submit_jobs(root_dir, failed, sgeargs, workers, journal)
+        wait_for_completion(failed, root_dir, True, max_interval, journal)
+        for job in failed:
+            if isinstance(job, JobGroup):
+                job.taskids = None
+    return [job for job in jobs if failed_tasks(job)]
+
+
+def resume_jobs(
+    jobs,
+    root_dir=os.curdir,
+    sgeargs=None,
+    wait=False,
+    max_interval=SGE_MAX_WAIT,
+    workers=SUBMIT_WORKERS,
+    manifest=False,
+    sentinels=False,
+):
+    """Resume a run started by build_and_submit_jobs(..., journal=True).
+
+    The journal in root_dir is read, and each passed job that it records as
+    submitted is reattached to its SGE job ID, rather than being submitted
+    again. The state of reattached jobs is checked once (with a qstat query,
+    or a scan for sentinel files), and only jobs that were never submitted
+    are submitted, holding on any reattached jobs still running. Jobs are
+    matched to the journal by name, so job names must be unique. Other
+    arguments are as for build_and_submit_jobs(), and should match those of
+    the original run.
+
+    Returns the list of jobs submitted by this call.
+    """
+    if not isinstance(jobs, list):
+        jobs = [jobs]
+    if len({job.name for job in jobs}) < len(jobs):
+        raise PySGEException("Job names must be unique to resume a run")
+
+    with SubmissionJournal(root_dir) as journal:
+        # Reattach jobs that were submitted before, and update their status
+        states = journal.load()
+        reattached = []
+        for job in jobs:
+            state = states.get(job.name)
+            if state is None:
+                continue
+            register_job(job, state["jobid"])
+            job.submit_time = state["submit_time"]
+            job.finished = state["finished"]
+            job.exit_codes = state["exit_codes"]
+            if not job.finished:
+                reattached.append(job)
+        if reattached and sentinels:
+            SentinelWatcher(reattached, os.path.join(root_dir, "status")).scan()
+        elif reattached:
+            JobPoller(reattached).poll()
+        for job in reattached:
+            if job.finished:
+                journal.record_finished(job)
+
+        # Submit the jobs that were never submitted
+        pending = [job for job in jobs if not job.submitted]
+        build_directories(root_dir)
+        build_job_scripts(root_dir, pending, manifest, sentinels)
+        submit_jobs(root_dir, pending, sgeargs, workers, journal)
+        if wait:
+            wait_for_completion(
+                [job for job in jobs if not job.finished],
+                root_dir,
+                sentinels,
+                max_interval,
+                journal,
+            )
+    return pending
+
+
+def build_and_run_local_jobs(
+    jobs, root_dir=os.curdir, workers=None, manifest=False, timing=False
+):
+    """Run passed iterable of Job objects on the local machine.
+
+    Jobs are run as they would be under SGE, but by a LocalScheduler: each
+    job (or JobGroup task) starts as soon as its dependencies have finished,
+    with up to workers tasks running at once. Output is placed in root_dir.
+    The exit code of each task is recorded in job.exit_codes.
+
+    - jobs       List of Job objects, describing each job to be run
+    - root_dir   Root directory for job output
+    - workers    Maximum number of concurrent tasks (default: number of CPUs)
+    - manifest   If True, write all job scripts to a single manifest
+    - timing     If True, write a timing report for the jobs to root_dir
+    """
+    if not isinstance(jobs, list):
+        jobs = [jobs]
+
+    build_directories(root_dir)  # build all necessary directories
+    build_job_scripts(root_dir, jobs, manifest)  # build job scripts
+    LocalScheduler(root_dir, workers).run(jobs)
+    if timing:
+        write_timing_report(jobs, root_dir, accounting=False)
+
+
+async def async_submit_job(root_dir, job, sgeargs=None):
+    """Coroutine: submit passed job to SGE server with dir as root for output.
+
+    - root_dir      Path to output directory
+    - job           Job object
+    - sgeargs       Additional arguments to qsub
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *build_qsub_cmd(root_dir, job, sgeargs),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    register_qsub_output(job, proc.returncode, stdout, stderr)
+
+
+async def async_submit_jobs(root_dir, jobs, sgeargs=None, workers=SUBMIT_WORKERS):
+    """Coroutine: submit passed jobs to SGE server with passed directory as root.
+
+    Jobs are submitted in waves, as for submit_jobs(), with up to workers
+    qsub calls running concurrently within each wave.
+
+    - root_dir       Path to output directory
+    - jobs           List of Job objects
+    - sgeargs        Additional arguments to qsub
+    - workers        Maximum number of concurrent qsub calls
+    """
+    semaphore = asyncio.Semaphore(max(workers, 1))
+
+    async def submit(job):
+        async with semaphore:
+            await async_submit_job(root_dir, job, sgeargs)
+
+    for wave in JobGraph(jobs).waves():
+        await asyncio.gather(*[submit(job) for job in wave])
+
+
+async def async_wait_for_jobs(jobs, interval=SGE_WAIT, max_interval=SGE_MAX_WAIT):
+    """Coroutine: wait until all passed jobs have finished.
+
+    All jobs are polled together, with a single qstat query per cycle.
+
+    - jobs           Iterable of Job objects
+    - interval       Initial time (s) between polls
+    - max_interval   Upper bound on time (s) between polls
+    """
+    poller = AsyncJobPoller(jobs, interval=interval, max_interval=max_interval)
+    await poller.wait()
+
+
+async def async_build_and_submit_jobs(
+    jobs,
+    root_dir=os.curdir,
+    sgeargs=None,
+    wait=False,
+    max_interval=SGE_MAX_WAIT,
+    workers=SUBMIT_WORKERS,
+    manifest=False,
+):
+    """Coroutine: submit passed iterable of Job objects to SGE.
+
+    Returns a list of futures, one per job, each resolving to its job when
+    that job has finished. Arguments are as for build_and_submit_jobs().
+    """
+    if not isinstance(jobs, list):
+        jobs = [jobs]
+
+    # Script files are written in a worker thread, to avoid blocking the loop
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, build_directories, root_dir)
+    await loop.run_in_executor(None, build_job_scripts, root_dir, jobs, manifest)
+    await async_submit_jobs(root_dir, jobs, sgeargs, workers)
+
+    poller = AsyncJobPoller(max_interval=max_interval)
+    futures = [poller.track(job) for job in jobs]
+    if wait:
+        await poller.wait()
+    return futures
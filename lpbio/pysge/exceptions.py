@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""Exceptions raised by the pysge module"""
+
+
+class PySGEException(Exception):
+    """General exception for pysge."""
+
+    def __init__(self, msg="Error in pysge module"):
+        """Instantiate class."""
+        Exception.__init__(self, msg)
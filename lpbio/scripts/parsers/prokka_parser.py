@@ -91,7 +91,80 @@ def parse_cmdline(argv=None):
         dest="extensions",
         action="store",
         default="fas,fasta,fna,fa",
-        help="allowed input file extensions",
+        help="allowed input file extensions; gzip-compressed files with "
+        "these extensions followed by .gz are also used",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        dest="recursive",
+        action="store_true",
+        default=False,
+        help="search subdirectories of the input directory for input files",
+    )
+    parser.add_argument(
+        "--include",
+        dest="include",
+        action="append",
+        default=None,
+        metavar="PATTERN",
+        help="only use input files whose name matches this shell-style "
+        "pattern (may be given more than once)",
+    )
+    parser.add_argument(
+        "--exclude",
+        dest="exclude",
+        action="append",
+        default=None,
+        metavar="PATTERN",
+        help="ignore input files and directories whose name matches this "
+        "shell-style pattern (may be given more than once)",
+    )
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        action="store_true",
+        default=False,
+        help="with multiprocessing, start annotating input files as they are "
+        "found, in the order found, rather than largest first",
+    )
+
+    parser.add_argument(
+        "--scratch",
+        dest="scratch",
+        action="store",
+        default=None,
+        help="node-local scratch directory (e.g. /dev/shm) in which to run "
+        "prokka; finished output is moved to the output directory. "
+        "Compressed inputs are always decompressed to scratch storage, in "
+        "$TMPDIR or /tmp if this is not set",
+    )
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        action="store",
+        default=None,
+        help="write FASTA statistics for the input files to this "
+        "tab-separated file, and use them to order inputs by sequence length "
+        "and skip inputs with no contigs of at least --mincontiglen",
+    )
+    parser.add_argument(
+        "--aggregate",
+        dest="aggregate",
+        action="store",
+        default=None,
+        help="after annotation, combine the features of all genomes in the "
+        "output directory into one table, written to this NumPy .npz file "
+        "(see lpbio.prokka.load_annotations())",
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cachedir",
+        action="store",
+        default=None,
+        help="directory for cached prokka results; unchanged genomes already "
+        "annotated with the same settings are not annotated again",
     )
 
     # Prokka-specific arguments
@@ -100,7 +173,7 @@ def parse_cmdline(argv=None):
         action="store",
         dest="config",
         default=None,
-        help="path to config file for bulk_prokka run"
+        help="path to config file for bulk_prokka run",
     )
     parser.add_argument(
         "--prokka_exe",
@@ -146,9 +219,20 @@ def parse_cmdline(argv=None):
         action="store",
         default=None,
         type=int,
-        help="Number of worker processes for multiprocessing "
+        help="Number of prokka processes to run at once with multiprocessing "
         "(default zero, meaning use all available cores)",
     )
+    parser.add_argument(
+        "--cpus",
+        dest="cpus",
+        action="store",
+        default=0,
+        type=int,
+        help="Total number of CPUs for prokka; with multiprocessing these are "
+        "shared between genomes by input size, and with SGE each task gets "
+        "this many (default zero, meaning all available cores with "
+        "multiprocessing, and the prokka default with SGE)",
+    )
     parser.add_argument(
         "--SGEgroupsize",
         dest="sgegroupsize",
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Provide a content-addressed cache of prokka results for bulk_prokka
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+# Name of the file recording the cache key of a complete prokka output
+# directory. It is written only when prokka succeeds, so its presence marks
+# the output as complete
+STAMP_FILENAME = ".bulk_prokka_key"
+
+# prokka arguments that do not change its results, with the number of
+# values each takes; these are left out of cache keys
+IGNORED_ARGS = {"--outdir": 1, "--force": 0, "--quiet": 0, "--cpus": 1}
+
+
+def hash_file(path, blocksize=1 << 20):
+    """Return the SHA-256 hex digest of the content of the passed file.
+
+    Gzip-compressed (.gz) files are hashed by their decompressed content, so
+    that a genome has the same key whether or not it is compressed.
+    """
+    digest = hashlib.sha256()
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as ifh:
+        for block in iter(lambda: ifh.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_prokka_version(prokka_exe):
+    """Return the version string reported by prokka --version.
+
+    Depending on its version, prokka reports this on stdout or stderr.
+    """
+    pipe = subprocess.run(
+        [prokka_exe, "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    output = (pipe.stdout + pipe.stderr).decode("utf-8").split()
+    return output[-1] if output else ""
+
+
+def effective_args(cmd):
+    """Return the arguments of a prokka command-line that affect its results.
+
+    The executable, the input file (the final argument) and arguments that
+    do not change prokka's output (e.g. --outdir) are removed, so that the
+    same genome annotated with the same settings gives the same arguments
+    wherever its files are.
+    """
+    argv = shlex.split(cmd)[1:-1]
+    args, idx = [], 0
+    while idx < len(argv):
+        if argv[idx] in IGNORED_ARGS:
+            idx += 1 + IGNORED_ARGS[argv[idx]]
+            continue
+        args.append(argv[idx])
+        idx += 1
+    return args
+
+
+def build_cache_key(input_hash, prokka_version, cmd):
+    """Return the cache key for a genome annotated with the passed command.
+
+    - input_hash       String, hash of the input FASTA content (hash_file())
+    - prokka_version   String, prokka version (get_prokka_version())
+    - cmd              String, prokka command-line
+    """
+    data = json.dumps([input_hash, prokka_version, effective_args(cmd)])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def read_stamp(outdir):
+    """Return the cache key recorded in a prokka output directory, or None."""
+    try:
+        with open(os.path.join(outdir, STAMP_FILENAME), "r") as ifh:
+            return ifh.read().strip()
+    except OSError:
+        return None
+
+
+def write_stamp(outdir, key):
+    """Record the cache key of a complete prokka output directory."""
+    with open(os.path.join(outdir, STAMP_FILENAME), "w") as ofh:
+        ofh.write("{}\n".format(key))
+
+
+def stamp_command(cmd, outdir, key):
+    """Return the shell command-line, extended to stamp its output with the key.
+
+    The stamp is written only if prokka exits successfully. This is for
+    command-lines run by a shell, e.g. in SGE jobs; see write_stamp() for
+    command-lines run directly.
+    """
+    return "{} && printf '%s\\n' {} > {}".format(
+        cmd, shlex.quote(key), shlex.quote(os.path.join(outdir, STAMP_FILENAME))
+    )
+
+
+def link_tree(src, dest):
+    """Hard-link the files of directory src into a new directory dest.
+
+    Files are copied instead where they cannot be linked (e.g. across
+    filesystems).
+    """
+    os.makedirs(dest)
+    for entry in os.scandir(src):
+        target = os.path.join(dest, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            link_tree(entry.path, target)
+            continue
+        try:
+            os.link(entry.path, target)
+        except OSError:
+            shutil.copy2(entry.path, target)
+
+
+class ProkkaCache:
+    """Content-addressed store of complete prokka output directories.
+
+    Each result is stored under the cache key of the run that made it (see
+    build_cache_key()), and is hard-linked into place when the same genome
+    is annotated again with the same prokka version and arguments.
+    """
+
+    def __init__(self, cachedir):
+        """Instantiate a ProkkaCache object.
+
+        - cachedir         Path to the directory holding cached results
+        """
+        self.cachedir = cachedir
+        os.makedirs(cachedir, exist_ok=True)
+
+    def path(self, key):
+        """Return the path at which the result with the passed key is stored."""
+        return os.path.join(self.cachedir, key[:2], key)
+
+    def __contains__(self, key):
+        """Return True if a complete result with the passed key is stored."""
+        return read_stamp(self.path(key)) == key
+
+    def store(self, key, outdir):
+        """Store the complete prokka output directory outdir under the key.
+
+        The result is linked into a temporary directory, which is renamed
+        into place, so that a partly stored result is never seen.
+        """
+        if key in self:
+            return
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        tmpdir = tempfile.mkdtemp(dir=os.path.dirname(self.path(key)))
+        link_tree(outdir, os.path.join(tmpdir, key))
+        try:
+            os.rename(os.path.join(tmpdir, key), self.path(key))
+        except OSError:  # Stored concurrently by another run
+            pass
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def fetch(self, key, outdir):
+        """Hard-link the result stored under the key into outdir.
+
+        Any existing outdir is replaced.
+        """
+        if os.path.isdir(outdir):
+            shutil.rmtree(outdir)
+        link_tree(self.path(key), outdir)
@@ -39,38 +39,94 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import copy
 import csv
-import multiprocessing
+import fnmatch
+import itertools
 import os
 import shlex
 import shutil
 import subprocess
-import sys
 import time
 
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_any
+
 from lpbio import pysge
+from lpbio.fasta import FastaError, summarise_fastas, write_summary
+from lpbio.prokka import ProkkaOutputError, aggregate_prokka_outputs
 
 from .. import __version__
 from .logger import build_logger
 from .parsers.prokka_parser import parse_cmdline
+from .prokka_cache import (
+    ProkkaCache,
+    build_cache_key,
+    get_prokka_version,
+    hash_file,
+    read_stamp,
+    stamp_command,
+    write_stamp,
+)
+from .prokka_staging import needs_staging, stage_command, strip_compression
+
+# factory class for the outcome of a local prokka run
+ProkkaResult = namedtuple("ProkkaResult", "cmd returncode logfile")
+
+
+def matches_any(name, patterns):
+    """Return True if the name matches any of the shell-style patterns"""
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns or ())
+
+
+def iter_inputs(args, logger):
+    """Yield input file paths, relative to args.indir, as they are found
+
+    Input files have an extension in args.extensions (optionally followed
+    by .gz, for gzip-compressed files), and a name that
+    matches any of the args.include patterns (if given) and none of the
+    args.exclude patterns. If args.recursive is set, subdirectories are
+    searched too, except those whose name matches an args.exclude pattern;
+    symbolic links to directories are not followed, so that a link cannot
+    make the search loop forever. Directories are read with os.scandir(),
+    one at a time, so that the first files are yielded before the rest of
+    the tree is walked.
+    """
+    if not os.path.isdir(args.indir):
+        logger.error("Input directory %s does not exist", args.indir)
+        return
+    dirs = [""]  # Directories to search, relative to args.indir
+    while dirs:
+        reldir = dirs.pop()
+        with os.scandir(os.path.join(args.indir, reldir)) as entries:
+            for entry in entries:
+                if matches_any(entry.name, args.exclude):
+                    continue
+                relpath = os.path.join(reldir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if args.recursive:
+                        dirs.append(relpath)
+                elif (
+                    os.path.splitext(strip_compression(entry.name))[-1]
+                    in args.extensions
+                    and (not args.include or matches_any(entry.name, args.include))
+                    and entry.is_file()
+                ):
+                    yield relpath
 
 
 def identify_inputs(args, logger):
-    """Return True if input directory exists and contains files"""
-    if not os.path.isdir(args.indir):
-        logger.error("Input directory %s does not exist", args.indir)
-        return False
-    infiles = [
-        fname
-        for fname in os.listdir(args.indir)
-        if os.path.splitext(fname)[-1] in args.extensions
-    ]
-    if not len(infiles):
+    """Return list of input files in the input directory (see iter_inputs())
+
+    A missing input directory is reported by iter_inputs(), and gives an
+    empty list.
+    """
+    infiles = list(iter_inputs(args, logger))
+    if not infiles:
         logger.error(
-            "Input directory %s contains no files with extension in %s",
-            args.indir,
-            args.extensions,
+            "Found no files with extension in %s in %s", args.extensions, args.indir
         )
+        return infiles
     logger.info(
         "Input directory %s exists and contains %d files with extension in %s",
         args.indir,
@@ -80,6 +136,51 @@ def identify_inputs(args, logger):
     return infiles
 
 
+def discover_inputs(args, logger, stream=False):
+    """Return the input files to annotate, or None if there are none
+
+    With stream, input files are returned as an iterator, in the order they
+    are found by iter_inputs(), so that local jobs can start as soon as their
+    input is found, rather than after the whole input tree is read; otherwise
+    they are returned as a list (see identify_inputs()).
+    """
+    if stream:
+        infiles = iter_inputs(args, logger)
+        first = next(infiles, None)
+        infiles = itertools.chain([first], infiles)
+    else:
+        infiles = identify_inputs(args, logger)
+        first = infiles[0] if infiles else None
+    if first is None:
+        return None
+    return infiles
+
+
+def prepare_outdir(args, logger):
+    """Return True if prokka output can be written to args.outdir
+
+    An existing output directory is removed if args.force is set, and
+    otherwise reused only with a cache, so that only genomes without a
+    complete result are run.
+    """
+    if not os.path.isdir(args.outdir):
+        return True
+    if args.force:
+        logger.warning(
+            "Removing output directory %s and everything under it", args.outdir
+        )
+        shutil.rmtree(args.outdir)
+    elif args.cachedir is not None:
+        logger.info("Reusing complete results in %s", args.outdir)
+    else:
+        logger.error(
+            "Cannot use existing directory %s for prokka output (exiting)",
+            args.outdir,
+        )
+        return False
+    return True
+
+
 def load_bulk_prokka_config(fname, logger=None):
     """Load bulk_prokka config file into dictionary keyed by filestem"""
     if not os.path.isfile(fname):
@@ -137,9 +238,96 @@ def add_prokka_arg(cmd, key, val, logger=None):
     return cmd
 
 
-def build_prokka_cmd(fname, args, config=None, logger=None):
-    """Construct a prokka command-line from the arguments"""
-    stem = shlex.quote(os.path.splitext(fname)[0])
+def order_by_size(infiles, args):
+    """Return input files and their sizes, largest first
+
+    Input size is a proxy for prokka's runtime, so starting the largest
+    genomes first stops them from holding up the end of a run.
+    """
+    sizes = {
+        fname: os.path.getsize(os.path.join(args.indir, fname)) for fname in infiles
+    }
+    infiles = sorted(infiles, key=sizes.get, reverse=True)
+    return infiles, [sizes[fname] for fname in infiles]
+
+
+def write_input_stats(args, inputs, logger):
+    """Write FASTA statistics for the input files to args.stats
+
+    Returns the input files and their sequence lengths, largest first, or
+    None if the inputs cannot be summarised, or none has sequence to
+    annotate. Statistics are collected with lpbio.fasta. Total sequence
+    length is a better guide to prokka's runtime than file size, which
+    depends on compression and line wrapping. Inputs with no contig of at
+    least args.mincontiglen are dropped, as prokka would have no sequence to
+    annotate.
+    """
+    try:
+        stats = summarise_fastas(
+            [os.path.join(args.indir, fname) for fname in inputs],
+            args.mincontiglen,
+            args.workers,
+        )
+    except FastaError as exc:
+        logger.error("Could not summarise input: %s (exiting)", exc)
+        return None
+    write_summary(stats, args.stats)
+    logger.info("Wrote statistics for %d input files to %s", len(stats), args.stats)
+    kept = []
+    for fname, stat in zip(inputs, stats):
+        if stat.contigs == stat.short_contigs:
+            logger.warning(
+                "Skipping %s: no contigs of at least %s bases",
+                fname,
+                args.mincontiglen,
+            )
+        else:
+            kept.append((stat.length, fname))
+    if not kept:
+        logger.error("No input with sequence to annotate (exiting)")
+        return None
+    kept.sort(reverse=True)
+    return [fname for _, fname in kept], [length for length, _ in kept]
+
+
+def allocate_cpus(sizes, budget, workers):
+    """Return the number of CPUs to give prokka for each input size
+
+    - sizes         List of input file sizes
+    - budget        Integer, total number of CPUs available
+    - workers       Integer, number of prokka processes run at once
+
+    An input of average size gets an equal share of the budget between the
+    workers; larger inputs get proportionally more, up to the whole budget,
+    and smaller inputs proportionally fewer, down to one CPU.
+    """
+    if not sizes:
+        return []
+    share = budget / min(workers, len(sizes))
+    mean = sum(sizes) / len(sizes) or 1
+    return [min(budget, max(1, int(round(share * size / mean)))) for size in sizes]
+
+
+def order_inputs(infiles, args, logger):
+    """Return input files and their sizes, largest first, or None on error
+
+    Inputs are ordered by sequence length if args.stats is set (see
+    write_input_stats()), and by file size otherwise (see order_by_size()).
+    """
+    if args.stats is not None:
+        return write_input_stats(args, infiles, logger)
+    return order_by_size(infiles, args)
+
+
+def build_prokka_cmd(fname, args, config=None, logger=None, cpus=None):
+    """Construct a prokka command-line from the arguments
+
+    If cpus is given, prokka is told to use that many CPUs. Input files in
+    subdirectories of args.indir are written to the same subdirectories of
+    args.outdir, and are looked up in the config by the stem of their name.
+    Paths are only quoted as they are added to the command-line.
+    """
+    stem = os.path.splitext(strip_compression(fname))[0]
     fpath = os.path.join(args.indir, fname)
 
     cmd = "{} --mincontiglen {} --outdir {}".format(
@@ -147,17 +335,20 @@ def build_prokka_cmd(fname, args, config=None, logger=None):
         shlex.quote(str(args.mincontiglen)),
         shlex.quote(os.path.join(args.outdir, stem)),
     )
+    if cpus is not None:
+        cmd = " ".join([cmd, "--cpus", str(cpus)])
 
     # Process config info
+    confstem = os.path.basename(stem)
     if config is not None:
-        if stem not in config:
+        if confstem not in config:
             logger.warning(
                 "Tried to process filestem %s, but not found in config file (skipping)",
-                stem,
+                confstem,
             )
         else:
-            for key in sorted(config[stem]):
-                cmd = add_prokka_arg(cmd, key, config[stem][key], logger)
+            for key in sorted(config[confstem]):
+                cmd = add_prokka_arg(cmd, key, config[confstem][key], logger)
 
     if args.compliant:  # Force Genbankk/ENA/DDJB compliance
         cmd = " ".join([cmd, "--compliant"])
@@ -171,41 +362,365 @@ def build_prokka_cmd(fname, args, config=None, logger=None):
     return cmd
 
 
-def run_multiprocessing(cmdlist, args, logger):
-    """Run the commands in the list with multiprocessing"""
-    if not args.workers:
-        logger.info("Using maximum number of multiprocessing worker threads")
+def build_commands(infiles, args, config, logger):
+    """Return input files and their prokka command-lines, or None on error
+
+    Command-lines are ordered largest genome first (see order_inputs()).
+    Local runs split the args.cpus budget between genomes by size (see
+    allocate_cpus()); SGE tasks all get args.cpus.
+    """
+    ordered = order_inputs(infiles, args, logger)
+    if ordered is None:
+        return None
+    infiles, sizes = ordered
+    if args.scheduler == "multiprocessing":
+        budget = args.cpus or os.cpu_count() or 1
+        workers = args.workers or os.cpu_count() or 1
+        cpulist = allocate_cpus(sizes, budget, workers)
     else:
-        logger.info("Using %d multiprocessing worker threads", args.workers)
-
-    pool = multiprocessing.Pool(processes=args.workers)
-    results = [
-        pool.apply_async(
-            subprocess.run,
-            (cline,),
-            {
-                "shell": sys.platform != "win32",
-                "stdout": subprocess.PIPE,
-                "stderr": subprocess.PIPE,
-            },
+        cpulist = [args.cpus or None] * len(infiles)
+    cmdlist = [
+        build_prokka_cmd(
+            fname=fname, args=args, config=config, logger=logger, cpus=cpus
         )
-        for cline in cmdlist
+        for fname, cpus in zip(infiles, cpulist)
     ]
-    pool.close()
-    pool.join()
+    logger.info("Compiled %d prokka command-lines", len(cmdlist))
+    return infiles, cmdlist
+
+
+def stream_commands(infiles, args, config, logger):
+    """Return an iterator of input files and one of their prokka command-lines
+
+    Command-lines are built as input files are taken from infiles (an
+    iterator), and each gets an equal share of the args.cpus budget. With a
+    cache, the returned input files are teed from infiles, to be consumed
+    alongside the command-lines by iter_uncached(), which needs both.
+    """
+    budget = args.cpus or os.cpu_count() or 1
+    workers = args.workers or os.cpu_count() or 1
+    fnames = infiles
+    if args.cachedir is not None:
+        infiles, fnames = itertools.tee(infiles)
+    cmdlist = (
+        build_prokka_cmd(
+            fname=fname,
+            args=args,
+            config=config,
+            logger=logger,
+            cpus=max(1, budget // workers),
+        )
+        for fname in fnames
+    )
+    logger.info("Streaming prokka command-lines as input files are found")
+    if args.stats is not None:
+        logger.warning("Input statistics are not collected with --stream")
+    return infiles, cmdlist
+
+
+def get_outdir(cmd):
+    """Return the output directory of a prokka command-line"""
+    argv = shlex.split(cmd)
+    return argv[argv.index("--outdir") + 1]
+
+
+def get_cpus(cmd):
+    """Return the number of CPUs requested by a prokka command-line
+
+    Command-lines without --cpus are counted as using one CPU.
+    """
+    argv = shlex.split(cmd)
+    if "--cpus" not in argv:
+        return 1
+    return int(argv[argv.index("--cpus") + 1])
+
+
+def iter_uncached(infiles, cmdlist, args, logger, pending):
+    """Yield prokka command-lines for genomes without a complete result
+
+    Each genome's cache key combines the hash of its input file, the prokka
+    version and the effective prokka arguments. Genomes whose output
+    directory already holds a complete result with the same key are
+    skipped, and those with a result in the cache at args.cachedir are
+    hard-linked into place. The remaining command-lines are yielded, and a
+    (key, output directory) tuple for each is appended to the pending list.
+    Output directories must be stamped with their key when prokka succeeds,
+    before the results can be stored in the cache (see store_results()).
+    """
+    cache = ProkkaCache(args.cachedir)
+    version = get_prokka_version(args.prokka_exe)
+    skipped, linked = 0, 0
+    for fname, cmd in zip(infiles, cmdlist):
+        outdir = get_outdir(cmd)
+        key = build_cache_key(hash_file(os.path.join(args.indir, fname)), version, cmd)
+        if read_stamp(outdir) == key:  # Complete, e.g. from an earlier SGE run
+            cache.store(key, outdir)
+            skipped += 1
+        elif key in cache:
+            cache.fetch(key, outdir)
+            linked += 1
+        else:
+            if os.path.isdir(outdir):  # Stale or incomplete output
+                shutil.rmtree(outdir)
+            pending.append((key, outdir))
+            yield cmd
+    logger.info(
+        "Skipped %d complete results, linked %d results from cache %s",
+        skipped,
+        linked,
+        args.cachedir,
+    )
+
+
+def select_uncached(infiles, cmdlist, args, logger):
+    """Return prokka command-lines for genomes without a complete result
+
+    Returns the command-lines still to run, and a matching list of (key,
+    output directory) tuples (see iter_uncached()).
+    """
+    pending = []
+    torun = list(iter_uncached(infiles, cmdlist, args, logger, pending))
+    return torun, pending
+
+
+def stage_commands(cmdlist, args):
+    """Yield the command-lines, wrapped to run from scratch where needed
+
+    See prokka_staging.stage_command(); compressed inputs are always staged,
+    and all inputs are staged if args.scratch is set.
+    """
+    for cmd in cmdlist:
+        if needs_staging(cmd, args.scratch):
+            cmd = stage_command(cmd, args.scratch)
+        yield cmd
+
+
+def select_commands(infiles, cmdlist, args, logger, stream=False):
+    """Return the command-lines still to run, and a list of their cache keys
+
+    Without a cache (args.cachedir), all command-lines run, and the list of
+    (key, output directory) tuples is empty; otherwise see iter_uncached().
+    Streamed command-lines are selected as they are taken from cmdlist, and
+    the list is filled as they are.
+    """
+    pending = []
+    if args.cachedir is None:
+        return cmdlist, pending
+    if stream:
+        return iter_uncached(infiles, cmdlist, args, logger, pending), pending
+    cmdlist, pending = select_uncached(infiles, cmdlist, args, logger)
+    logger.info("%d genomes still to be annotated", len(cmdlist))
+    return cmdlist, pending
+
+
+def build_staged_commands(cmdlist, args, logger, stream=False):
+    """Return the command-lines, wrapped to run from scratch where needed
+
+    Streamed command-lines are wrapped as they are taken from cmdlist, and
+    returned as an iterator; otherwise a list is returned (see
+    stage_commands()).
+    """
+    if args.scratch is not None:
+        logger.info("Staging prokka runs through scratch directory %s", args.scratch)
+    cmdlist = stage_commands(cmdlist, args)
+    if stream:
+        return cmdlist
+    return list(cmdlist)
+
+
+def store_results(pending, args, logger):
+    """Store the complete results of the pending runs in the cache
+
+    - pending       List of (key, output directory) tuples, from
+                    select_uncached()
+    """
+    cache = ProkkaCache(args.cachedir)
+    stored = 0
+    for key, outdir in pending:
+        if read_stamp(outdir) == key:
+            cache.store(key, outdir)
+            stored += 1
+    logger.info("Stored %d new results in cache %s", stored, args.cachedir)
+
+
+def run_command(cmd, logfile):
+    """Run the command-line without a shell, streaming its output to logfile
+
+    Returns a ProkkaResult. A command that cannot be started (e.g. a missing
+    executable) has return code 127, as it would under a shell.
+    """
+    os.makedirs(os.path.dirname(logfile) or os.curdir, exist_ok=True)
+    with open(logfile, "wb") as lfh:
+        try:
+            returncode = subprocess.call(
+                shlex.split(cmd), stdout=lfh, stderr=subprocess.STDOUT
+            )
+        except OSError as exc:
+            lfh.write("{}\n".format(exc).encode("utf-8"))
+            returncode = 127
+    return ProkkaResult(cmd, returncode, logfile)
+
+
+def run_multiprocessing(cmdlist, args, logger):
+    """Run the commands in the list locally, and return a list of ProkkaResults
+
+    Each worker thread starts one prokka process directly, without a shell,
+    and its combined stdout and stderr are written to <outdir>.log as it
+    runs. Commands are taken from cmdlist (which may be a generator) and
+    started in order, each once a worker is free and enough of the args.cpus
+    budget is unused for its --cpus value, so memory use does not grow with
+    the number of genomes, and the CPUs are not oversubscribed. Results are
+    returned in the order of cmdlist.
+    """
+    if not args.workers:
+        logger.info("Using maximum number of worker threads")
+    else:
+        logger.info("Using %d worker threads", args.workers)
+    workers = args.workers or os.cpu_count() or 1
+    budget = args.cpus or os.cpu_count() or 1
+    logger.info("Using a budget of %d CPUs", budget)
+
+    results = []
+    running = {}  # Index and CPUs of each running command, keyed by future
+    used = 0  # CPUs requested by running commands
+
+    def collect(futures):
+        """Record the results of the passed finished futures"""
+        nonlocal used
+        for future in futures:
+            idx, cpus = running.pop(future)
+            used -= cpus
+            result = results[idx] = future.result()
+            if result.returncode:
+                logger.error(
+                    "prokka failed (exit code %d); see %s",
+                    result.returncode,
+                    result.logfile,
+                )
+            else:
+                logger.debug("prokka completed; output logged to %s", result.logfile)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for cmd in cmdlist:
+            cpus = get_cpus(cmd)
+            while running and (len(running) >= workers or used + cpus > budget):
+                collect(wait_any(running, return_when=FIRST_COMPLETED).done)
+            logfile = "{}.log".format(get_outdir(cmd))
+            running[executor.submit(run_command, cmd, logfile)] = (len(results), cpus)
+            results.append(None)
+            used += cpus
+        collect(list(running))
+    return results
+
+
+def run_local(cmdlist, pending, args, logger):
+    """Run the command-lines locally, and return a list of ProkkaResults
+
+    - pending       List of (key, output directory) tuples, one for each
+                    command-line (see iter_uncached()), or empty if there is
+                    no cache
+
+    The output directory of each successful run is stamped with its cache
+    key, marking it as complete.
+    """
+    results = run_multiprocessing(cmdlist, args, logger)
+    for (key, outdir), result in zip(pending, results):
+        if not result.returncode:
+            write_stamp(outdir, key)
     return results
 
 
+def count_failures(results, logger):
+    """Return the number of failed local prokka runs, and report them
+
+    - results       List of ProkkaResults, from run_local()
+    """
+    failed = sum(1 for result in results if result.returncode)
+    if failed:
+        logger.error("%d of %d prokka runs failed", failed, len(results))
+    return failed
+
+
+def build_sge_jobs(cmdlist, args, logger):
+    """Return list of pysge JobGroups that run the commands in the list
+
+    Command-lines are packed into array jobs of at most args.sgegroupsize
+    tasks, and each task runs the command-line selected by its $SGE_TASK_ID.
+    """
+    logger.debug(
+        "Converting command-lines to JobGroup objects of up to %d tasks",
+        args.sgegroupsize,
+    )
+    joblist = []
+    for idx in range(0, len(cmdlist), args.sgegroupsize):
+        clines = cmdlist[idx : idx + args.sgegroupsize]
+        joblist.append(
+            pysge.JobGroup(
+                name="{}_{}".format(args.jobprefix, len(joblist)),
+                command='eval "$prokka_cmd"',
+                arguments={"prokka_cmd": [shlex.quote(cline) for cline in clines]},
+            )
+        )
+    logger.info(
+        "Packed %d command-lines into %d SGE array jobs", len(cmdlist), len(joblist)
+    )
+    return joblist
+
+
 def run_sge(cmdlist, args, logger, wait=False):
-    """Run the commands in the list with SGE
+    """Run the commands in the list with SGE, as array jobs
 
     Use wait=True if you want to wait for the SGE run to complete before continuing
     """
-    logger.debug("Converting command-lines to Job objects")
-    joblist = []
-    for idx, cline in enumerate(cmdlist):
-        joblist.append(pysge.Job(name="prokka_job_{}".format(idx), command=cline))
-    pysge.build_and_submit_jobs(joblist, wait=wait)
+    joblist = build_sge_jobs(cmdlist, args, logger)
+    pysge.build_and_submit_jobs(joblist, sgeargs=args.sgeargs, wait=wait)
+
+
+def submit_sge(cmdlist, pending, args, logger, wait=False):
+    """Run the command-lines with SGE (see run_sge())
+
+    - pending       List of (key, output directory) tuples, one for each
+                    command-line (see iter_uncached()), or empty if there is
+                    no cache
+
+    Each job stamps its output directory with its cache key when prokka
+    succeeds, marking it as complete.
+    """
+    if wait:
+        logger.info(
+            "Wait parameter set to True: waiting for SGE jobs to complete before proceeding"
+        )
+    if pending:
+        cmdlist = [
+            stamp_command(cmd, outdir, key)
+            for cmd, (key, outdir) in zip(cmdlist, pending)
+        ]
+    run_sge(cmdlist, args, logger, wait)
+
+
+def aggregate_outputs(args, logger, complete=True):
+    """Combine the annotations of all genomes into args.aggregate
+
+    Returns False if the prokka output cannot be combined. Output is only
+    combined once it is complete (i.e. not while SGE jobs are still running),
+    and otherwise a warning is logged.
+    """
+    if args.aggregate is None:
+        return True
+    if not complete:
+        logger.warning("Not waiting for SGE jobs, so prokka output is not combined")
+        return True
+    try:
+        genomes, features = aggregate_prokka_outputs(
+            args.outdir, args.aggregate, args.workers
+        )
+    except ProkkaOutputError as exc:
+        logger.error("Could not combine prokka output: %s", exc)
+        return False
+    logger.info(
+        "Wrote %d features from %d genomes to %s", features, genomes, args.aggregate
+    )
+    return True
 
 
 def run_main(argv=None, logger=None):
@@ -233,28 +748,22 @@ def run_prokka(args, logger=None, wait=False):
         logger.error("Prokka executable %s is not found (exiting)", args.prokka_exe)
         return 1
 
-    # Process arguments
-    args.extensions = {".{}".format(ext) for ext in args.extensions.split(",")}
+    # Process arguments, in a copy of the namespace, so that the caller's
+    # arguments can be used again
+    extensions = {".{}".format(ext) for ext in args.extensions.split(",")}
+    args = copy.copy(args)
+    args.extensions = extensions
 
-    # Identify input genomes
-    infiles = identify_inputs(args, logger)
-    if not infiles:
+    # Identify input genomes. Only local runs can be streamed
+    stream = args.stream and args.scheduler == "multiprocessing"
+    infiles = discover_inputs(args, logger, stream)
+    if infiles is None:
         logger.error("Could not find input (exiting)")
         return 1
 
-    # Can the output directory be made
-    if os.path.isdir(args.outdir):
-        if not args.force:
-            logger.error(
-                "Cannot use existing directory %s for prokka output (exiting)",
-                args.outdir,
-            )
-            return 1
-        else:
-            logger.warning(
-                "Removing output directory %s and everything under it", args.outdir
-            )
-            shutil.rmtree(args.outdir)
+    # Can the output directory be made?
+    if not prepare_outdir(args, logger):
+        return 1
 
     # If necessary, load config data for bulk_prokka
     if args.config is not None:
@@ -264,28 +773,41 @@ def run_prokka(args, logger=None, wait=False):
     else:
         config_data = None
 
-    # Create list of prokka commands
-    cmdlist = []
-    for fname in infiles:
-        cmdlist.append(
-            build_prokka_cmd(fname=fname, args=args, config=config_data, logger=logger)
-        )
-    logger.info("Compiled %d prokka command-lines", len(cmdlist))
+    # Create prokka commands, largest genomes first; streamed genomes are run
+    # in the order they are found
+    if stream:
+        infiles, cmdlist = stream_commands(infiles, args, config_data, logger)
+    else:
+        commands = build_commands(infiles, args, config_data, logger)
+        if commands is None:
+            return 1
+        infiles, cmdlist = commands
+
+    # Reuse complete results, where we have them, and run prokka in scratch
+    # storage, decompressing inputs there
+    cmdlist, pending = select_commands(infiles, cmdlist, args, logger, stream)
+    cmdlist = build_staged_commands(cmdlist, args, logger, stream)
 
     # Submit commands to scheduler
     logger.info("Submitting prokka command-lines to %s scheduler", args.scheduler)
+    results = []
     if args.scheduler == "multiprocessing":
-        run_multiprocessing(cmdlist, args, logger)
-        # To extract more information on each run, use
-        # [result.get() for result in results]
+        results = run_local(cmdlist, pending, args, logger)
     if args.scheduler == "SGE":
-        if wait:
-            logger.info(
-                "Wait parameter set to True: waiting for SGE jobs to complete before proceeding"
-            )
-        run_sge(cmdlist, args, logger, wait)
+        submit_sge(cmdlist, pending, args, logger, wait)
     logger.info("Submission complete")
 
-    # Report on clean exit
+    # Cache new results, and combine the annotations of all genomes, once
+    # they have all been written. Results of SGE jobs that are not waited
+    # for are cached by the next run with the same cache
+    complete = args.scheduler != "SGE" or wait
+    if args.cachedir is not None and complete:
+        store_results(pending, args, logger)
+    if not aggregate_outputs(args, logger, complete):
+        return 1
+
+    # Report on exit
     logger.info("Completed. Time taken: {:.2f}".format(time.time() - time0))
+    if count_failures(results, logger):
+        return 1
     return 0
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Stage bulk_prokka runs through node-local scratch storage
+
+(c) The James Hutton Institute 2018
+Author: Leighton Pritchard
+"""
+
+import shlex
+
+# Suffix of compressed input files
+GZIP_SUFFIX = ".gz"
+
+# bash script that runs a prokka command-line in a scratch directory. It is
+# called as: bash -c STAGE_SCRIPT bulk_prokka_stage SCRATCH PROKKA_ARGV...
+# The input file (the last argument) is copied, or decompressed, into a new
+# directory under SCRATCH (default $TMPDIR, or /tmp), prokka writes its
+# output there, and the finished output is copied alongside the --outdir
+# directory, then renamed into place. The scratch directory, and any partial
+# copy of the output, are always removed, and no --outdir directory is made
+# if prokka fails.
+STAGE_SCRIPT = r"""set -eu
+scratch=${1:-${TMPDIR:-/tmp}}
+shift
+input=${!#}
+set -- "${@:1:$#-1}"
+argv=()
+outdir=
+while [ $# -gt 0 ]; do
+  if [ "$1" = --outdir ]; then
+    outdir=$2
+    shift 2
+  else
+    argv+=("$1")
+    shift
+  fi
+done
+if [ -e "$outdir" ]; then
+  echo "Output directory $outdir already exists" >&2
+  exit 1
+fi
+work=$(mktemp -d "$scratch/bulk_prokka.XXXXXX")
+partial="$outdir.partial.$$"
+trap 'rm -rf "$work" "$partial"' EXIT
+staged="$work/$(basename "${input%.gz}")"
+case $input in
+  *.gz) gzip -dc "$input" > "$staged" ;;
+  *) cp "$input" "$staged" ;;
+esac
+"${argv[@]}" --outdir "$work/output" "$staged"
+mkdir -p "$(dirname "$outdir")"
+cp -R "$work/output" "$partial"
+mv "$partial" "$outdir"
+"""
+
+
+def strip_compression(fname):
+    """Return the file name without any compression suffix."""
+    if fname.endswith(GZIP_SUFFIX):
+        return fname[: -len(GZIP_SUFFIX)]
+    return fname
+
+
+def needs_staging(cmd, scratch=None):
+    """Return True if the prokka command-line must be run from scratch.
+
+    Command-lines are staged if a scratch directory is given, and always if
+    the input file is compressed, as prokka cannot read it directly.
+    """
+    return scratch is not None or shlex.split(cmd)[-1].endswith(GZIP_SUFFIX)
+
+
+def stage_command(cmd, scratch=None):
+    """Return the prokka command-line, wrapped to run from scratch storage.
+
+    - cmd            String, prokka command-line (see build_prokka_cmd())
+    - scratch        Path to node-local scratch directory, or None for
+                     $TMPDIR (or /tmp) on the node that runs the command
+
+    The wrapped command-line can be run with or without a shell, and keeps
+    the --outdir and --cpus arguments of cmd.
+    """
+    return " ".join(
+        [
+            "bash -c",
+            shlex.quote(STAGE_SCRIPT),
+            "bulk_prokka_stage",
+            shlex.quote(scratch or ""),
+            cmd,
+        ]
+    )
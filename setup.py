@@ -50,7 +50,7 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     package_data={},
     include_package_date=True,
-    install_requires=[],
+    install_requires=["numpy"],
     classifiers=[
         "Development Status :: 4 - Beta",
         "Environment :: Console",
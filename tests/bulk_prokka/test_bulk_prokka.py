@@ -1,20 +1,23 @@
 # -*- coding: utf-8 -*-
 """Tests of bulk_prokka script"""
 
+import gzip
 import logging
 import os
 import shlex
 import shutil
 import subprocess
+import sys
+import tempfile
 import unittest
 
 from argparse import Namespace
 
 import pytest  # noqa: E0401
 
-from lpbio import pysge
+from lpbio import fasta, prokka, pysge
 
-from lpbio.scripts import prokka_script  # noqa: E0401
+from lpbio.scripts import prokka_cache, prokka_script, prokka_staging  # noqa: E0401
 
 # Null logger to enable tests of functions expecting a logger
 NULL_LOGGER = logging.getLogger("test_bulk_prokka.py null logger")
@@ -56,6 +59,9 @@ VALID_INDIR = Namespace(
     compliant=COMPLIANT,
     metagenome=METAGENOME,
     config=CONFIG_FNAME,
+    recursive=False,
+    include=None,
+    exclude=None,
 )
 MISSING_INDIR = Namespace(
     indir=FAKE_INDIR,
@@ -66,6 +72,9 @@ MISSING_INDIR = Namespace(
     compliant=COMPLIANT,
     metagenome=METAGENOME,
     config=CONFIG_FNAME,
+    recursive=False,
+    include=None,
+    exclude=None,
 )
 AS_SCRIPT_MP = Namespace(
     indir=INDIR,
@@ -76,9 +85,18 @@ AS_SCRIPT_MP = Namespace(
     compliant=COMPLIANT,
     metagenome=METAGENOME,
     config=CONFIG_FNAME,
+    recursive=False,
+    include=None,
+    exclude=None,
+    stream=False,
+    scratch=None,
+    stats=None,
+    aggregate=None,
     scheduler="multiprocessing",
     workers=8,
+    cpus=8,
     force=True,
+    cachedir=None,
 )
 AS_SCRIPT_SGE = Namespace(
     indir=INDIR,
@@ -89,8 +107,20 @@ AS_SCRIPT_SGE = Namespace(
     compliant=COMPLIANT,
     metagenome=METAGENOME,
     config=CONFIG_FNAME,
+    recursive=False,
+    include=None,
+    exclude=None,
+    stream=False,
+    scratch=None,
+    stats=None,
+    aggregate=None,
     scheduler="SGE",
+    sgegroupsize=2,
+    sgeargs=None,
+    jobprefix="PROKKA_BULK_TEST",
+    cpus=0,
     force=True,
+    cachedir=None,
 )
 
 
@@ -182,8 +212,36 @@ OUTFILES = {
 }
 
 
-class TestBulkProkka(unittest.TestCase):
+def write_fake_prokka(path):
+    """Write an executable stand-in for prokka to path, and return path
+
+    The stand-in creates its --outdir, and copies its input file there as
+    input.fna, with an empty done.txt file and a one-feature PROKKA.tsv.
+    """
+    script = "\n".join(
+        [
+            "#!{}".format(sys.executable),
+            "import os, shutil, sys",
+            "print('prokka 0.0.1', file=sys.stderr)",
+            "if '--version' in sys.argv:",
+            "    sys.exit(0)",
+            "outdir = sys.argv[sys.argv.index('--outdir') + 1]",
+            "os.makedirs(outdir)",
+            "shutil.copyfile(sys.argv[-1], os.path.join(outdir, 'input.fna'))",
+            "open(os.path.join(outdir, 'done.txt'), 'w').close()",
+            "with open(os.path.join(outdir, 'PROKKA.tsv'), 'w') as ofh:",
+            "    ofh.write('locus_tag\\tftype\\tlength_bp\\tgene\\tEC_number"
+            "\\tCOG\\tproduct\\n')",
+            "    ofh.write('TAG_00001\\tCDS\\t300\\t\\t\\t\\tprotein\\n')",
+        ]
+    )
+    with open(path, "w") as ofh:
+        ofh.write(script)
+    os.chmod(path, 0o755)
+    return path
+
 
+class TestBulkProkka(unittest.TestCase):
     """Class collecting tests for bulk_prokka script."""
 
     def check_outputs(self):
@@ -205,6 +263,46 @@ class TestBulkProkka(unittest.TestCase):
         infiles = prokka_script.identify_inputs(MISSING_INDIR, NULL_LOGGER)
         self.assertFalse(infiles)
 
+    def test_iter_inputs(self):
+        """Finds input files recursively, with include and exclude patterns"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for path in ("a.fna", "b.fas", "c.txt", "sub/d.fna", "sub/tmp/e.fna"):
+                os.makedirs(os.path.dirname(os.path.join(tmpdir, path)), exist_ok=True)
+                open(os.path.join(tmpdir, path), "w").close()
+            args = Namespace(
+                indir=tmpdir,
+                extensions=EXTENSIONS,
+                recursive=False,
+                include=None,
+                exclude=None,
+            )
+
+            def found(**kwargs):
+                """Return sorted input files found with the passed arguments"""
+                return sorted(
+                    prokka_script.iter_inputs(
+                        Namespace(**dict(vars(args), **kwargs)), NULL_LOGGER
+                    )
+                )
+
+            self.assertEqual(found(), ["a.fna", "b.fas"])
+            self.assertEqual(
+                found(recursive=True),
+                ["a.fna", "b.fas", "sub/d.fna", "sub/tmp/e.fna"],
+            )
+            self.assertEqual(
+                found(recursive=True, exclude=["tmp", "b.*"]), ["a.fna", "sub/d.fna"]
+            )
+            self.assertEqual(
+                found(recursive=True, include=["*.fna"], exclude=["a*"]),
+                ["sub/d.fna", "sub/tmp/e.fna"],
+            )
+            self.assertEqual(found(indir=os.path.join(tmpdir, "nodir")), [])
+
+            # Links to directories are not followed, so cannot make a loop
+            os.symlink(tmpdir, os.path.join(tmpdir, "sub", "loop"))
+            self.assertEqual(found(recursive=True, include=["d.*"]), ["sub/d.fna"])
+
     def test_config_load(self):
         """Loads and parses bulk_prokka config file"""
         confdata = prokka_script.load_bulk_prokka_config(CONFIG_FNAME, NULL_LOGGER)
@@ -217,6 +315,277 @@ class TestBulkProkka(unittest.TestCase):
         )
         self.assertEqual(cmd, PROKKA_CMD)
 
+        # Paths that need quoting are only quoted on the command-line, so
+        # give the same output directory and config lookup as other paths
+        fname = os.path.join("sub dir", INFILENAMES[0])
+        stem = os.path.splitext(INFILENAMES[0])[0]
+        outdir = os.path.join(OUTDIR, "sub dir", stem)
+        cmd = prokka_script.build_prokka_cmd(fname, VALID_INDIR, CONFDATA, NULL_LOGGER)
+        self.assertEqual(prokka_script.get_outdir(cmd), outdir)
+        self.assertEqual(
+            cmd,
+            PROKKA_CMD.replace(os.path.join(OUTDIR, stem), shlex.quote(outdir)).replace(
+                os.path.join(INDIR, INFILENAMES[0]),
+                shlex.quote(os.path.join(INDIR, fname)),
+            ),
+        )
+
+    def test_build_sge_jobs(self):
+        """Packs PROKKA commands into SGE array jobs"""
+        cmdlist = [
+            prokka_script.build_prokka_cmd(fname, VALID_INDIR, CONFDATA, NULL_LOGGER)
+            for fname in INFILENAMES
+        ]
+        joblist = prokka_script.build_sge_jobs(cmdlist, AS_SCRIPT_SGE, NULL_LOGGER)
+        self.assertEqual([job.tasks for job in joblist], [2, 1])
+        self.assertEqual(
+            [job.name for job in joblist],
+            ["PROKKA_BULK_TEST_0", "PROKKA_BULK_TEST_1"],
+        )
+
+    def test_cache_key(self):
+        """Cache keys depend on input content and prokka settings, not paths"""
+        cmd = prokka_script.build_prokka_cmd(
+            INFILENAMES[0], VALID_INDIR, CONFDATA, NULL_LOGGER
+        )
+        moved = cmd.replace(INDIR, "elsewhere").replace(OUTDIR, "other_output")
+        compliant = cmd.replace("--mincontiglen 200", "--mincontiglen 200 --compliant")
+        keys = [
+            prokka_cache.build_cache_key("abc", "1.14.0", cline)
+            for cline in (cmd, moved, compliant)
+        ]
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+        self.assertNotEqual(keys[0], prokka_cache.build_cache_key("abc", "1.14.5", cmd))
+
+    def test_cache_reuse(self):
+        """Only genomes without complete results are annotated again"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            indir = os.path.join(tmpdir, "input")
+            shutil.copytree(INDIR, indir)
+            args = Namespace(
+                indir=indir,
+                outdir=os.path.join(tmpdir, "output"),
+                cachedir=os.path.join(tmpdir, "cache"),
+                prokka_exe=sys.executable,  # Stands in for prokka --version
+                mincontiglen=MINCONTIGLEN,
+                compliant=COMPLIANT,
+                metagenome=METAGENOME,
+            )
+
+            def select():
+                """Return command-lines still to run, and pending results"""
+                cmdlist = [
+                    prokka_script.build_prokka_cmd(fname, args, None, NULL_LOGGER)
+                    for fname in INFILENAMES
+                ]
+                return prokka_script.select_uncached(
+                    INFILENAMES, cmdlist, args, NULL_LOGGER
+                )
+
+            cmdlist, pending = select()
+            self.assertEqual(len(cmdlist), 3)
+            for key, outdir in pending:  # Simulate successful prokka runs
+                os.makedirs(outdir)
+                with open(os.path.join(outdir, "result.gff"), "w") as ofh:
+                    ofh.write(key)
+                prokka_cache.write_stamp(outdir, key)
+            prokka_script.store_results(pending, args, NULL_LOGGER)
+
+            # Complete results are skipped, or linked from the cache
+            shutil.rmtree(pending[0][1])
+            self.assertEqual(select()[0], [])
+            cached = os.path.join(
+                prokka_script.ProkkaCache(args.cachedir).path(pending[0][0]),
+                "result.gff",
+            )
+            self.assertTrue(
+                os.path.samefile(cached, os.path.join(pending[0][1], "result.gff"))
+            )
+
+            # A changed genome is annotated again
+            with open(os.path.join(indir, INFILENAMES[1]), "a") as ofh:
+                ofh.write(">extra\nACGT\n")
+            cmdlist, pending = select()
+            self.assertEqual([outdir for _, outdir in pending], [pending[0][1]])
+            self.assertIn(os.path.splitext(INFILENAMES[1])[0], pending[0][1])
+
+    def test_write_input_stats(self):
+        """Orders inputs by sequence length, skipping those too short"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            indir = os.path.join(tmpdir, "input")
+            shutil.copytree(INDIR, indir)
+            with open(os.path.join(indir, "short.fna"), "w") as ofh:
+                ofh.write(">short\nACGT\n")
+            args = Namespace(
+                indir=indir,
+                mincontiglen=MINCONTIGLEN,
+                workers=2,
+                stats=os.path.join(tmpdir, "stats.tab"),
+            )
+            infiles, lengths = prokka_script.write_input_stats(
+                args, INFILENAMES + ["short.fna"], NULL_LOGGER
+            )
+            self.assertEqual(sorted(infiles), sorted(INFILENAMES))
+            self.assertEqual(lengths, sorted(lengths, reverse=True))
+            stats = fasta.read_summary(args.stats)
+            self.assertEqual(len(stats), 4)
+            self.assertEqual(stats[-1].short_contigs, 1)
+            self.assertIsNone(
+                prokka_script.write_input_stats(args, ["short.fna"], NULL_LOGGER)
+            )
+
+    def test_allocate_cpus(self):
+        """Splits the CPU budget between genomes by size, largest first"""
+        infiles, sizes = prokka_script.order_by_size(INFILENAMES, VALID_INDIR)
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertEqual(sorted(infiles), sorted(INFILENAMES))
+        # A large genome among small plasmids gets most of the budget
+        cpus = prokka_script.allocate_cpus([12000] + [500] * 9, 16, 4)
+        self.assertEqual(cpus, [16] + [1] * 9)
+        self.assertEqual(prokka_script.allocate_cpus([100] * 4, 16, 4), [4] * 4)
+        self.assertEqual(prokka_script.allocate_cpus([], 16, 4), [])
+        cmd = prokka_script.build_prokka_cmd(
+            INFILENAMES[0], VALID_INDIR, CONFDATA, NULL_LOGGER, cpus=3
+        )
+        self.assertEqual(prokka_script.get_cpus(cmd), 3)
+        self.assertEqual(prokka_script.get_cpus(PROKKA_CMD), 1)
+        self.assertEqual(
+            prokka_cache.effective_args(cmd), prokka_cache.effective_args(PROKKA_CMD)
+        )
+
+    def test_run_multiprocessing(self):
+        """Runs commands without a shell, logging output and exit codes"""
+        script = "import sys; print('annotating'); sys.exit(int(sys.argv[-1]))"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cmdlist = [
+                " ".join(
+                    shlex.quote(arg)
+                    for arg in (
+                        sys.executable,
+                        "-c",
+                        script,
+                        "--outdir",
+                        os.path.join(tmpdir, "genome_{}".format(idx)),
+                        str(code),
+                    )
+                )
+                for idx, code in enumerate((0, 3, 0, 1))
+            ]
+            cmdlist.append("no_such_prokka --outdir {}".format(tmpdir))
+            results = prokka_script.run_multiprocessing(
+                cmdlist, Namespace(workers=2, cpus=2), NULL_LOGGER
+            )
+            self.assertEqual([result.cmd for result in results], cmdlist)
+            self.assertEqual(
+                [result.returncode for result in results], [0, 3, 0, 1, 127]
+            )
+            with open(results[1].logfile, "r") as ifh:
+                self.assertEqual(ifh.read(), "annotating\n")
+
+    def test_script_run_stream(self):
+        """Streams recursively found, and compressed, inputs to a prokka stand-in"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exe = write_fake_prokka(os.path.join(tmpdir, "prokka"))
+            indir = os.path.join(tmpdir, "input")
+            shutil.copytree(INDIR, os.path.join(indir, "nested"))
+            fname = os.path.join(indir, "nested", INFILENAMES[0])
+            with open(fname, "rb") as ifh, gzip.open(fname + ".gz", "wb") as ofh:
+                shutil.copyfileobj(ifh, ofh)
+            os.remove(fname)
+            args = Namespace(
+                **dict(
+                    vars(AS_SCRIPT_MP),
+                    indir=indir,
+                    extensions=EXTENSIONS_STR,
+                    outdir=os.path.join(tmpdir, "output"),
+                    prokka_exe=exe,
+                    recursive=True,
+                    stream=True,
+                    force=False,
+                    cachedir=os.path.join(tmpdir, "cache"),
+                    aggregate=os.path.join(tmpdir, "annotations.npz"),
+                )
+            )
+            self.assertEqual(prokka_script.run_prokka(args, NULL_LOGGER), 0)
+            table = prokka.load_annotations(args.aggregate)
+            self.assertEqual(
+                sorted(table["genome"].categories),
+                sorted(
+                    os.path.join("nested", os.path.splitext(fname)[0])
+                    for fname in INFILENAMES
+                ),
+            )
+            self.assertEqual(list(table["length"]), [300] * 3)
+            for fname in INFILENAMES:
+                outdir = os.path.join(args.outdir, "nested", os.path.splitext(fname)[0])
+                self.assertTrue(os.path.isfile(os.path.join(outdir, "done.txt")))
+                self.assertIsNotNone(prokka_cache.read_stamp(outdir))
+
+            # All genomes are complete, so a second run with the same
+            # arguments skips them
+            self.assertEqual(args.extensions, EXTENSIONS_STR)
+            self.assertEqual(prokka_script.run_prokka(args, NULL_LOGGER), 0)
+
+    def test_stage_command(self):
+        """Runs prokka from scratch storage, with compressed input"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exe = write_fake_prokka(os.path.join(tmpdir, "prokka"))
+            scratch = os.path.join(tmpdir, "scratch")
+            os.makedirs(scratch)
+            plain = os.path.join(INDIR, INFILENAMES[0])
+            fname = os.path.join(tmpdir, INFILENAMES[0] + ".gz")
+            with open(plain, "rb") as ifh, gzip.open(fname, "wb") as ofh:
+                shutil.copyfileobj(ifh, ofh)
+            self.assertEqual(
+                prokka_cache.hash_file(fname), prokka_cache.hash_file(plain)
+            )
+
+            outdir = os.path.join(tmpdir, "output", "genome")
+            cmd = " ".join(
+                shlex.quote(arg)
+                for arg in (exe, "--cpus", "2", "--outdir", outdir, fname)
+            )
+            self.assertTrue(prokka_staging.needs_staging(cmd))
+            staged = prokka_staging.stage_command(cmd, scratch)
+            self.assertEqual(prokka_script.get_outdir(staged), outdir)
+            self.assertEqual(prokka_script.get_cpus(staged), 2)
+            result = prokka_script.run_command(staged, outdir + ".log")
+            self.assertEqual(result.returncode, 0)
+            with open(os.path.join(outdir, "input.fna"), "rb") as ifh:
+                with open(plain, "rb") as tfh:
+                    self.assertEqual(ifh.read(), tfh.read())
+            self.assertEqual(os.listdir(scratch), [])
+            self.assertEqual(
+                sorted(os.listdir(os.path.dirname(outdir))), ["genome", "genome.log"]
+            )
+
+            # A failed run leaves no output directory, and cleans scratch up
+            failing = cmd.replace(shlex.quote(exe), "false", 1).replace(
+                "genome", "failed"
+            )
+            result = prokka_script.run_command(
+                prokka_staging.stage_command(failing, scratch), outdir + ".failed.log"
+            )
+            self.assertNotEqual(result.returncode, 0)
+            self.assertFalse(os.path.exists(prokka_script.get_outdir(failing)))
+            self.assertEqual(os.listdir(scratch), [])
+
+            # Output that cannot be moved into place leaves no partial copy
+            clash = os.path.join(tmpdir, "clash")
+            with open(clash, "w") as ofh:
+                ofh.write('#!/bin/sh\nmkdir -p "$4"\ntouch {}\n'.format(outdir + "2"))
+            os.chmod(clash, 0o755)
+            clashing = cmd.replace(shlex.quote(exe), clash, 1).replace(
+                "genome", "genome2"
+            )
+            result = prokka_script.run_command(
+                prokka_staging.stage_command(clashing, scratch), outdir + ".clash.log"
+            )
+            self.assertNotEqual(result.returncode, 0)
+            outputs = os.listdir(os.path.dirname(outdir))
+            self.assertEqual([fname for fname in outputs if "partial" in fname], [])
+
     def test_script_run_mp(self):
         """Runs script with multiprocessing"""
         retval = prokka_script.run_prokka(AS_SCRIPT_MP, NULL_LOGGER)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Tests of FASTA statistics in lpbio.fasta"""
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from lpbio import fasta
+
+# Input files from the bulk_prokka tests
+INDIR = os.path.join("tests", "bulk_prokka", "input")
+
+# Multi-contig FASTA with wrapped, lowercase, ambiguous and CRLF lines
+FASTA = (
+    b">contig_1 first\nACGTACGTAC\nGGCCnnNN\n"
+    b">contig_2\r\nAT\r\nGC\r\n"
+    b">contig_3 last, without a final newline\nacgtNNNNNNacgtacgtacgtacgt"
+)
+
+
+def reference_stats(path, mincontiglen):
+    """Return (length, contigs, gc, n_fraction) counted in pure Python"""
+    with open(path, "r") as ifh:
+        contigs = ifh.read().split(">")[1:]
+    seqs = ["".join(contig.split("\n", 1)[1].split()) for contig in contigs]
+    seq = "".join(seqs).upper()
+    acgt = sum(seq.count(base) for base in "ACGT")
+    return (
+        len(seq),
+        len(seqs),
+        (seq.count("G") + seq.count("C")) / acgt,
+        seq.count("N") / len(seq),
+        sum(1 for _ in seqs if len(_) < mincontiglen),
+    )
+
+
+class TestFasta(unittest.TestCase):
+    """Class collecting tests for FASTA statistics."""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, "genome.fna")
+        with open(self.fname, "wb") as ofh:
+            ofh.write(FASTA)
+
+    def tearDown(self):
+        """Remove test fixtures"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_fasta_stats(self):
+        """Counts contigs, lengths and bases in a FASTA file"""
+        stats = fasta.fasta_stats(self.fname, mincontiglen=10)
+        self.assertEqual(stats.name, "genome")
+        self.assertEqual(stats.length, 18 + 4 + 26)
+        self.assertEqual(stats.contigs, 3)
+        self.assertEqual(stats.n50, 26)
+        self.assertEqual(stats.largest, 26)
+        self.assertEqual(stats.gc, (9 + 2 + 10) / (14 + 4 + 20))
+        self.assertEqual(stats.n_fraction, 10 / 48)
+        self.assertEqual((stats.short_contigs, stats.short_length), (1, 4))
+
+    def test_compressed(self):
+        """Compressed files give the same statistics"""
+        gzname = self.fname + ".gz"
+        with gzip.open(gzname, "wb") as ofh:
+            ofh.write(FASTA)
+        self.assertEqual(
+            fasta.fasta_stats(gzname)._replace(path=self.fname),
+            fasta.fasta_stats(self.fname),
+        )
+
+    def test_invalid(self):
+        """Files without FASTA headers raise FastaError"""
+        for content in (b"", b"ACGT\nACGT\n"):
+            with open(self.fname, "wb") as ofh:
+                ofh.write(content)
+            with self.assertRaises(fasta.FastaError) as context:
+                fasta.fasta_stats(self.fname)
+            self.assertIn(self.fname, str(context.exception))
+
+    def test_n50(self):
+        """Calculates N50 of sequence lengths"""
+        self.assertEqual(fasta.n50(fasta.np.array([2, 3, 4, 5, 6])), 5)
+        self.assertEqual(fasta.n50(fasta.np.array([10, 1, 1])), 10)
+        self.assertEqual(fasta.n50(fasta.np.array([], dtype=int)), 0)
+
+    def test_summary(self):
+        """Summarises genomes in parallel, and writes and reads the table"""
+        paths = [os.path.join(INDIR, fname) for fname in sorted(os.listdir(INDIR))]
+        stats = fasta.summarise_fastas(paths, 200, workers=3)
+        self.assertEqual([stat.path for stat in stats], paths)
+        for path, stat in zip(paths, stats):
+            self.assertEqual(
+                reference_stats(path, 200),
+                (
+                    stat.length,
+                    stat.contigs,
+                    stat.gc,
+                    stat.n_fraction,
+                    stat.short_contigs,
+                ),
+            )
+        summary = os.path.join(self.tmpdir, "summary.tab")
+        fasta.write_summary(stats, summary)
+        self.assertEqual(fasta.read_summary(summary), stats)
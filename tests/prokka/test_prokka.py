@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Tests of prokka output aggregation in lpbio.prokka"""
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from collections import Counter
+
+from lpbio import prokka
+
+# prokka output from the bulk_prokka tests
+OUTDIR = os.path.join("tests", "bulk_prokka", "targets", "1.13")
+GENOMES = sorted(os.listdir(OUTDIR))
+
+# Feature table written by prokka before version 1.13
+OLD_TSV = "locus_tag\tftype\tgene\tEC_number\tproduct\nOLD_00001\tCDS\tdnaA\t\tDnaA\n"
+
+
+def read_tsv(genome):
+    """Return the rows of a genome's prokka feature table"""
+    outdir = os.path.join(OUTDIR, genome)
+    (fname,) = [fname for fname in os.listdir(outdir) if fname.endswith(".tsv")]
+    with open(os.path.join(outdir, fname), "r") as ifh:
+        return list(csv.DictReader(ifh, delimiter="\t"))
+
+
+class TestProkka(unittest.TestCase):
+    """Class collecting tests for prokka output aggregation."""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.outfile = os.path.join(self.tmpdir, "annotations.npz")
+
+    def tearDown(self):
+        """Remove test fixtures"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_aggregate(self):
+        """Combines feature tables of all genomes into one table"""
+        counts = prokka.aggregate_prokka_outputs(OUTDIR, self.outfile, workers=2)
+        rows = {genome: read_tsv(genome) for genome in GENOMES}
+        self.assertEqual(counts, (3, sum(len(_) for _ in rows.values())))
+
+        table = prokka.load_annotations(self.outfile)
+        self.assertEqual(list(table["genome"].categories), GENOMES)
+        expected = [row for genome in GENOMES for row in rows[genome]]
+        self.assertEqual(
+            [tag.decode() for tag in table["locus_tag"]],
+            [row["locus_tag"] for row in expected],
+        )
+        self.assertEqual(
+            list(table["length"]), [int(row["length_bp"]) for row in expected]
+        )
+        for name, header in prokka.CATEGORICAL_COLUMNS:
+            self.assertEqual(
+                list(table[name].values()), [row[header] for row in expected]
+            )
+        self.assertEqual(list(table["bases"]), [1003404, 948121, 991702])
+        self.assertEqual(list(table["contigs"]), [1, 1, 1])
+
+        # Feature counts match each genome's feature table
+        ftypes = list(table["ftype"].categories)
+        for genome, genome_counts in zip(GENOMES, prokka.feature_counts(table)):
+            self.assertEqual(
+                dict(zip(ftypes, genome_counts)),
+                dict(Counter(row["ftype"] for row in rows[genome])),
+            )
+
+    def test_nested_and_old_output(self):
+        """Finds nested output directories, and reads older feature tables"""
+        shutil.copytree(
+            os.path.join(OUTDIR, GENOMES[0]), os.path.join(self.tmpdir, "a", "new")
+        )
+        os.makedirs(os.path.join(self.tmpdir, "b", "old"))
+        with open(os.path.join(self.tmpdir, "b", "old", "OLD.tsv"), "w") as ofh:
+            ofh.write(OLD_TSV)
+        os.symlink(self.tmpdir, os.path.join(self.tmpdir, "b", "loop"))
+        self.assertEqual(
+            sorted(prokka.find_prokka_outputs(self.tmpdir)),
+            [os.path.join("a", "new"), os.path.join("b", "old")],
+        )
+        prokka.aggregate_prokka_outputs(self.tmpdir, self.outfile, workers=1)
+        table = prokka.load_annotations(self.outfile)
+        old = table["genome"].codes == 1
+        self.assertEqual(list(table["length"][old]), [prokka.UNKNOWN_LENGTH])
+        self.assertEqual(list(table["gene"].values()[old]), ["dnaA"])
+        self.assertEqual(list(table["cog"].values()[old]), [""])
+        self.assertEqual(list(table["contigs"]), [1, 0])
+
+    def test_invalid_output(self):
+        """Output directories must hold one feature table"""
+        for fname in ("one.tsv", "two.tsv"):
+            with open(os.path.join(self.tmpdir, fname), "w") as ofh:
+                ofh.write(OLD_TSV)
+        with self.assertRaises(prokka.ProkkaOutputError) as context:
+            prokka.parse_prokka_output(self.tmpdir)
+        self.assertIn("found 2", str(context.exception))
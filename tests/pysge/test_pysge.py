@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
 """Tests of SGE job submission"""
 
+import asyncio
+import base64
+import json
+import os
+import pickle
+import shlex
 import shutil
+import subprocess
+import tempfile
+import threading
 import time
 import unittest
 
@@ -9,6 +18,77 @@ import pytest
 
 from lpbio import pysge
 
+# Example output from qstat -xml, with a running job, running array tasks and
+# pending array tasks
+QSTAT_XML = """<?xml version='1.0'?>
+<job_info  xmlns:xsd="http://arc.liv.ac.uk/repos/darcs/sge/source/dist/util/resources/schemas/qstat/qstat.xsd">
+  <queue_info>
+    <job_list state="running">
+      <JB_job_number>101</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>test_job</JB_name>
+      <JB_owner>user</JB_owner>
+      <state>r</state>
+      <JAT_start_time>2018-11-02T10:00:00</JAT_start_time>
+      <queue_name>all.q@node1</queue_name>
+      <slots>1</slots>
+    </job_list>
+    <job_list state="running">
+      <JB_job_number>102</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>test_jobgroup</JB_name>
+      <JB_owner>user</JB_owner>
+      <state>r</state>
+      <JAT_start_time>2018-11-02T10:00:01</JAT_start_time>
+      <queue_name>all.q@node2</queue_name>
+      <slots>1</slots>
+      <tasks>1</tasks>
+    </job_list>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>102</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>test_jobgroup</JB_name>
+      <JB_owner>user</JB_owner>
+      <state>qw</state>
+      <JB_submission_time>2018-11-02T09:59:00</JB_submission_time>
+      <queue_name></queue_name>
+      <slots>1</slots>
+      <tasks>2-3:1</tasks>
+    </job_list>
+  </job_info>
+</job_info>
+"""
+
+# Example output from qacct -j, for two tasks of an array job
+QACCT_OUTPUT = """==============================================================
+qname        all.q
+hostname     node1
+jobname      test_jobgroup
+jobnumber    102
+taskid       1
+qsub_time    Fri Nov  2 09:59:00 2018
+start_time   Fri Nov  2 10:00:01 2018
+end_time     Fri Nov  2 10:01:01 2018
+failed       0
+exit_status  0
+ru_wallclock 60s
+cpu          58.500s
+maxvmem      1.500G
+==============================================================
+qname        all.q
+hostname     node2
+jobname      test_jobgroup
+jobnumber    102
+taskid       2
+failed       0
+exit_status  1
+ru_wallclock 5
+cpu          4.250
+maxvmem      512.000M
+"""
+
 
 class TestPysge(unittest.TestCase):
 
@@ -55,6 +135,587 @@ class TestPysge(unittest.TestCase):
         for depjob in depjobs:
             jobgroup.add_dependency(depjob)
 
+    def test_parse_qstat_xml(self):
+        """Parse job states from qstat -xml output"""
+        records = pysge.parse_qstat_xml(QSTAT_XML)
+        self.assertEqual(
+            records,
+            [
+                pysge.QstatRecord("101", "test_job", "r", None),
+                pysge.QstatRecord("102", "test_jobgroup", "r", "1"),
+                pysge.QstatRecord("102", "test_jobgroup", "qw", "2-3:1"),
+            ],
+        )
+
+    def test_parse_qacct(self):
+        """Parse per-task accounting data from qacct -j output"""
+        tasks = pysge.parse_qacct(QACCT_OUTPUT)
+        self.assertEqual(sorted(tasks), [1, 2])
+        self.assertEqual(tasks[1]["hostname"], "node1")
+        self.assertEqual(tasks[1]["start_time"], "Fri Nov  2 10:00:01 2018")
+        self.assertEqual(tasks[1]["ru_wallclock"], 60)
+        self.assertEqual(tasks[1]["maxvmem"], 1.5 * 1024 ** 3)
+        self.assertEqual(tasks[2]["cpu"], 4.25)
+        self.assertEqual(tasks[2]["maxvmem"], 512 * 1024 ** 2)
+        self.assertEqual(tasks[2]["exit_status"], 1)
+
+    def test_poller_task_times(self):
+        """Record when tasks are first seen running, and seen to finish"""
+        group = pysge.JobGroup(
+            name="test_jobgroup", command="echo", arguments={"arg": list("abc")}
+        )
+        pysge.register_job(group, "102")
+        poller = pysge.JobPoller([group])
+        poller.update(pysge.parse_qstat_xml(QSTAT_XML))
+        self.assertEqual(list(group.task_times), [1])
+        self.assertNotIn("finished", group.task_times[1])
+        poller.update([pysge.QstatRecord("102", "test_jobgroup", "r", "2")])
+        self.assertIn("finished", group.task_times[1])
+        self.assertNotIn("finished", group.task_times[2])
+        poller.update([])
+        self.assertTrue(group.finished)
+        self.assertTrue(all("finished" in times for times in group.task_times.values()))
+
+    def test_jobgraph_waves(self):
+        """Order jobs with dependencies into submission waves"""
+        jobs = [pysge.Job(name="job_{}".format(i), command="echo") for i in range(4)]
+        jobs[0].add_dependency(jobs[1])
+        jobs[0].add_dependency(jobs[2])
+        jobs[1].add_dependency(jobs[3])
+        jobs[2].add_dependency(jobs[3])
+        waves = pysge.JobGraph(jobs).waves()
+        self.assertEqual(waves, [[jobs[3]], [jobs[1], jobs[2]], [jobs[0]]])
+
+    def test_jobgraph_long_chain(self):
+        """Order a long dependency chain in linear time"""
+        jobs = [
+            pysge.Job(name="job_{}".format(i), command="echo") for i in range(100000)
+        ]
+        for job, dep in zip(jobs[:-1], jobs[1:]):
+            job.add_dependency(dep)
+        order = pysge.JobGraph(jobs).order()
+        self.assertEqual(order, jobs[::-1])
+
+    def test_simulate_jobs(self):
+        """Dry-run a workflow to estimate makespan and find the critical path"""
+        shorts = [
+            pysge.Job(name="short_{}".format(i), command="echo") for i in range(4)
+        ]
+        longs = [pysge.Job(name="long_{}".format(i), command="echo") for i in range(2)]
+        longs[1].add_dependency(longs[0])
+        runtimes = {"long_0": 3, "long_1": 3}
+        fifo = pysge.simulate_jobs(shorts + longs, 2, runtimes)
+        self.assertEqual(fifo.makespan, 8)
+        self.assertEqual(fifo.critical_path, longs)
+        self.assertEqual(fifo.critical_path_length, 6)
+        self.assertEqual((fifo.busy_slot_time, fifo.idle_slot_time), (10, 6))
+        self.assertEqual(fifo.schedule[4], (longs[0], 2, 5))
+        critical = pysge.simulate_jobs(shorts + longs, 2, runtimes, policy="critical")
+        self.assertEqual(critical.makespan, 6)
+        self.assertEqual(critical.schedule[4], (longs[0], 0, 3))
+
+    def test_simulate_jobgroup(self):
+        """Tasks of a simulated JobGroup run in parallel, as slots allow"""
+        group = pysge.JobGroup(
+            name="group", command="echo", arguments={"arg1": list("abcde")}
+        )
+        last = pysge.Job(name="last", command="echo")
+        last.add_dependency(group)
+        report = pysge.simulate_jobs([group, last], 2, {"group": 2})
+        self.assertEqual(report.schedule, [(group, 0, 6), (last, 6, 7)])
+        self.assertEqual(report.critical_path_length, 3)
+        self.assertAlmostEqual(report.utilisation, 11 / 14)
+
+    def test_assign_priorities(self):
+        """Give jobs on the longest remaining paths the highest priority"""
+        jobs = [pysge.Job(name="job_{}".format(i), command="echo") for i in range(4)]
+        jobs[1].add_dependency(jobs[0])
+        jobs[2].add_dependency(jobs[1])
+        pysge.assign_priorities(jobs)
+        self.assertEqual([job.priority for job in jobs], [0, -512, -1023, -1023])
+        pysge.assign_priorities(jobs, runtimes={"job_3": 5}, lowest=-100)
+        self.assertEqual([job.priority for job in jobs], [-50, -75, -100, 0])
+        jobs[0].scriptpath = "job_0.sh"
+        cmd = pysge.build_qsub_cmd("root", jobs[0])
+        self.assertEqual(cmd[cmd.index("-p") + 1], "-50")
+
+    def test_job_slots(self):
+        """Jobs hold their attributes in slots, not a per-instance __dict__"""
+        job = pysge.Job(name="job", command="echo")
+        group = pysge.JobGroup(name="group", command="echo")
+        for obj in (job, group):
+            self.assertFalse(hasattr(obj, "__dict__"))
+            with pytest.raises(AttributeError):
+                obj.no_such_attribute = True
+
+    def test_jobtable_roundtrip(self):
+        """Pickle a long dependency chain as a JobTable, and unpack it"""
+        jobs = [
+            pysge.Job(name="job_{}".format(i), command="echo") for i in range(100000)
+        ]
+        for job, dep in zip(jobs[:-1], jobs[1:]):
+            job.add_dependency(dep)
+        group = pysge.JobGroup(
+            name="group", command="echo $arg1", arguments={"arg1": ["a", "b"]}
+        )
+        group.add_dependency(jobs[0])
+        group.exit_codes = {1: 0, 2: 1}
+        pysge.register_job(jobs[5], "605")
+        table = pickle.loads(pickle.dumps(pysge.JobTable([group, jobs[0]])))
+        self.assertEqual(len(table), 100001)
+        unpacked = table.jobs()
+        self.assertEqual([job.name for job in unpacked], ["group", "job_0"])
+        newgroup = unpacked[0]
+        self.assertIsInstance(newgroup, pysge.JobGroup)
+        self.assertEqual(newgroup.script, group.script)
+        self.assertEqual((newgroup.tasks, newgroup.exit_codes), (2, {1: 0, 2: 1}))
+        self.assertIs(newgroup.dependencies[0], unpacked[1])
+        chain = [unpacked[1]]
+        while chain[-1].dependencies:
+            chain.append(chain[-1].dependencies[0])
+        self.assertEqual([job.name for job in chain], [job.name for job in jobs])
+        self.assertEqual((chain[5].jobid, chain[5].submitted), ("605", True))
+        self.assertIsNone(chain[5].scriptpath)
+
+    def test_jobgraph_cycle(self):
+        """Cyclic job dependencies raise an exception"""
+        jobs = [pysge.Job(name="job_{}".format(i), command="echo") for i in range(3)]
+        for job, dep in zip(jobs, jobs[1:] + jobs[:1]):
+            job.add_dependency(dep)
+        with pytest.raises(pysge.PySGEException):
+            pysge.JobGraph(jobs).waves()
+
+    def test_jobgraph_missing_dependency(self):
+        """Dependencies on jobs that will not be submitted raise an exception"""
+        job = pysge.Job(name="job", command="echo")
+        job.add_dependency(pysge.Job(name="missing", command="echo"))
+        with pytest.raises(pysge.PySGEException):
+            pysge.JobGraph([job])
+
+    def test_parse_qsub_jobid(self):
+        """Parse job IDs from qsub output"""
+        self.assertEqual(pysge.parse_qsub_jobid(b"12345\n"), "12345")
+        self.assertEqual(pysge.parse_qsub_jobid("12346.1-3:1\n"), "12346")
+        self.assertEqual(
+            pysge.parse_qsub_jobid('Your job 12347 ("job") has been submitted'),
+            "12347",
+        )
+        with pytest.raises(pysge.PySGEException):
+            pysge.parse_qsub_jobid("Unable to run job: denied")
+
+    def test_qsub_cmd_holds_by_jobid(self):
+        """Hold jobs on dependencies using their SGE job IDs"""
+        job = pysge.Job(name="job", command="echo")
+        job.scriptpath = "job.sh"
+        deps = [pysge.Job(name="dependency", command="echo") for i in range(2)]
+        for jobid, dep in zip(("101", "102"), deps):
+            pysge.register_job(dep, jobid)
+            job.add_dependency(dep)
+        cmd = pysge.build_qsub_cmd("root", job)
+        self.assertEqual(cmd[cmd.index("-hold_jid") + 1], "101,102")
+        self.assertIs(pysge.get_job(102), deps[1])
+
+    def test_async_poller_finished_jobs(self):
+        """Futures for jobs that have already finished resolve immediately"""
+        jobs = [pysge.Job(name="job_{}".format(i), command="echo") for i in range(3)]
+        for job in jobs:
+            job.finished = True
+
+        async def track():
+            poller = pysge.AsyncJobPoller(jobs)
+            await poller.wait()
+            return [poller.track(job).result() for job in jobs]
+
+        self.assertEqual(asyncio.new_event_loop().run_until_complete(track()), jobs)
+
+    def test_async_poller_qstat_error(self):
+        """Errors running qstat are passed to the job futures"""
+        job = pysge.Job(name="job", command="echo")
+
+        async def track():
+            poller = pysge.AsyncJobPoller(qstat="/nonexistent/qstat")
+            await poller.track(job)
+
+        with pytest.raises(FileNotFoundError):
+            asyncio.new_event_loop().run_until_complete(track())
+
+    def test_async_poller_tracked_during_query(self):
+        """Jobs tracked during a qstat query are not resolved from its result"""
+        first = pysge.Job(name="first", command="echo")
+        second = pysge.Job(name="second", command="echo")
+        snapshots = [[], []]  # qstat snapshots, neither of which lists a job
+
+        async def track():
+            poller = pysge.AsyncJobPoller(interval=0.01)
+
+            async def query():
+                if len(snapshots) == 2:  # second is submitted during the query
+                    poller.delay = 10
+                    poller.track(second)
+                    self.assertEqual(poller.delay, 0.01)
+                await asyncio.sleep(0)
+                return snapshots.pop()
+
+            poller.query = query
+            await poller.track(first)
+            self.assertFalse(second.finished)
+            self.assertEqual(list(poller.futures), [id(second)])
+            await poller.wait()
+            self.assertEqual(poller.futures, {})
+
+        asyncio.new_event_loop().run_until_complete(track())
+        self.assertTrue(first.finished and second.finished)
+        self.assertEqual(snapshots, [])
+
+    def test_job_registry_weak(self):
+        """The job registry does not keep submitted jobs alive"""
+        job = pysge.Job(name="job", command="echo")
+        pysge.register_job(job, "701")
+        self.assertIs(pysge.get_job("701"), job)
+        del job
+        with pytest.raises(KeyError):
+            pysge.get_job("701")
+
+    def test_run_local_jobs(self):
+        """Run Jobs and JobGroups with dependencies on the local machine"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            outfile = os.path.join(root_dir, "output", "out.txt")
+            first = pysge.Job(name="first", command="echo first > {}".format(outfile))
+            group = pysge.JobGroup(
+                name="group",
+                command="echo $arg1 >> {}".format(outfile),
+                arguments={"arg1": ["a", "b", "c"]},
+            )
+            last = pysge.Job(
+                name="last", command="echo last >> {}; exit 3".format(outfile)
+            )
+            group.add_dependency(first)
+            last.add_dependency(group)
+            pysge.build_and_run_local_jobs([last, group, first], root_dir, workers=3)
+            with open(outfile, "r") as ifh:
+                lines = ifh.read().split()
+        self.assertEqual(lines[0], "first")
+        self.assertEqual(sorted(lines[1:4]), ["a", "b", "c"])
+        self.assertEqual(lines[4], "last")
+        self.assertEqual(group.exit_codes, {1: 0, 2: 0, 3: 0})
+        self.assertEqual(last.exit_codes, {1: 3})
+        self.assertTrue(all(job.finished for job in (first, group, last)))
+
+    def test_run_local_jobs_manifest(self):
+        """Run Jobs and JobGroups from a manifest on the local machine"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            outdir = os.path.join(root_dir, "output")
+            jobs = [
+                pysge.Job(
+                    name="job_{}".format(i),
+                    command="echo \"job $1 {0}\" > {1}/job_{0}.txt".format(i, outdir),
+                )
+                for i in range(3)
+            ]
+            group = pysge.JobGroup(
+                name="group",
+                command="echo $arg1 > {}/group_$SGE_TASK_ID.txt".format(outdir),
+                arguments={"arg1": ["a", "b"]},
+            )
+            pysge.build_and_run_local_jobs(jobs + [group], root_dir, manifest=True)
+            self.assertEqual(len(os.listdir(os.path.join(root_dir, "jobs"))), 2)
+            manifest = os.path.splitext(jobs[2].scriptpath)[0] + ".tsv"
+            offset, length = map(int, jobs[2].scriptargs)
+            with open(manifest, "rb") as ifh:
+                ifh.seek(offset)
+                script = base64.b64decode(ifh.read(length)).decode("utf-8")
+            self.assertEqual(script, jobs[2].script)
+            outputs = {}
+            for fname in sorted(os.listdir(outdir)):
+                with open(os.path.join(outdir, fname), "r") as ifh:
+                    outputs[fname] = ifh.read().strip()
+        self.assertEqual(
+            outputs,
+            {
+                "group_1.txt": "a",
+                "group_2.txt": "b",
+                "job_0.txt": "job  0",
+                "job_1.txt": "job  1",
+                "job_2.txt": "job  2",
+            },
+        )
+
+    def test_sweep_tables(self):
+        """Run product and zipped parameter sweeps from sweep tables"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            outdir = os.path.join(root_dir, "output")
+            product = pysge.JobGroup(
+                name="product",
+                command="echo $foo $bar > {}/product_$SGE_TASK_ID.txt".format(outdir),
+                arguments={"foo": ["1", "2"], "bar": ["a", "b", "c"]},
+            )
+            inline_script = product.script
+            zipped = pysge.JobGroup(
+                name="zipped",
+                command='echo "$foo" $bar > {}/zipped_$SGE_TASK_ID.txt'.format(outdir),
+                arguments={"foo": [shlex.quote("x  y"), "'z'"], "bar": ["a", "b"]},
+                sweep="zip",
+            )
+            pysge.build_and_run_local_jobs([product, zipped], root_dir)
+            self.assertNotIn("_ARRAY", product.script)
+            self.assertIn("_ARRAY", inline_script)
+            outputs = {}
+            for fname in os.listdir(outdir):
+                with open(os.path.join(outdir, fname), "r") as ifh:
+                    outputs[fname] = ifh.read().strip()
+        self.assertEqual((product.tasks, zipped.tasks), (6, 2))
+        self.assertEqual(
+            [outputs["product_{}.txt".format(task)] for task in range(1, 7)],
+            ["1 a", "1 b", "1 c", "2 a", "2 b", "2 c"],
+        )
+        self.assertEqual(outputs["zipped_1.txt"], "x  y a")
+        self.assertEqual(outputs["zipped_2.txt"], "z b")
+
+    def test_large_zipped_sweep(self):
+        """Tasks of a large zipped sweep read their own values"""
+        values = [str(idx) for idx in range(200000)]
+        group = pysge.JobGroup(
+            name="large", command="echo $arg1", arguments={"arg1": values}, sweep="zip"
+        )
+        with tempfile.TemporaryDirectory() as root_dir:
+            pysge.build_directories(root_dir)
+            pysge.build_job_scripts(root_dir, [group])
+            self.assertLess(len(group.script), 1000)
+            for taskid in ("1", "123457", "200000"):
+                output = subprocess.check_output(
+                    ["bash", group.scriptpath],
+                    env=dict(os.environ, SGE_TASK_ID=taskid),
+                )
+                self.assertEqual(int(output), int(taskid) - 1)
+
+    def test_resubmitted_sweep(self):
+        """Submitting a job again does not overwrite its queued sweep tables"""
+        groups = [
+            pysge.JobGroup(
+                name="sweep", command="echo $arg1", arguments={"arg1": [arg]}
+            )
+            for arg in ("first", "second")
+        ]
+        with tempfile.TemporaryDirectory() as root_dir:
+            pysge.build_directories(root_dir)
+            for group in groups:
+                pysge.build_job_scripts(root_dir, [group])
+            self.assertNotEqual(groups[0].sweepdir, groups[1].sweepdir)
+            self.assertEqual(
+                sorted(os.listdir(groups[0].sweepdir)), ["arg1.index", "arg1.values"]
+            )
+            for group, arg in zip(groups, ("first", "second")):
+                output = subprocess.check_output(
+                    ["bash", "-c", group.script], env=dict(os.environ, SGE_TASK_ID="1")
+                )
+                self.assertEqual(output.decode().strip(), arg)
+
+    def test_zipped_sweep_lengths(self):
+        """Zipped sweeps need parameter lists of the same length"""
+        with pytest.raises(pysge.PySGEException):
+            pysge.JobGroup(
+                name="zipped",
+                command="echo",
+                arguments={"foo": ["1", "2"], "bar": ["a"]},
+                sweep="zip",
+            )
+
+    def test_sentinel_completion(self):
+        """Detect job completion and exit codes from sentinel files"""
+        job = pysge.Job(name="job", command="exit 2")
+        group = pysge.JobGroup(
+            name="group", command="echo $arg1", arguments={"arg1": ["a", "b"]}
+        )
+        with tempfile.TemporaryDirectory() as root_dir:
+            pysge.build_directories(root_dir)
+            pysge.build_job_scripts(root_dir, [job, group], sentinels=True)
+            pysge.register_job(job, "42")
+            pysge.register_job(group, "43")
+            runs = [(job, "undefined"), (group, "1"), (group, "2")]
+            for idx, (runjob, taskid) in enumerate(runs):
+                env = dict(os.environ, JOB_ID=runjob.jobid, SGE_TASK_ID=taskid)
+                subprocess.call(["bash", runjob.scriptpath], env=env)
+                active = pysge.wait_for_sentinels(
+                    [job, group], root_dir, interval=0.01, timeout=0.05
+                )
+                self.assertEqual(active, [1, 1, 0][idx])
+        self.assertEqual(job.exit_codes, {1: 2})
+        self.assertEqual(group.exit_codes, {1: 0, 2: 0})
+        self.assertTrue(job.finished and group.finished)
+        times = job.task_times[1]
+        self.assertLessEqual(int(times["started"]), times["finished"])
+
+    def test_retry_task_subset(self):
+        """Rerun only the listed tasks of a JobGroup"""
+        group = pysge.JobGroup(
+            name="group", command="exit 1", arguments={"arg1": list("abcdef")}
+        )
+        group.exit_codes = {1: 0, 2: 1, 3: 0, 4: 1, 5: 0, 6: 0}
+        self.assertEqual(pysge.failed_tasks(group), [2, 4])
+        group.taskids = pysge.failed_tasks(group)
+        group.scriptpath = "group.sh"
+        cmd = pysge.build_qsub_cmd("root", group)
+        self.assertEqual(cmd[cmd.index("-t") + 1], "2-4")
+        self.assertEqual(cmd[cmd.index("-v") + 1], "PYSGE_TASKS=:2:4:")
+
+        with tempfile.TemporaryDirectory() as root_dir:
+            pysge.build_directories(root_dir)
+            pysge.build_job_scripts(root_dir, [group], sentinels=True)
+            for taskid in ("2", "3", "4"):
+                env = dict(
+                    os.environ, JOB_ID="301", SGE_TASK_ID=taskid, PYSGE_TASKS=":2:4:"
+                )
+                subprocess.call(["bash", group.scriptpath], env=env)
+            sentinels = sorted(os.listdir(os.path.join(root_dir, "status")))
+        self.assertEqual(sentinels, ["301.2", "301.4"])
+
+    def test_retry_requires_sentinels(self):
+        """Retries are refused unless completion is tracked with sentinels"""
+        job = pysge.Job(name="job", command="echo")
+        with pytest.raises(pysge.PySGEException):
+            pysge.build_and_submit_jobs(job, wait=True, retries=2)
+
+    def test_bundle_jobs(self):
+        """Bundle short jobs by dependency wave, and run them locally"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            outfile = os.path.join(root_dir, "output", "out.txt")
+            first = [
+                pysge.Job(name="first_{}".format(i), command="echo a >> " + outfile)
+                for i in range(5)
+            ]
+            last = pysge.Job(
+                name="last", command="echo b >> {}; exit 2".format(outfile)
+            )
+            for job in first:
+                last.add_dependency(job)
+            bundles = pysge.bundle_jobs(
+                first + [last], target_duration=2, runtimes={"first_0": 3}, width=2
+            )
+            self.assertEqual(
+                [[job.name for job in bundle.members] for bundle in bundles],
+                [["first_0", "first_1"], ["first_2", "first_3", "first_4"], ["last"]],
+            )
+            self.assertEqual(bundles[2].dependencies, bundles[:2])
+            pysge.build_and_run_local_jobs(bundles, root_dir)
+            with open(outfile, "r") as ifh:
+                self.assertEqual(ifh.read().split(), ["a"] * 5 + ["b"])
+        self.assertEqual(
+            [bundle.exit_codes for bundle in bundles], [{1: 0}, {1: 0}, {1: 1}]
+        )
+
+    def test_local_timing_report(self):
+        """Write a timing report for jobs run on the local machine"""
+        group = pysge.JobGroup(
+            name="group", command="sleep 0.$arg1", arguments={"arg1": ["1", "2"]}
+        )
+        with tempfile.TemporaryDirectory() as root_dir:
+            pysge.build_and_run_local_jobs(group, root_dir, timing=True)
+            with open(os.path.join(root_dir, pysge.TIMING_FILENAME), "r") as ifh:
+                rows = json.load(ifh)["tasks"]
+        self.assertEqual(
+            [(row["name"], row["task"]) for row in rows], [("group", 1), ("group", 2)]
+        )
+        for row, duration in zip(rows, (0.1, 0.2)):
+            self.assertGreaterEqual(row["run_time"], duration)
+            self.assertGreaterEqual(row["queue_wait"], 0)
+            self.assertEqual(row["exit_code"], 0)
+
+    def test_max_running_tasks(self):
+        """Limit the number of concurrent array tasks with qsub -tc"""
+        group = pysge.JobGroup(
+            name="group",
+            command="echo",
+            arguments={"arg1": list("abcd")},
+            max_running=2,
+        )
+        group.scriptpath = "group.sh"
+        cmd = pysge.build_qsub_cmd("root", group)
+        self.assertEqual(cmd[cmd.index("-tc") + 1], "2")
+
+    def test_throttle_in_flight(self):
+        """Release jobs for submission only as earlier jobs finish"""
+        jobs = [pysge.Job(name="job_{}".format(i), command="echo") for i in range(3)]
+        with tempfile.TemporaryDirectory() as root_dir:
+            pysge.build_directories(root_dir)
+            throttle = pysge.build_throttle(root_dir, sentinels=True, max_in_flight=2)
+            throttle.max_interval = 0.01
+            for jobid, job in enumerate(jobs[:2], 501):
+                throttle.wait()
+                pysge.register_job(job, str(jobid))
+                throttle.track(job)
+            self.assertEqual(throttle.in_flight, 2)
+
+            def finish():
+                """Write a sentinel file for the second job"""
+                with open(os.path.join(root_dir, "status", "502.1"), "w") as ofh:
+                    ofh.write("0\n")
+
+            finisher = threading.Timer(0.1, finish)
+            start = time.time()
+            finisher.start()
+            throttle.wait()
+            finisher.join()
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        self.assertEqual(throttle.in_flight, 1)
+        self.assertTrue(jobs[1].finished)
+
+    def test_throttle_rate(self):
+        """Limit the rate of qsub calls"""
+        throttle = pysge.SubmissionThrottle(rate=50)
+        start = time.time()
+        for _ in range(6):
+            throttle.wait()
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_journal_load(self):
+        """Record job submissions and completions in a journal"""
+        jobs = [pysge.Job(name="job_{}".format(i), command="echo") for i in range(3)]
+        jobs[1].add_dependency(jobs[0])
+        with tempfile.TemporaryDirectory() as root_dir:
+            with pysge.SubmissionJournal(root_dir) as journal:
+                for jobid, job in enumerate(jobs, 101):
+                    pysge.register_job(job, str(jobid))
+                    journal.record_submitted(job)
+                jobs[0].exit_codes = {1: 0}
+                journal.record_finished(jobs[0])
+            # Simulate an incomplete final line, from a crash
+            with open(os.path.join(root_dir, pysge.JOURNAL_FILENAME), "a") as ofh:
+                ofh.write('{"event": "fini')
+            states = pysge.SubmissionJournal(root_dir).load()
+        for state in states.values():
+            self.assertLess(time.time() - state.pop("submit_time"), 60)
+        self.assertEqual(
+            states,
+            {
+                "job_0": {"jobid": "101", "finished": True, "exit_codes": {1: 0}},
+                "job_1": {"jobid": "102", "finished": False, "exit_codes": {}},
+                "job_2": {"jobid": "103", "finished": False, "exit_codes": {}},
+            },
+        )
+
+    def test_resume_jobs(self):
+        """Reattach to journalled jobs instead of submitting them again"""
+        with tempfile.TemporaryDirectory() as root_dir:
+            pysge.build_directories(root_dir)
+            with pysge.SubmissionJournal(root_dir) as journal:
+                for jobid, name in ((201, "first"), (202, "second")):
+                    job = pysge.Job(name=name, command="echo")
+                    pysge.register_job(job, str(jobid))
+                    journal.record_submitted(job)
+            with open(os.path.join(root_dir, "status", "202.1"), "w") as ofh:
+                ofh.write("0\n")
+            jobs = [
+                pysge.Job(name=name, command="echo") for name in ("first", "second")
+            ]
+            jobs[1].add_dependency(jobs[0])
+            for jobid in ("201", "202"):
+                pysge.JOB_REGISTRY.pop(jobid, None)
+            submitted = pysge.resume_jobs(jobs, root_dir, sentinels=True)
+        self.assertEqual(submitted, [])
+        self.assertEqual([job.jobid for job in jobs], ["201", "202"])
+        self.assertEqual([job.finished for job in jobs], [False, True])
+        self.assertIs(pysge.get_job("201"), jobs[0])
+
     @pytest.mark.skipif(
         shutil.which(pysge.QSUB_DEFAULT) is None,
         reason="qsub executable ({}) could not be found".format(pysge.QSUB_DEFAULT),
@@ -141,3 +802,87 @@ class TestPysge(unittest.TestCase):
         for depjob in depjobs:
             jobgroup.add_dependency(depjob)
         pysge.build_and_submit_jobs([jobgroup] + depjobs)
+
+    @pytest.mark.skipif(
+        shutil.which(pysge.QSUB_DEFAULT) is None,
+        reason="qsub executable ({}) could not be found".format(pysge.QSUB_DEFAULT),
+    )
+    def test_create_run_jobs_wait(self):
+        """Create and run Jobs, polling SGE together until they finish"""
+        jobs = [
+            pysge.Job(
+                name="test_run_jobs_wait_{}".format(i),
+                command="echo {}".format(time.asctime()),
+            )
+            for i in range(3)
+        ]
+        pysge.build_and_submit_jobs(jobs, wait=True, max_interval=1)
+        self.assertTrue(all(job.finished for job in jobs))
+        self.assertTrue(all(pysge.get_job(job.jobid) is job for job in jobs))
+
+    @pytest.mark.skipif(
+        shutil.which(pysge.QSUB_DEFAULT) is None,
+        reason="qsub executable ({}) could not be found".format(pysge.QSUB_DEFAULT),
+    )
+    def test_create_run_jobs_concurrent(self):
+        """Create and run Jobs with dependencies, submitting concurrently"""
+        job = pysge.Job(name="test_run_jobs_concurrent", command="echo done")
+        depjobs = [
+            pysge.Job(
+                name="test_run_jobs_concurrent_{}".format(i),
+                command="echo {}".format(time.asctime()),
+            )
+            for i in range(10)
+        ]
+        for depjob in depjobs:
+            job.add_dependency(depjob)
+        pysge.build_and_submit_jobs([job] + depjobs, workers=4)
+        self.assertTrue(all(depjob.jobid is not None for depjob in depjobs))
+
+    @pytest.mark.skipif(
+        shutil.which(pysge.QSUB_DEFAULT) is None,
+        reason="qsub executable ({}) could not be found".format(pysge.QSUB_DEFAULT),
+    )
+    def test_create_run_jobgroup_retries(self):
+        """Create and run a JobGroup, retrying tasks that fail the first time"""
+        with tempfile.TemporaryDirectory(dir=os.curdir) as root_dir:
+            marker = os.path.abspath(os.path.join(root_dir, "output", "task_"))
+            jobgroup = pysge.JobGroup(
+                name="test_run_jobgroup_retries",
+                command="[ -e {0}$arg1 ] || {{ touch {0}$arg1; exit 1; }}".format(
+                    marker
+                ),
+                arguments={"arg1": ["a", "b", "c"]},
+            )
+            pysge.build_and_submit_jobs(
+                jobgroup,
+                root_dir,
+                wait=True,
+                max_interval=1,
+                sentinels=True,
+                retries=1,
+                backoff=0,
+            )
+        self.assertEqual(jobgroup.exit_codes, {1: 0, 2: 0, 3: 0})
+
+    @pytest.mark.skipif(
+        shutil.which(pysge.QSUB_DEFAULT) is None,
+        reason="qsub executable ({}) could not be found".format(pysge.QSUB_DEFAULT),
+    )
+    def test_create_run_jobs_async(self):
+        """Create and run Jobs from an asyncio event loop"""
+        jobs = [
+            pysge.Job(
+                name="test_run_jobs_async_{}".format(i),
+                command="echo {}".format(time.asctime()),
+            )
+            for i in range(3)
+        ]
+
+        async def run():
+            futures = await pysge.async_build_and_submit_jobs(
+                jobs, max_interval=1, workers=3
+            )
+            return await asyncio.gather(*futures)
+
+        self.assertEqual(asyncio.new_event_loop().run_until_complete(run()), jobs)